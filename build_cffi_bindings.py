@@ -9,6 +9,7 @@ ffibuilder.set_source(
 #include <vpx/vpx_encoder.h>
 #include <vpx/vp8cx.h>
 #include <vpx/vp8dx.h>
+#include <string.h>
 
 #undef vpx_codec_dec_init
 #undef vpx_codec_enc_init
@@ -28,6 +29,43 @@ vpx_codec_err_t vpx_codec_enc_init(vpx_codec_ctx_t *ctx,
 {
     return vpx_codec_enc_init_ver(ctx, iface, cfg, flags, VPX_ENCODER_ABI_VERSION);
 }
+
+void vpx_rtp_copy_plane(void *dst, int dst_stride,
+                        const void *src, int src_stride,
+                        unsigned int width, unsigned int height)
+{
+    unsigned char *o = dst;
+    const unsigned char *i = src;
+
+    if (dst_stride == src_stride) {
+        memcpy(o, i, (size_t)dst_stride * height);
+        return;
+    }
+    for (unsigned int row = 0; row < height; row++) {
+        memcpy(o, i, width);
+        o += dst_stride;
+        i += src_stride;
+    }
+}
+
+void vpx_rtp_split_uv(void *u, void *v, int dst_stride,
+                      const void *uv, int src_stride,
+                      unsigned int width, unsigned int height)
+{
+    unsigned char *ou = u;
+    unsigned char *ov = v;
+    const unsigned char *i = uv;
+
+    for (unsigned int row = 0; row < height; row++) {
+        for (unsigned int col = 0; col < width; col++) {
+            ou[col] = i[2 * col];
+            ov[col] = i[2 * col + 1];
+        }
+        ou += dst_stride;
+        ov += dst_stride;
+        i += src_stride;
+    }
+}
     """,
     libraries=["vpx"],
 )
@@ -36,7 +74,10 @@ ffibuilder.cdef(
     """
 #define VPX_CODEC_USE_OUTPUT_PARTITION 0x20000
 #define VPX_DL_REALTIME 1
+#define VPX_DL_GOOD_QUALITY 1000000
+#define VPX_DL_BEST_QUALITY 0
 #define VPX_EFLAG_FORCE_KF 1
+#define VPX_ERROR_RESILIENT_DEFAULT ...
 
 #define VPX_FRAME_IS_KEY 0x1
 #define VPX_FRAME_IS_DROPPABLE 0x2
@@ -49,11 +90,31 @@ ffibuilder.cdef(
 #define VPX_PLANE_V 2
 #define VPX_PLANE_ALPHA 3
 
+#define VP8_EFLAG_NO_REF_LAST ...
+#define VP8_EFLAG_NO_REF_GF ...
+#define VP8_EFLAG_NO_REF_ARF ...
+#define VP8_EFLAG_NO_UPD_LAST ...
+#define VP8_EFLAG_NO_UPD_GF ...
+#define VP8_EFLAG_NO_UPD_ARF ...
+#define VP8_EFLAG_NO_UPD_ENTROPY ...
+
 #define VP8_SET_POSTPROC 3
 #define VP8E_SET_CPUUSED 13
 #define VP8E_SET_NOISE_SENSITIVITY 15
 #define VP8E_SET_STATIC_THRESHOLD 17
 #define VP8E_SET_TOKEN_PARTITIONS 18
+#define VP8E_SET_TEMPORAL_LAYER_ID ...
+#define VP9E_SET_TILE_COLUMNS ...
+#define VP9E_SET_FRAME_PARALLEL_DECODING ...
+#define VP9E_SET_AQ_MODE ...
+#define VP9E_SET_ROW_MT ...
+#define VP9E_SET_SVC ...
+#define VP9E_SET_SVC_PARAMETERS ...
+#define VP9E_GET_SVC_LAYER_ID ...
+
+#define VP9E_TEMPORAL_LAYERING_MODE_NOLAYERING ...
+#define VP9E_TEMPORAL_LAYERING_MODE_0101 ...
+#define VP9E_TEMPORAL_LAYERING_MODE_0212 ...
 
 typedef enum {
   VPX_CODEC_OK,
@@ -79,6 +140,7 @@ typedef enum vpx_img_fmt {
 } vpx_img_fmt_t;
 
 typedef long vpx_codec_flags_t;
+typedef uint32_t vpx_codec_er_flags_t;
 typedef uint32_t vpx_codec_frame_flags_t;
 typedef long vpx_enc_frame_flags_t;
 typedef const void *vpx_codec_iter_t;
@@ -117,6 +179,7 @@ typedef struct vpx_codec_enc_cfg {
   unsigned int g_w;
   unsigned int g_h;
   struct vpx_rational g_timebase;
+  vpx_codec_er_flags_t g_error_resilient;
   unsigned int g_lag_in_frames;
 
   unsigned int rc_resize_allowed;
@@ -132,6 +195,16 @@ typedef struct vpx_codec_enc_cfg {
 
   enum vpx_kf_mode kf_mode;
   unsigned int kf_max_dist;
+
+  unsigned int ss_number_layers;
+  unsigned int ss_target_bitrate[...];
+  unsigned int ts_number_layers;
+  unsigned int ts_target_bitrate[...];
+  unsigned int ts_rate_decimator[...];
+  unsigned int ts_periodicity;
+  unsigned int ts_layer_id[...];
+  unsigned int layer_target_bitrate[...];
+  int temporal_layering_mode;
   ...;
 } vpx_codec_enc_cfg_t;
 
@@ -195,6 +268,21 @@ typedef enum {
   VP8_EIGHT_TOKENPARTITION = 3
 } vp8e_token_partitions;
 
+typedef struct vpx_svc_parameters {
+  int max_quantizers[...];
+  int min_quantizers[...];
+  int scaling_factor_num[...];
+  int scaling_factor_den[...];
+  int temporal_layering_mode;
+  ...;
+} vpx_svc_extra_cfg_t;
+
+typedef struct vpx_svc_layer_id {
+  int spatial_layer_id;
+  int temporal_layer_id;
+  ...;
+} vpx_svc_layer_id_t;
+
 typedef struct vp8_postproc_cfg {
   int post_proc_flag;
   int deblocking_level;
@@ -249,6 +337,13 @@ void vpx_img_free(vpx_image_t *img);
 vpx_image_t *vpx_img_wrap(vpx_image_t *img, vpx_img_fmt_t fmt, unsigned int d_w,
                           unsigned int d_h, unsigned int align,
                           unsigned char *img_data);
+
+void vpx_rtp_copy_plane(void *dst, int dst_stride,
+                        const void *src, int src_stride,
+                        unsigned int width, unsigned int height);
+void vpx_rtp_split_uv(void *u, void *v, int dst_stride,
+                      const void *uv, int src_stride,
+                      unsigned int width, unsigned int height);
 """
 )
 
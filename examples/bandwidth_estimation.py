@@ -0,0 +1,206 @@
+"""
+Simulates a sender over a bottleneck link whose capacity changes, and prints how
+the target bitrate follows the capacity. By default the sender uses a
+SendSideBandwidthEstimator with transport-wide congestion control feedback sent
+back every 100 ms; with --remb it follows the REMBs of a RemoteBitrateEstimator
+at the receiver, which uses abs-send-time.
+
+The simulation runs in 1 ms steps and does not need libvpx: frames are random
+bytes of the size the encoder would produce at the target bitrate.
+"""
+
+import argparse
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from vpx_rtp.rate import RemoteBitrateEstimator, SendSideBandwidthEstimator
+from vpx_rtp.rtcp import (
+    RtcpPsfbPacket,
+    RtcpRtpfbPacket,
+    RtcpTransportFeedback,
+    pack_remb_fci,
+    parse_rtcp,
+    unpack_remb_fci,
+)
+from vpx_rtp.rtp import RTCP_PSFB_APP, RTCP_RTPFB_TRANSPORT_CC
+from vpx_rtp.utils import uint16_add
+
+DURATION = 60000  # ms
+FRAME_INTERVAL = 1000 / 30
+PACKET_SIZE = 1200
+PACING_FACTOR = 2.5
+PROPAGATION_DELAY = 25  # ms each way
+QUEUE_DELAY_MAX = 300  # ms of data the bottleneck buffers before dropping
+FEEDBACK_INTERVAL = 100  # ms
+START_BITRATE = 300000
+
+# link capacity in bits per second from each time in ms
+CAPACITY = [(0, 2000000), (20000, 800000), (40000, 1500000)]
+
+
+def capacity_at(now: int) -> int:
+    return [capacity for start, capacity in CAPACITY if start <= now][-1]
+
+
+def transport_feedback(
+    base_sequence_number: int,
+    arrivals: List[Optional[int]],
+    feedback_packet_count: int,
+) -> bytes:
+    """
+    Build transport feedback for arrival times in microseconds, or None for lost
+    packets, as serialized RTCP.
+    """
+    reference_time = min(x for x in arrivals if x is not None) // 64000
+    time = reference_time * 64000
+    deltas: List[Optional[int]] = []
+    for arrival in arrivals:
+        if arrival is None:
+            deltas.append(None)
+        else:
+            delta = round((arrival - time) / 250)
+            deltas.append(delta)
+            time += delta * 250
+    packet = RtcpRtpfbPacket(
+        fmt=RTCP_RTPFB_TRANSPORT_CC,
+        ssrc=1,
+        media_ssrc=2,
+        transport_feedback=RtcpTransportFeedback(
+            base_sequence_number=base_sequence_number,
+            reference_time=reference_time,
+            feedback_packet_count=feedback_packet_count,
+            deltas=deltas,
+        ),
+    )
+    return bytes(packet)
+
+
+def abs_send_time(now: int) -> int:
+    return (now << 18) // 1000 & 0xFFFFFF
+
+
+def simulate(remb: bool) -> None:
+    estimator = SendSideBandwidthEstimator(START_BITRATE)
+    remote_estimator = RemoteBitrateEstimator()
+    target_bitrate = START_BITRATE
+
+    send_queue: Deque[int] = deque()  # packet sizes waiting for the pacer
+    pacer_budget = 0.0
+    sequence_number = 0
+
+    # sequence number, size and send time
+    link_queue: Deque[Tuple[int, int, int]] = deque()
+    link_queued = 0
+    link_budget = 0.0
+
+    # arrival time, sequence number, size and send time
+    in_flight: Deque[Tuple[int, int, int, int]] = deque()
+    received: List[Tuple[int, int]] = []  # sequence number and arrival time
+    feedback_queue: Deque[Tuple[int, bytes]] = deque()  # delivery time and RTCP
+    feedback_count = 0
+    next_feedback_sequence_number = 0
+
+    next_frame = 0.0
+    dropped = 0
+    print(f"{'time':>6} {'capacity':>10} {'target':>10} {'queue':>8} {'dropped':>8}")
+    for now in range(DURATION):
+        # the encoder produces a frame at the target bitrate
+        if now >= next_frame:
+            size = target_bitrate // 30 // 8
+            while size > 0:
+                send_queue.append(min(size, PACKET_SIZE))
+                size -= PACKET_SIZE
+            next_frame += FRAME_INTERVAL
+
+        # the pacer sends at a multiple of the target bitrate
+        pacer_budget = min(
+            pacer_budget + target_bitrate * PACING_FACTOR / 8000, 4 * PACKET_SIZE
+        )
+        while send_queue and pacer_budget >= send_queue[0]:
+            size = send_queue.popleft()
+            pacer_budget -= size
+            estimator.on_packet_sent(sequence_number, size, now)
+            capacity = capacity_at(now)
+            if link_queued + size > capacity * QUEUE_DELAY_MAX / 8000:
+                dropped += 1
+            else:
+                link_queue.append((sequence_number, size, now))
+                link_queued += size
+            sequence_number = uint16_add(sequence_number, 1)
+
+        # the bottleneck drains at its capacity
+        link_budget += capacity_at(now) / 8000
+        while link_queue and link_budget >= link_queue[0][1]:
+            seq, size, sent = link_queue.popleft()
+            link_budget -= size
+            link_queued -= size
+            in_flight.append((now + PROPAGATION_DELAY, seq, size, sent))
+        if not link_queue:
+            link_budget = 0.0
+
+        while in_flight and in_flight[0][0] <= now:
+            arrival, seq, size, sent = in_flight.popleft()
+            if remb:
+                result = remote_estimator.add(arrival, abs_send_time(sent), size, 2)
+                if result is not None:
+                    remb_packet = RtcpPsfbPacket(
+                        fmt=RTCP_PSFB_APP,
+                        ssrc=1,
+                        media_ssrc=0,
+                        fci=pack_remb_fci(*result),
+                    )
+                    feedback_queue.append((now + PROPAGATION_DELAY, bytes(remb_packet)))
+            else:
+                received.append((seq, arrival))
+
+        # the receiver reports arrivals, including gaps for lost packets
+        if now % FEEDBACK_INTERVAL == 0 and received:
+            arrivals_by_seq = dict(received)
+            last = received[-1][0]
+            count = uint16_add(last, -next_feedback_sequence_number) + 1
+            arrivals = [
+                arrivals_by_seq.get(uint16_add(next_feedback_sequence_number, i))
+                for i in range(count)
+            ]
+            arrivals = [None if x is None else x * 1000 for x in arrivals]
+            feedback_queue.append(
+                (
+                    now + PROPAGATION_DELAY,
+                    transport_feedback(
+                        next_feedback_sequence_number, arrivals, feedback_count
+                    ),
+                )
+            )
+            feedback_count += 1
+            next_feedback_sequence_number = uint16_add(last, 1)
+            received.clear()
+
+        while feedback_queue and feedback_queue[0][0] <= now:
+            for feedback in parse_rtcp(feedback_queue.popleft()[1]):
+                if isinstance(feedback, RtcpPsfbPacket):
+                    target_bitrate = unpack_remb_fci(feedback.fci)[0]
+                else:
+                    assert isinstance(feedback, RtcpRtpfbPacket)
+                    assert feedback.transport_feedback is not None
+                    bitrate = estimator.on_transport_feedback(
+                        feedback.transport_feedback, now
+                    )
+                    if bitrate is not None:
+                        target_bitrate = bitrate
+
+        if now % 1000 == 0:
+            queue_delay = link_queued * 8000 / capacity_at(now)
+            print(
+                f"{now / 1000:>5.0f}s {capacity_at(now) / 1000:>7.0f}kbps "
+                f"{target_bitrate / 1000:>7.0f}kbps {queue_delay:>6.0f}ms "
+                f"{dropped:>8}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--remb", action="store_true", help="estimate the bitrate at the receiver"
+    )
+    args = parser.parse_args()
+    simulate(remb=args.remb)
@@ -0,0 +1,71 @@
+"""
+Benchmark of EncoderFarm throughput: how many low resolution streams can be
+sustained at 30 fps for a growing number of worker processes.
+"""
+
+import os
+import time
+from typing import List
+
+import numpy as np
+
+from vpx_rtp.codecs.farm import EncoderFarm, i420_size
+from vpx_rtp.codecs.vpx import VIDEO_CLOCK_RATE
+
+WIDTH, HEIGHT = 320, 180
+FPS = 30
+STREAMS = 64
+FRAMES_PER_STREAM = 90
+
+
+def generate_frames(count: int) -> List[bytes]:
+    """
+    Moving gradients as contiguous I420 images.
+    """
+    x = np.arange(WIDTH, dtype=np.uint16)
+    y = np.arange(HEIGHT, dtype=np.uint16)[:, np.newaxis]
+    chroma_size = i420_size(WIDTH, HEIGHT) - WIDTH * HEIGHT
+    frames = []
+    for index in range(count):
+        luma = ((x + y + 4 * index) & 0xFF).astype(np.uint8)
+        chroma = np.full(chroma_size, 128, dtype=np.uint8)
+        frames.append(luma.tobytes() + chroma.tobytes())
+    return frames
+
+
+def frames_per_second(workers: int, frames: List[bytes]) -> float:
+    farm = EncoderFarm(workers=workers)
+    for stream_id in range(STREAMS):
+        farm.add_stream(stream_id, WIDTH, HEIGHT, target_bitrate=300000)
+
+    start = time.perf_counter()
+    received = 0
+    for index in range(FRAMES_PER_STREAM):
+        for stream_id in range(STREAMS):
+            farm.frame_buffer(stream_id)[:] = frames[(index + stream_id) % len(frames)]
+            farm.submit(
+                stream_id,
+                pts=index * VIDEO_CLOCK_RATE // FPS,
+                force_keyframe=index == 0,
+            )
+        while farm.get(timeout=0) is not None:
+            received += 1
+    while received < STREAMS * FRAMES_PER_STREAM:
+        farm.get()
+        received += 1
+    elapsed = time.perf_counter() - start
+
+    farm.close()
+    return received / elapsed
+
+
+if __name__ == "__main__":
+    frames = generate_frames(FPS)
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, 16, cpus} & set(range(1, cpus + 1)))
+
+    print(f"{WIDTH}x{HEIGHT}, {STREAMS} streams, {FRAMES_PER_STREAM} frames each")
+    print(f"{'workers':>8} {'frames/s':>10} {f'streams@{FPS}fps':>14}")
+    for workers in worker_counts:
+        rate = frames_per_second(workers, frames)
+        print(f"{workers:>8} {rate:>10,.0f} {rate / FPS:>14.1f}")
@@ -0,0 +1,137 @@
+"""
+Micro-benchmark of JitterBuffer.add throughput (packets/sec) against the previous
+implementation, which rescanned the ring from its origin on every packet.
+"""
+
+import time
+from typing import List, Optional, Tuple
+
+from vpx_rtp.jitterbuffer import MAX_MISORDER, JitterBuffer, JitterFrame
+from vpx_rtp.rtp import RtpPacket
+from vpx_rtp.utils import uint16_add
+
+CAPACITY = 512
+TOTAL_PACKETS = 50000
+PACKETS_PER_FRAME = [1, 10, 50, 100, 200]
+
+
+class LegacyJitterBuffer:
+    """
+    The JitterBuffer as it was before frame state was tracked incrementally.
+    """
+
+    def __init__(
+        self, capacity: int, prefetch: int = 0, is_video: bool = False
+    ) -> None:
+        self._capacity = capacity
+        self._origin: Optional[int] = None
+        self._packets: List[Optional[RtpPacket]] = [None for i in range(capacity)]
+        self._prefetch = prefetch
+        self._is_video = is_video
+
+    def add(self, packet: RtpPacket) -> Tuple[bool, Optional[JitterFrame]]:
+        pli_flag = False
+        if self._origin is None:
+            self._origin = packet.sequence_number
+            delta = 0
+            misorder = 0
+        else:
+            delta = uint16_add(packet.sequence_number, -self._origin)
+            misorder = uint16_add(self._origin, -packet.sequence_number)
+
+        if misorder < delta:
+            if misorder >= MAX_MISORDER:
+                self.remove(self._capacity)
+                self._origin = packet.sequence_number
+                delta = misorder = 0
+                if self._is_video:
+                    pli_flag = True
+            else:
+                return pli_flag, None
+
+        pos = packet.sequence_number % self._capacity
+        self._packets[pos] = packet
+
+        return pli_flag, self._remove_frame(packet.sequence_number)
+
+    def _remove_frame(self, sequence_number: int) -> Optional[JitterFrame]:
+        frame = None
+        frames = 0
+        packets = []
+        remove = 0
+        timestamp = None
+
+        assert self._origin is not None, "origin must be set"
+
+        for count in range(self._capacity):
+            pos = (self._origin + count) % self._capacity
+            packet = self._packets[pos]
+            if packet is None:
+                break
+            if timestamp is None:
+                timestamp = packet.timestamp
+            elif packet.timestamp != timestamp:
+                if frame is None:
+                    frame = JitterFrame(
+                        data=b"".join([x._data for x in packets]),
+                        timestamp=timestamp,
+                        sequence_numbers=[x.sequence_number for x in packets],
+                    )
+                    remove = count
+
+                frames += 1
+                if frames >= self._prefetch:
+                    self.remove(remove)
+                    return frame
+
+                packets = []
+                timestamp = packet.timestamp
+
+            packets.append(packet)
+
+        return None
+
+    def remove(self, count: int) -> None:
+        assert self._origin is not None, "origin must be set"
+        for _ in range(count):
+            pos = self._origin % self._capacity
+            self._packets[pos] = None
+            self._origin = uint16_add(self._origin, 1)
+
+
+def generate_packets(packets_per_frame: int) -> List[RtpPacket]:
+    packets = []
+    for i in range(TOTAL_PACKETS):
+        packet = RtpPacket(
+            sequence_number=i & 0xFFFF,
+            timestamp=(i // packets_per_frame) * 3000,
+            marker=int(i % packets_per_frame == packets_per_frame - 1),
+        )
+        packet._data = b"\x00" * 1200
+        packets.append(packet)
+    return packets
+
+
+def packets_per_second(
+    jitter_buffer: JitterBuffer | LegacyJitterBuffer, packets: List[RtpPacket]
+) -> float:
+    start = time.perf_counter()
+    for packet in packets:
+        jitter_buffer.add(packet)
+    return len(packets) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(f"{'packets/frame':>14} {'legacy pkt/s':>14} {'current pkt/s':>14} speedup")
+    for packets_per_frame in PACKETS_PER_FRAME:
+        packets = generate_packets(packets_per_frame)
+        legacy = packets_per_second(
+            LegacyJitterBuffer(capacity=CAPACITY, is_video=True), packets
+        )
+        current = packets_per_second(
+            JitterBuffer(capacity=CAPACITY, is_video=True), packets
+        )
+        print(
+            f"{packets_per_frame:>14} {legacy:>14,.0f} {current:>14,.0f} "
+            f"{current / legacy:6.1f}x"
+        )
@@ -1,33 +1,42 @@
 import random
 import time
 from pathlib import Path
+from typing import cast
 
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 from av import VideoFrame
 
-from vpx_rtp.clock import current_ntp_time
 from vpx_rtp.codecs.vpx import (
     VIDEO_CLOCK_RATE,
-    VIDEO_TIME_BASE,
+    FrameDecodabilityTracker,
     Vp8Decoder,
     Vp8Encoder,
+    Vp9PayloadDescriptor,
     VpxCodec,
+    VpxPayloadDescriptor,
     vp8_depayload,
+    vp8_frame_start,
+    vp9_depayload,
+    vp9_frame_start,
 )
+from vpx_rtp.fec import FlexFecDecoder, FlexFecEncoder
 from vpx_rtp.jitterbuffer import JitterBuffer
-from vpx_rtp.rtp import RtpPacket
-from vpx_rtp.utils import random16, random32, uint16_add
+from vpx_rtp.rtp import RtpPacket, RtpSender
 
 DUCK_JPEG_PATH = Path(__file__).parent / "duck.jpg"
 
 VIDEO_PTIME = 1 / 30  # 30fps
 DROPPED_PACKET_PERCENTAGE = 0
+FLEXFEC_PAYLOAD_TYPE = 120
 
 
-def generate_flag_frames() -> list[VideoFrame]:
-    height, width = 480, 640
+HEIGHT, WIDTH = 480, 640
+
+
+def generate_flag_frames() -> list[np.ndarray]:
+    height, width = HEIGHT, WIDTH
 
     duck_np_array = cv2.imread(str(DUCK_JPEG_PATH))
     data_bgr = cv2.resize(duck_np_array, (width, height))
@@ -47,27 +56,51 @@ def generate_flag_frames() -> list[VideoFrame]:
         map_x = id_x + 10 * np.cos(omega * id_x + phase)
         map_y = id_y + 10 * np.sin(omega * id_x + phase)
         frames.append(
-            VideoFrame.from_ndarray(
-                cv2.remap(data_bgr, map_x, map_y, cv2.INTER_LINEAR).astype(np.uint8),
-                format="bgr24",
-            )
+            cv2.remap(data_bgr, map_x, map_y, cv2.INTER_LINEAR).astype(np.uint8)
         )
 
     return frames
 
 
+def is_keyframe(payload: bytes | memoryview) -> bool:
+    """
+    Whether the first payload of a frame, after its headroom, is of a keyframe,
+    including those libvpx inserts on its own.
+    """
+    if codec == VpxCodec.VP9:
+        return not Vp9PayloadDescriptor.parse(payload)[0].inter_picture_predicted
+    data = VpxPayloadDescriptor.parse(payload)[1]
+    # the P bit of the VP8 payload header is clear on keyframes
+    return bool(data) and not data[0] & 0x01
+
+
 DUCK_FLAG_FRAMES = generate_flag_frames()
 
 codec = VpxCodec.VP9
+depayload, frame_start = (
+    (vp9_depayload, vp9_frame_start)
+    if codec == VpxCodec.VP9
+    else (vp8_depayload, vp8_frame_start)
+)
 
 video_encoder = Vp8Encoder(codec, target_bitrate=200000)
 video_decoder = Vp8Decoder(codec)
 
 pts_timestamp = 0
-_ssrc = random32()
-sequence_number = random16()
+rtp_sender = RtpSender(payload_type=codec.value.payloadType)
+
+# repair packets let lost packets be recovered without waiting for a keyframe
+fec_encoder = FlexFecEncoder(payload_type=FLEXFEC_PAYLOAD_TYPE)
+fec_decoder = FlexFecDecoder(payload_type=FLEXFEC_PAYLOAD_TYPE)
+
+# frames are converted from BGR into this one buffer, which is encoded in place
+i420_buffer = np.empty((HEIGHT * 3 // 2, WIDTH), dtype=np.uint8)
 
-_jitter_buffer = JitterBuffer(capacity=128, is_video=True)
+_jitter_buffer = JitterBuffer(capacity=128, is_video=True, frame_start=frame_start)
+
+# frames which depend on a lost frame are skipped until the requested keyframe
+decodability_tracker = FrameDecodabilityTracker(codec)
+keyframe_requested = False
 
 received_frame_num = 0
 max_simulated_time = 5
@@ -78,42 +111,34 @@ for send_frame_num in range(500):
     if time.perf_counter() - script_start_time > max_simulated_time:
         break
 
-    video_frame = DUCK_FLAG_FRAMES[send_frame_num % len(DUCK_FLAG_FRAMES)]
-    video_frame.pts = pts_timestamp
-    video_frame.time_base = VIDEO_TIME_BASE
+    bgr_frame = DUCK_FLAG_FRAMES[send_frame_num % len(DUCK_FLAG_FRAMES)]
 
     start = time.perf_counter()
 
-    force_keyframe = (send_frame_num % FORCE_KEYFRAME_EVERY_N) == 0
+    force_keyframe = keyframe_requested or send_frame_num % FORCE_KEYFRAME_EVERY_N == 0
+    keyframe_requested = False
     if force_keyframe:
         print("Forcing keyframe")
 
-    _mid_encoding_video_packets, timestamp = video_encoder.encode(
-        video_frame, force_keyframe=force_keyframe
+    cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2YUV_I420, dst=i420_buffer)
+    headroom = rtp_sender.header_length
+    _mid_encoding_video_packets, timestamp = video_encoder.encode_ndarray(
+        i420_buffer,
+        pts_timestamp,
+        force_keyframe=force_keyframe,
+        headroom=headroom,
     )
     print(f"Encoding took {1000*(time.perf_counter() - start):0.2f} ms")
 
     start = time.perf_counter()
-    wire_packet_bytes = []
-    for i, payload in enumerate(_mid_encoding_video_packets):
-        outgoing_packet = RtpPacket(
-            payload_type=codec.value.payloadType,
-            sequence_number=sequence_number,
-            timestamp=timestamp,
-        )
-        outgoing_packet.ssrc = _ssrc
-        outgoing_packet.payload = payload
-        outgoing_packet.marker = (i == len(_mid_encoding_video_packets) - 1) and 1 or 0
-
-        # set header extensions
-        outgoing_packet.extensions.abs_send_time = (
-            current_ntp_time() >> 14
-        ) & 0x00FFFFFF
-
-        outgoing_packet_bytes = outgoing_packet.serialize()
-        wire_packet_bytes.append(outgoing_packet_bytes)
+    wire_packet_bytes = rtp_sender.write_headers(
+        cast(list[bytearray], _mid_encoding_video_packets), timestamp, headroom
+    )
 
-        sequence_number = uint16_add(sequence_number, 1)
+    fec_packet_bytes = fec_encoder.protect(
+        wire_packet_bytes,
+        keyframe=is_keyframe(memoryview(wire_packet_bytes[0])[headroom:]),
+    )
 
     print(f"Outgoing serialization took {1000*(time.perf_counter() - start):0.2f} ms")
     print(
@@ -122,28 +147,47 @@ for send_frame_num in range(500):
 
     start = time.perf_counter()
     received_video_frames: list[VideoFrame] = []
-    for incoming_packet_bytes in wire_packet_bytes:
+    for incoming_packet_bytes in [*wire_packet_bytes, *fec_packet_bytes]:
         if random.random() < DROPPED_PACKET_PERCENTAGE:
             print("\n\n\nSIMULATED DROPPED PACKET\n\n\n")
             continue
-        incoming_rtp_packet = RtpPacket.parse(incoming_packet_bytes)
-        try:
-            if incoming_rtp_packet.payload:
-                incoming_rtp_packet._data = vp8_depayload(incoming_rtp_packet.payload)
-            else:
-                print("PACKET HAS NO PAYLOAD")
-                incoming_rtp_packet._data = b""
-        except ValueError as exc:
-            raise ValueError(f"x RTP payload parsing failed: {exc}")
-
-        # try to re-assemble encoded frame
-        pli_flag, encoded_frame = _jitter_buffer.add(incoming_rtp_packet)
-
-        # if we have a complete encoded frame, decode it
-        if encoded_frame is not None:
-            received_video_frames.extend(video_decoder.decode(encoded_frame))
-            received_frame_num += 1
 
+        # repair packets only go to the FEC decoder, which may recover media packets
+        recovered_packet_bytes = fec_decoder.add(incoming_packet_bytes)
+        if recovered_packet_bytes:
+            print(f"RECOVERED {len(recovered_packet_bytes)} PACKETS WITH FEC")
+        media_packet_bytes = [
+            data
+            for data in [incoming_packet_bytes, *recovered_packet_bytes]
+            if data[1] & 0x7F != FLEXFEC_PAYLOAD_TYPE
+        ]
+
+        for packet_bytes in media_packet_bytes:
+            incoming_rtp_packet = RtpPacket.parse(packet_bytes)
+            decodability_tracker.add(incoming_rtp_packet)
+            try:
+                if incoming_rtp_packet.payload:
+                    incoming_rtp_packet._data = depayload(incoming_rtp_packet.payload)
+                else:
+                    print("PACKET HAS NO PAYLOAD")
+                    incoming_rtp_packet._data = b""
+            except ValueError as exc:
+                raise ValueError(f"x RTP payload parsing failed: {exc}")
+
+            # try to re-assemble encoded frame
+            pli_flag, encoded_frame = _jitter_buffer.add(incoming_rtp_packet)
+
+            # if we have a complete encoded frame, decode it
+            if encoded_frame is not None:
+                if not decodability_tracker.decodable(encoded_frame):
+                    print("SKIPPING UNDECODABLE FRAME")
+                    continue
+                received_video_frames.extend(video_decoder.decode(encoded_frame))
+                received_frame_num += 1
+
+    if decodability_tracker.request_keyframe():
+        print("REQUESTING KEYFRAME")
+        keyframe_requested = True
     print(f"Decoding took {1000*(time.perf_counter() - start):0.2f} ms")
 
     start = time.perf_counter()
@@ -0,0 +1,76 @@
+"""
+Sends a synthetic video over UDP on the loopback interface and reports how many
+frames were received, with paced sending, NACKs and retransmissions, and with
+encoding and decoding off the event loop.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+from av import VideoFrame
+
+from vpx_rtp.codecs.aio import AsyncVp8Decoder, AsyncVp8Encoder
+from vpx_rtp.codecs.vpx import (
+    VIDEO_CLOCK_RATE,
+    VIDEO_TIME_BASE,
+    Vp8Decoder,
+    Vp8Encoder,
+    VpxCodec,
+)
+from vpx_rtp.nack import NackGenerator
+from vpx_rtp.rtp import RtpHistory, RtpSender
+from vpx_rtp.transport import open_receiver, open_sender
+
+VIDEO_PTIME = 1 / 30  # 30fps
+FRAME_COUNT = 150
+FORCE_KEYFRAME_EVERY_N = 60
+
+
+def generate_frame(index: int, width: int = 640, height: int = 480) -> VideoFrame:
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)[:, np.newaxis]
+    gray = ((x + y + 4 * index) & 0xFF).astype(np.uint8)
+    return VideoFrame.from_ndarray(np.dstack([gray, gray[::-1], gray[:, ::-1]]))
+
+
+async def main() -> None:
+    codec = VpxCodec.VP8
+
+    receiver_transport, receiver = await open_receiver(
+        AsyncVp8Decoder(Vp8Decoder(codec)),
+        ("127.0.0.1", 0),
+        nack_generator=NackGenerator(),
+    )
+    port = receiver_transport.get_extra_info("sockname")[1]
+
+    encoder = AsyncVp8Encoder(Vp8Encoder(codec, target_bitrate=1000000))
+    sender_transport, sender = await open_sender(
+        encoder,
+        ("127.0.0.1", port),
+        rtp_sender=RtpSender(
+            payload_type=codec.value.payloadType, history=RtpHistory()
+        ),
+    )
+
+    start = time.perf_counter()
+    for index in range(FRAME_COUNT):
+        frame = generate_frame(index)
+        frame.pts = int(index * VIDEO_PTIME * VIDEO_CLOCK_RATE)
+        frame.time_base = VIDEO_TIME_BASE
+        await sender.send(frame, force_keyframe=(index % FORCE_KEYFRAME_EVERY_N) == 0)
+        await asyncio.sleep(VIDEO_PTIME)
+    await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Received {receiver.frames.qsize()}/{FRAME_COUNT} frames "
+        f"in {elapsed:0.2f} s"
+    )
+
+    sender_transport.close()
+    receiver_transport.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
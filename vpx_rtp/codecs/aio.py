@@ -0,0 +1,100 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from av import VideoFrame
+
+from vpx_rtp.codecs.vpx import Vp8Decoder, Vp8Encoder
+from vpx_rtp.jitterbuffer import JitterFrame
+
+# frames which may be queued for a codec before callers have to wait
+MAX_PENDING_FRAMES = 4
+
+
+class AsyncVp8Encoder:
+    """
+    Runs a :class:`Vp8Encoder` on a thread of its own, so that encoding does not
+    block the event loop.
+
+    libvpx is called with the GIL released, so encoders of different streams run in
+    parallel across cores. Frames are encoded in the order :meth:`encode` is called,
+    with at most `max_pending` of them queued.
+    """
+
+    def __init__(
+        self, encoder: Vp8Encoder, max_pending: int = MAX_PENDING_FRAMES
+    ) -> None:
+        self.encoder = encoder
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vpx-encoder"
+        )
+        self._semaphore = asyncio.Semaphore(max_pending)
+
+    @property
+    def target_bitrate(self) -> int:
+        """
+        Target bitrate in bits per second.
+        """
+        return self.encoder.target_bitrate
+
+    @target_bitrate.setter
+    def target_bitrate(self, bitrate: int) -> None:
+        self.encoder.target_bitrate = bitrate
+
+    async def encode(
+        self, frame: VideoFrame, force_keyframe: bool = False, headroom: int = 0
+    ) -> Tuple[List[bytes], int]:
+        """
+        Encode a frame, as :meth:`Vp8Encoder.encode`.
+        """
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                functools.partial(
+                    self.encoder.encode,
+                    frame,
+                    force_keyframe=force_keyframe,
+                    headroom=headroom,
+                ),
+            )
+
+    def close(self) -> None:
+        """
+        Wait for pending frames and stop the encoder's thread.
+        """
+        self._executor.shutdown()
+
+
+class AsyncVp8Decoder:
+    """
+    Runs a :class:`Vp8Decoder` on a thread of its own, so that decoding does not
+    block the event loop.
+
+    Frames are decoded in the order :meth:`decode` is called, with at most
+    `max_pending` of them queued.
+    """
+
+    def __init__(
+        self, decoder: Vp8Decoder, max_pending: int = MAX_PENDING_FRAMES
+    ) -> None:
+        self.decoder = decoder
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vpx-decoder"
+        )
+        self._semaphore = asyncio.Semaphore(max_pending)
+
+    async def decode(self, encoded_frame: JitterFrame) -> List[VideoFrame]:
+        """
+        Decode a frame, as :meth:`Vp8Decoder.decode`.
+        """
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.decoder.decode, encoded_frame
+            )
+
+    def close(self) -> None:
+        """
+        Wait for pending frames and stop the decoder's thread.
+        """
+        self._executor.shutdown()
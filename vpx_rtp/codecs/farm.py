@@ -0,0 +1,427 @@
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Deque, Dict, List, Optional
+
+from av import VideoFrame
+
+from vpx_rtp.codecs._vpx import ffi, lib
+from vpx_rtp.codecs.vpx import (
+    DEFAULT_BITRATE,
+    PACKET_MAX,
+    VIDEO_TIME_BASE,
+    EncoderPreset,
+    Vp8Encoder,
+    VpxCodec,
+    convert_timebase,
+)
+
+# frames of each stream which may be in flight at once
+FARM_FRAME_SLOTS = 2
+
+# size of each worker's ring of encoded payloads, which must hold the largest frame
+# of its streams, up to 1080p by default
+FARM_RING_SIZE = 4 << 20
+
+# bytes of each payload which its payload descriptor takes at most
+FARM_DESCRIPTOR_MAX = 64
+
+# how long a worker waits for its ring to be drained before checking again
+FARM_POLL_INTERVAL = 0.001
+
+# how often to check that workers are alive while waiting for results
+FARM_LIVENESS_INTERVAL = 1.0
+
+
+def i420_size(width: int, height: int) -> int:
+    """
+    Return the size of a contiguous I420 image.
+    """
+    return width * height + 2 * ((width + 1) >> 1) * ((height + 1) >> 1)
+
+
+def max_payloads_size(width: int, height: int, headroom: int = 0) -> int:
+    """
+    Return the largest total size of the payloads of one frame. libvpx frames are
+    never larger than the raw image, and each packet adds its payload descriptor
+    and headroom.
+    """
+    size = i420_size(width, height)
+    packets = size // (PACKET_MAX - FARM_DESCRIPTOR_MAX) + 1
+    return size + packets * (FARM_DESCRIPTOR_MAX + headroom)
+
+
+def _release_memory(memory: SharedMemory) -> None:
+    try:
+        memory.close()
+    except BufferError:
+        # a view from frame_buffer is still held, the mapping goes away with it
+        pass
+    memory.unlink()
+
+
+class EncodedFrame:
+    def __init__(
+        self,
+        stream_id: int,
+        payloads: List[bytearray],
+        timestamp: int,
+        error: Optional[str] = None,
+    ) -> None:
+        self.stream_id = stream_id
+        self.payloads = payloads
+        self.timestamp = timestamp
+        self.error = error
+
+
+class _WorkerStream:
+    def __init__(
+        self,
+        memory: SharedMemory,
+        width: int,
+        height: int,
+        codec: VpxCodec,
+        target_bitrate: int,
+        headroom: int,
+        preset: EncoderPreset,
+    ) -> None:
+        self.encoder = Vp8Encoder(codec, target_bitrate=target_bitrate, preset=preset)
+        self.memory = memory
+        self.width = width
+        self.height = height
+        self.frame_size = i420_size(width, height)
+        self.headroom = headroom
+
+
+def _run_worker(
+    index: int, tasks: Any, results: Any, ring_name: str, consumed: Any
+) -> None:
+    ring = SharedMemory(name=ring_name)
+    ring_size = ring.size
+    produced = 0
+    streams: Dict[int, _WorkerStream] = {}
+    try:
+        while True:
+            message = tasks.get()
+            if message is None:
+                break
+
+            command, stream_id, *args = message
+            if command == "add":
+                (
+                    memory_name,
+                    width,
+                    height,
+                    codec,
+                    target_bitrate,
+                    headroom,
+                    preset,
+                ) = args
+                streams[stream_id] = _WorkerStream(
+                    SharedMemory(name=memory_name),
+                    width=width,
+                    height=height,
+                    codec=codec,
+                    target_bitrate=target_bitrate,
+                    headroom=headroom,
+                    preset=preset,
+                )
+            elif command == "remove":
+                streams.pop(stream_id).memory.close()
+            elif command == "bitrate":
+                streams[stream_id].encoder.target_bitrate = args[0]
+            elif command == "preset":
+                streams[stream_id].encoder.preset = args[0]
+            elif command == "encode":
+                slot, pts, force_keyframe = args
+                stream = streams[stream_id]
+                offset = slot * stream.frame_size
+                payloads, timestamp = stream.encoder.encode_i420(
+                    stream.memory.buf[offset : offset + stream.frame_size],
+                    stream.width,
+                    stream.height,
+                    pts,
+                    force_keyframe=force_keyframe,
+                    headroom=stream.headroom,
+                )
+
+                size = sum(len(payload) for payload in payloads)
+                if size > ring_size:
+                    results.put((index, stream_id, timestamp, 0, None, produced))
+                    continue
+
+                # a frame's payloads never wrap around the end of the ring
+                pos = produced % ring_size
+                if pos + size > ring_size:
+                    produced += ring_size - pos
+                    pos = 0
+                while produced + size - consumed.value > ring_size:
+                    time.sleep(FARM_POLL_INTERVAL)
+
+                start = pos
+                for payload in payloads:
+                    ring.buf[pos : pos + len(payload)] = payload
+                    pos += len(payload)
+                produced += size
+                results.put(
+                    (
+                        index,
+                        stream_id,
+                        timestamp,
+                        start,
+                        [len(payload) for payload in payloads],
+                        produced,
+                    )
+                )
+    finally:
+        for stream in streams.values():
+            stream.memory.close()
+        ring.close()
+
+
+class _Worker:
+    def __init__(self, index: int, context: Any, results: Any, ring_size: int) -> None:
+        self.ring = SharedMemory(create=True, size=ring_size)
+        self.consumed = context.RawValue("Q", 0)
+        self.tasks = context.SimpleQueue()
+        self.streams = 0
+        self.process = context.Process(
+            target=_run_worker,
+            args=(index, self.tasks, results, self.ring.name, self.consumed),
+            daemon=True,
+        )
+        self.process.start()
+
+
+class _Stream:
+    def __init__(self, worker: _Worker, memory: SharedMemory, frame_size: int) -> None:
+        self.worker = worker
+        self.memory = memory
+        self.frame_size = frame_size
+        self.next_slot = 0
+        self.pending = 0
+
+
+class EncoderFarm:
+    """
+    Encodes many independent streams on a pool of worker processes.
+
+    Raw I420 frames are written into shared memory, either directly into
+    :meth:`frame_buffer` followed by :meth:`submit`, or from a VideoFrame with
+    :meth:`encode`. The packetized payloads come back through a shared memory ring
+    per worker and are collected with :meth:`get`, so frames are never pickled.
+
+    Each stream stays on the worker it was assigned to, which keeps its libvpx
+    context warm. Streams are assigned to the worker with the fewest streams.
+    """
+
+    def __init__(
+        self, workers: Optional[int] = None, ring_size: int = FARM_RING_SIZE
+    ) -> None:
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue()
+        self._workers = [
+            _Worker(index, context, self._results, ring_size)
+            for index in range(workers or os.cpu_count() or 1)
+        ]
+        self._streams: Dict[int, _Stream] = {}
+        self._completed: Deque[EncodedFrame] = deque()
+
+    def add_stream(
+        self,
+        stream_id: int,
+        width: int,
+        height: int,
+        codec: VpxCodec = VpxCodec.VP8,
+        target_bitrate: int = DEFAULT_BITRATE,
+        headroom: int = 0,
+        preset: EncoderPreset = EncoderPreset(),
+    ) -> None:
+        """
+        :param headroom: bytes reserved at the front of each payload, as for
+            :meth:`Vp8Encoder.encode`
+        :param preset: the speed and threading settings of the stream's encoder
+        """
+        assert stream_id not in self._streams, "stream already exists"
+        worker = min(self._workers, key=lambda worker: worker.streams)
+        if max_payloads_size(width, height, headroom) > worker.ring.size:
+            raise ValueError(
+                f"Frames of {width}x{height} may not fit in the ring, "
+                "increase ring_size"
+            )
+        frame_size = i420_size(width, height)
+        memory = SharedMemory(create=True, size=FARM_FRAME_SLOTS * frame_size)
+        self._streams[stream_id] = _Stream(worker, memory, frame_size)
+        worker.streams += 1
+        worker.tasks.put(
+            (
+                "add",
+                stream_id,
+                memory.name,
+                width,
+                height,
+                codec,
+                target_bitrate,
+                headroom,
+                preset,
+            )
+        )
+
+    def remove_stream(self, stream_id: int) -> None:
+        stream = self._streams[stream_id]
+        stream.worker.tasks.put(("remove", stream_id))
+        _release_memory(stream.memory)
+        del self._streams[stream_id]
+        stream.worker.streams -= 1
+
+    def set_target_bitrate(self, stream_id: int, bitrate: int) -> None:
+        self._streams[stream_id].worker.tasks.put(("bitrate", stream_id, bitrate))
+
+    def set_preset(self, stream_id: int, preset: EncoderPreset) -> None:
+        self._streams[stream_id].worker.tasks.put(("preset", stream_id, preset))
+
+    def frame_buffer(self, stream_id: int) -> memoryview:
+        """
+        Return the shared memory into which to write the stream's next I420 frame,
+        waiting for one of its previous frames to be encoded if need be. The view
+        should be released once written, or the memory is only unmapped when it is
+        garbage collected.
+        """
+        stream = self._streams[stream_id]
+        while stream.pending == FARM_FRAME_SLOTS:
+            frame = self._receive(None)
+            if frame is not None:
+                self._completed.append(frame)
+
+        offset = stream.next_slot * stream.frame_size
+        return stream.memory.buf[offset : offset + stream.frame_size]
+
+    def submit(self, stream_id: int, pts: int, force_keyframe: bool = False) -> None:
+        """
+        Encode the frame written into :meth:`frame_buffer`.
+
+        :param pts: the presentation timestamp in the video time base
+        """
+        stream = self._streams[stream_id]
+        assert stream.pending < FARM_FRAME_SLOTS, "frame_buffer was not called"
+        stream.worker.tasks.put(
+            ("encode", stream_id, stream.next_slot, pts, force_keyframe)
+        )
+        stream.next_slot = (stream.next_slot + 1) % FARM_FRAME_SLOTS
+        stream.pending += 1
+
+    def encode(
+        self, stream_id: int, frame: VideoFrame, force_keyframe: bool = False
+    ) -> None:
+        """
+        Copy a frame into shared memory and submit it.
+        """
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        assert frame.pts is not None, "Frame must have a PTS"
+        assert frame.time_base is not None, "Frame must have a time base"
+
+        with self.frame_buffer(stream_id) as view, ffi.from_buffer(
+            view, require_writable=True
+        ) as buffer:
+            pos = 0
+            for plane in frame.planes:
+                lib.vpx_rtp_copy_plane(
+                    buffer + pos,
+                    plane.width,
+                    ffi.cast("void*", plane.buffer_ptr),
+                    plane.line_size,
+                    plane.width,
+                    plane.height,
+                )
+                pos += plane.width * plane.height
+
+        self.submit(
+            stream_id,
+            convert_timebase(frame.pts, frame.time_base, VIDEO_TIME_BASE),
+            force_keyframe=force_keyframe,
+        )
+
+    def get(self, timeout: Optional[float] = None) -> Optional[EncodedFrame]:
+        """
+        Return the next encoded frame of any stream, or None if there is none after
+        `timeout` seconds. Frames of a stream are returned in order.
+
+        Raises ValueError in place of a frame which could not be returned, such as
+        one larger than the ring.
+        """
+        if self._completed:
+            return self._check(self._completed.popleft())
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+            try:
+                frame = self._receive(remaining)
+            except queue.Empty:
+                return None
+            if frame is not None:
+                return self._check(frame)
+
+    def close(self) -> None:
+        """
+        Stop the workers and release the shared memory.
+        """
+        for worker in self._workers:
+            worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join()
+            worker.ring.close()
+            worker.ring.unlink()
+        for stream in self._streams.values():
+            _release_memory(stream.memory)
+        self._streams.clear()
+
+    @staticmethod
+    def _check(frame: EncodedFrame) -> EncodedFrame:
+        if frame.error is not None:
+            raise ValueError(frame.error)
+        return frame
+
+    def _receive(self, timeout: Optional[float]) -> Optional[EncodedFrame]:
+        while True:
+            try:
+                message = self._results.get(
+                    timeout=FARM_LIVENESS_INTERVAL if timeout is None else timeout
+                )
+                break
+            except queue.Empty:
+                if timeout is not None:
+                    raise
+                if not all(worker.process.is_alive() for worker in self._workers):
+                    raise RuntimeError("Encoder worker exited unexpectedly")
+
+        index, stream_id, timestamp, pos, lengths, produced = message
+        worker = self._workers[index]
+
+        payloads = []
+        if lengths is not None:
+            for length in lengths:
+                payloads.append(bytearray(worker.ring.buf[pos : pos + length]))
+                pos += length
+        worker.consumed.value = produced
+
+        # the stream may have been removed while its frames were being encoded
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.worker is not worker:
+            return None
+        stream.pending -= 1
+
+        if lengths is None:
+            return EncodedFrame(
+                stream_id=stream_id,
+                payloads=[],
+                timestamp=timestamp,
+                error=f"Encoded frame of stream {stream_id} is larger than the ring",
+            )
+        return EncodedFrame(stream_id=stream_id, payloads=payloads, timestamp=timestamp)
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from av import VideoFrame
+from av.video.reformatter import VideoReformatter
+
+from vpx_rtp.codecs.vpx import DEFAULT_BITRATE, Vp8Encoder, VpxCodec
+from vpx_rtp.utils import random32
+
+# how much each stream is scaled down by, and its bitrate, from lowest to highest
+SIMULCAST_LAYERS = [(4.0, 150000), (2.0, 500000), (1.0, 1500000)]
+
+
+class SimulcastStream:
+    """
+    One stream of a simulcast, with an encoder of its own and thus its own
+    picture IDs and rate control, and a scaler of its own so that streams can be
+    scaled from the same frame at once.
+    """
+
+    def __init__(
+        self,
+        codec: VpxCodec,
+        scale_resolution_down_by: float = 1.0,
+        target_bitrate: int = DEFAULT_BITRATE,
+        ssrc: Optional[int] = None,
+    ) -> None:
+        assert scale_resolution_down_by >= 1.0, "streams can only be scaled down"
+        self.encoder = Vp8Encoder(codec, target_bitrate=target_bitrate)
+        self.reformatter = VideoReformatter()
+        self.scale_resolution_down_by = scale_resolution_down_by
+        self.ssrc = random32() if ssrc is None else ssrc
+        self.keyframe_requested = False
+
+    def resolution(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Return the resolution of this stream for an input of the given size,
+        rounded down to even sizes.
+        """
+        scale = self.scale_resolution_down_by
+        return (
+            max(int(width / scale) & ~1, 2),
+            max(int(height / scale) & ~1, 2),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"SimulcastStream(ssrc={self.ssrc}, "
+            f"scale_resolution_down_by={self.scale_resolution_down_by}, "
+            f"target_bitrate={self.encoder.target_bitrate})"
+        )
+
+
+class SimulcastEncoder:
+    """
+    Encodes each frame into several streams of different resolutions and bitrates.
+
+    The frame is converted to yuv420p once, and each lower resolution is scaled
+    from the converted frame, so colour conversion is not repeated per stream.
+    The scaling and encoding of the streams run in parallel on a thread pool.
+    """
+
+    def __init__(
+        self,
+        codec: VpxCodec = VpxCodec.VP8,
+        streams: Optional[Sequence[SimulcastStream]] = None,
+    ) -> None:
+        if streams is None:
+            streams = [
+                SimulcastStream(
+                    codec, scale_resolution_down_by=scale, target_bitrate=bitrate
+                )
+                for scale, bitrate in SIMULCAST_LAYERS
+            ]
+        assert streams, "at least one stream is required"
+        self.streams = list(streams)
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.streams), thread_name_prefix="vpx-simulcast"
+        )
+
+    def request_keyframe(self, ssrc: int) -> None:
+        """
+        Make the next frame of the stream with the given SSRC a keyframe, as when
+        a PLI is received for it.
+        """
+        for stream in self.streams:
+            if stream.ssrc == ssrc:
+                stream.keyframe_requested = True
+
+    def encode(
+        self, frame: VideoFrame, force_keyframe: bool = False, headroom: int = 0
+    ) -> Tuple[List[List[bytes]], int]:
+        """
+        Encode a frame into every stream, as :meth:`Vp8Encoder.encode`.
+
+        :return: the packets of each stream, in the order of :attr:`streams`, and
+            the timestamp in the video time base
+        """
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+
+        futures = []
+        for stream in self.streams:
+            futures.append(
+                self._executor.submit(
+                    self._encode_stream,
+                    stream,
+                    frame,
+                    force_keyframe or stream.keyframe_requested,
+                    headroom,
+                )
+            )
+            stream.keyframe_requested = False
+
+        results = [future.result() for future in futures]
+        return [payloads for payloads, timestamp in results], results[0][1]
+
+    def close(self) -> None:
+        """
+        Wait for pending frames and stop the encoding threads.
+        """
+        self._executor.shutdown()
+
+    @staticmethod
+    def _encode_stream(
+        stream: SimulcastStream,
+        frame: VideoFrame,
+        force_keyframe: bool,
+        headroom: int,
+    ) -> Tuple[List[bytes], int]:
+        width, height = stream.resolution(frame.width, frame.height)
+        if (width, height) != (frame.width, frame.height):
+            frame = stream.reformatter.reformat(frame, width=width, height=height)
+        return stream.encoder.encode(
+            frame, force_keyframe=force_keyframe, headroom=headroom
+        )
@@ -1,16 +1,36 @@
 import fractions
 import multiprocessing
 import random
+import time
+from collections import deque
+from dataclasses import dataclass
 from enum import Enum
-from struct import pack, unpack_from
-from typing import List, Tuple, Type, TypeVar, cast
+from struct import pack, pack_into, unpack_from
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
 from av import VideoFrame
 from av.packet import Packet
+from av.video.reformatter import VideoReformatter
+from typing_extensions import Self
 
 from vpx_rtp.codecs._vpx import ffi, lib
 from vpx_rtp.jitterbuffer import JitterFrame
 from vpx_rtp.rtcrtpparameters import RTCRtpCodecParameters
+from vpx_rtp.rtp import RtpPacket, RtpPacketView
+from vpx_rtp.utils import uint16_gt
 
 VIDEO_CLOCK_RATE = 90000
 VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
@@ -20,6 +40,30 @@ DEFAULT_BITRATE = 500000  # 500 kbps
 MAX_FRAME_RATE = 30
 PACKET_MAX = 1300
 
+# smallest buffer of the encoder output pool, and how much larger than the average
+# frame at the target bitrate keyframes are expected to be
+OUTPUT_POOL_MIN_SIZE = 8192
+KEYFRAME_SIZE_RATIO = 8
+
+# cumulative share of a spatial layer's bitrate up to each temporal layer
+SVC_TEMPORAL_RATES = {1: [1.0], 2: [0.6, 1.0], 3: [0.4, 0.6, 1.0]}
+
+# pictures of the temporal pattern: temporal layer ID, switching up point and
+# reference picture index differences
+SVC_TEMPORAL_PATTERNS = {
+    1: [(0, 0, [1])],
+    2: [(0, 0, [2]), (1, 1, [1])],
+    3: [(0, 0, [4]), (2, 1, [1]), (1, 1, [2]), (2, 1, [1])],
+}
+
+# dropped packets remembered to renumber late packets, such as retransmissions
+LAYER_FILTER_HISTORY = 512
+
+# seconds between keyframe requests while frames cannot be decoded, and frame
+# starts remembered until the jitter buffer completes their frame
+KEYFRAME_REQUEST_INTERVAL = 0.5
+DECODABILITY_HISTORY = 256
+
 DESCRIPTOR_T = TypeVar("DESCRIPTOR_T", bound="VpxPayloadDescriptor")
 
 VP8_CODEC = RTCRtpCodecParameters(
@@ -46,6 +90,49 @@ def convert_timebase(
     return pts
 
 
+@dataclass(frozen=True)
+class EncoderPreset:
+    """
+    Speed and threading settings of a :class:`Vp8Encoder`, which can be changed
+    between frames with :attr:`Vp8Encoder.preset`.
+
+    The VP9 settings are ignored by VP8. Changing the number of threads restarts
+    the encoder, so the next frame is a keyframe.
+    """
+
+    cpu_used: int = -6
+    "Speed of the encoder, higher being faster, with negative values adapting it."
+    threads: Optional[int] = None
+    "Number of encoding threads, or None to pick it from the resolution."
+    noise_sensitivity: int = 4
+    static_threshold: int = 1
+    deadline: Optional[int] = None
+    "Time budget of a frame in microseconds, or None for real time."
+    row_mt: bool = False
+    "Whether VP9 encodes rows of superblocks in parallel."
+    tile_columns: Optional[int] = None
+    "Base 2 logarithm of the number of VP9 tile columns, or None for the default."
+    aq_mode: Optional[int] = None
+    "VP9 adaptive quantization mode, or None for the default."
+    frame_parallel_decoding: bool = False
+    "Whether VP9 frames can be decoded in parallel, at some cost in quality."
+
+    @classmethod
+    def multicore(cls, cpus: Optional[int] = None) -> "EncoderPreset":
+        """
+        Return a real-time preset spreading VP9 encoding across `cpus` cores, with
+        row based multi-threading and a tile column per thread.
+        """
+        threads = min(cpus or multiprocessing.cpu_count(), 16)
+        return cls(
+            cpu_used=7,
+            threads=threads,
+            row_mt=True,
+            tile_columns=(threads - 1).bit_length(),
+            frame_parallel_decoding=True,
+        )
+
+
 def number_of_threads(pixels: int, cpus: int) -> int:
     if pixels >= 1920 * 1080 and cpus > 8:
         return 8
@@ -115,7 +202,9 @@ class VpxPayloadDescriptor:
         )
 
     @classmethod
-    def parse(cls: Type[DESCRIPTOR_T], data: bytes) -> Tuple[DESCRIPTOR_T, bytes]:
+    def parse(
+        cls: Type[DESCRIPTOR_T], data: bytes | memoryview
+    ) -> Tuple[DESCRIPTOR_T, bytes | memoryview]:
         if len(data) < 1:
             raise ValueError("VPX descriptor is too short")
 
@@ -157,7 +246,6 @@ class VpxPayloadDescriptor:
                     picture_id = data[pos]
                     pos += 1
 
-            # unused
             if ext_L:
                 if len(data) < pos + 1:
                     raise ValueError("VPX descriptor has truncated TL0PICIDX")
@@ -186,6 +274,364 @@ class VpxPayloadDescriptor:
         return obj, data[pos:]
 
 
+class Vp9ScalabilityStructure:
+    """
+    The scalability structure of a VP9 payload descriptor: the resolution of each
+    spatial layer and, optionally, the pictures of a group of frames as tuples of
+    temporal layer ID, switching up point and reference picture index differences.
+    """
+
+    def __init__(
+        self,
+        resolutions: list[tuple[int, int]],
+        pictures: list[tuple[int, int, list[int]]] | None = None,
+    ) -> None:
+        self.resolutions = resolutions
+        self.pictures = pictures
+
+    def __bytes__(self) -> bytes:
+        octet = ((len(self.resolutions) - 1) << 5) | (1 << 4)
+        if self.pictures is not None:
+            octet |= 1 << 3
+        data = pack("!B", octet) + b"".join(
+            pack("!HH", width, height) for width, height in self.resolutions
+        )
+        if self.pictures is not None:
+            data += pack("!B", len(self.pictures))
+            for tid, switching_up, p_diffs in self.pictures:
+                data += pack(
+                    f"!B{len(p_diffs)}B",
+                    (tid << 5) | (switching_up << 4) | (len(p_diffs) << 2),
+                    *p_diffs,
+                )
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"Vp9ScalabilityStructure(resolutions={self.resolutions}, "
+            f"pictures={self.pictures})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, pos: int) -> tuple[Self, int]:
+        if len(data) < pos + 1:
+            raise ValueError("VP9 descriptor has truncated scalability structure")
+
+        octet = data[pos]
+        spatial_layers = (octet >> 5) + 1
+        has_resolutions = (octet >> 4) & 1
+        has_pictures = (octet >> 3) & 1
+        pos += 1
+
+        resolutions = []
+        if has_resolutions:
+            if len(data) < pos + 4 * spatial_layers:
+                raise ValueError("VP9 descriptor has truncated resolutions")
+            for _ in range(spatial_layers):
+                resolutions.append(unpack_from("!HH", data, pos))
+                pos += 4
+
+        pictures = None
+        if has_pictures:
+            if len(data) < pos + 1:
+                raise ValueError("VP9 descriptor has truncated picture group")
+            count = data[pos]
+            pos += 1
+            pictures = []
+            for _ in range(count):
+                if len(data) < pos + 1:
+                    raise ValueError("VP9 descriptor has truncated picture group")
+                octet = data[pos]
+                references = (octet >> 2) & 3
+                if len(data) < pos + 1 + references:
+                    raise ValueError("VP9 descriptor has truncated picture group")
+                pictures.append(
+                    (
+                        octet >> 5,
+                        (octet >> 4) & 1,
+                        list(data[pos + 1 : pos + 1 + references]),
+                    )
+                )
+                pos += 1 + references
+
+        return cls(resolutions=resolutions, pictures=pictures), pos
+
+
+class Vp9PayloadDescriptor:
+    """
+    The VP9 payload descriptor of RFC 9628.
+
+    Layer indices are present if `tid` and `sid` are set, with `tl0picidx` in
+    non-flexible mode. In flexible mode, `p_diffs` lists the reference pictures.
+    """
+
+    def __init__(
+        self,
+        start_of_frame: int,
+        end_of_frame: int,
+        picture_id: int | None = None,
+        inter_picture_predicted: int = 0,
+        flexible: int = 0,
+        not_reference: int = 0,
+        tid: int | None = None,
+        switching_up: int = 0,
+        sid: int | None = None,
+        inter_layer_predicted: int = 0,
+        tl0picidx: int | None = None,
+        p_diffs: list[int] | None = None,
+        scalability_structure: Vp9ScalabilityStructure | None = None,
+    ) -> None:
+        self.start_of_frame = start_of_frame
+        self.end_of_frame = end_of_frame
+        self.picture_id = picture_id
+        self.inter_picture_predicted = inter_picture_predicted
+        self.flexible = flexible
+        self.not_reference = not_reference
+        self.tid = tid
+        self.switching_up = switching_up
+        self.sid = sid
+        self.inter_layer_predicted = inter_layer_predicted
+        self.tl0picidx = tl0picidx
+        self.p_diffs = p_diffs if p_diffs is not None else []
+        self.scalability_structure = scalability_structure
+
+    def __bytes__(self) -> bytes:
+        layers = self.tid is not None and self.sid is not None
+        octet = (
+            ((self.picture_id is not None) << 7)
+            | (self.inter_picture_predicted << 6)
+            | (layers << 5)
+            | (self.flexible << 4)
+            | (self.start_of_frame << 3)
+            | (self.end_of_frame << 2)
+            | ((self.scalability_structure is not None) << 1)
+            | self.not_reference
+        )
+        data = pack("!B", octet)
+        if self.picture_id is not None:
+            data += pack("!H", (1 << 15) | self.picture_id)
+        if layers:
+            data += pack(
+                "!B",
+                (cast(int, self.tid) << 5)
+                | (self.switching_up << 4)
+                | (cast(int, self.sid) << 1)
+                | self.inter_layer_predicted,
+            )
+            if not self.flexible:
+                data += pack("!B", self.tl0picidx or 0)
+        if self.flexible and self.inter_picture_predicted:
+            for i, p_diff in enumerate(self.p_diffs):
+                data += pack("!B", (p_diff << 1) | (i < len(self.p_diffs) - 1))
+        if self.scalability_structure is not None:
+            data += bytes(self.scalability_structure)
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"Vp9PayloadDescriptor(B={self.start_of_frame}, E={self.end_of_frame}, "
+            f"pic_id={self.picture_id}, P={self.inter_picture_predicted}, "
+            f"tid={self.tid}, sid={self.sid})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview) -> tuple[Self, bytes | memoryview]:
+        if len(data) < 1:
+            raise ValueError("VP9 descriptor is too short")
+
+        octet = data[0]
+        has_picture_id = octet >> 7
+        layers = (octet >> 5) & 1
+        has_scalability_structure = (octet >> 1) & 1
+        obj = cls(
+            start_of_frame=(octet >> 3) & 1,
+            end_of_frame=(octet >> 2) & 1,
+            inter_picture_predicted=(octet >> 6) & 1,
+            flexible=(octet >> 4) & 1,
+            not_reference=octet & 1,
+        )
+        pos = 1
+
+        # picture id
+        if has_picture_id:
+            if len(data) < pos + 1:
+                raise ValueError("VP9 descriptor has truncated PictureID")
+
+            if data[pos] & 0x80:
+                if len(data) < pos + 2:
+                    raise ValueError("VP9 descriptor has truncated long PictureID")
+
+                obj.picture_id = unpack_from("!H", data, pos)[0] & 0x7FFF
+                pos += 2
+            else:
+                obj.picture_id = data[pos]
+                pos += 1
+
+        # layer indices
+        if layers:
+            if len(data) < pos + 1 + (not obj.flexible):
+                raise ValueError("VP9 descriptor has truncated layer indices")
+
+            octet = data[pos]
+            obj.tid = octet >> 5
+            obj.switching_up = (octet >> 4) & 1
+            obj.sid = (octet >> 1) & 7
+            obj.inter_layer_predicted = octet & 1
+            pos += 1
+            if not obj.flexible:
+                obj.tl0picidx = data[pos]
+                pos += 1
+
+        # reference indices
+        if obj.flexible and obj.inter_picture_predicted:
+            while True:
+                if len(data) < pos + 1:
+                    raise ValueError("VP9 descriptor has truncated reference indices")
+
+                obj.p_diffs.append(data[pos] >> 1)
+                pos += 1
+                if not data[pos - 1] & 1 or len(obj.p_diffs) == 3:
+                    break
+
+        if has_scalability_structure:
+            obj.scalability_structure, pos = Vp9ScalabilityStructure.parse(data, pos)
+
+        return obj, data[pos:]
+
+
+class Vp9SvcConfig:
+    """
+    The layers of a scalable VP9 stream.
+
+    Spatial layer `sid` is scaled down by ``2 ** (spatial_layers - 1 - sid)`` and
+    temporal layers follow the 0-1 or 0-2-1-2 patterns.
+    """
+
+    def __init__(self, spatial_layers: int = 1, temporal_layers: int = 1) -> None:
+        assert 1 <= spatial_layers <= 3, "spatial_layers must be between 1 and 3"
+        assert 1 <= temporal_layers <= 3, "temporal_layers must be between 1 and 3"
+        self.spatial_layers = spatial_layers
+        self.temporal_layers = temporal_layers
+
+    @property
+    def pictures(self) -> list[tuple[int, int, list[int]]]:
+        return SVC_TEMPORAL_PATTERNS[self.temporal_layers]
+
+    def scaling_factor(self, sid: int) -> tuple[int, int]:
+        return 1, 1 << (self.spatial_layers - 1 - sid)
+
+    def resolution(self, sid: int, width: int, height: int) -> tuple[int, int]:
+        """
+        Return the resolution of a spatial layer, rounded up to even sizes as
+        libvpx does.
+        """
+        num, den = self.scaling_factor(sid)
+        width = width * num // den
+        height = height * num // den
+        return width + width % 2, height + height % 2
+
+    def layer_bitrates(self, bitrate: int) -> list[list[int]]:
+        """
+        Split a bitrate across the layers, in proportion to the scale of each
+        spatial layer. Bitrates are cumulative across the temporal layers of a
+        spatial layer, as libvpx expects.
+        """
+        weights = [
+            num / den
+            for num, den in map(self.scaling_factor, range(self.spatial_layers))
+        ]
+        total = sum(weights)
+        return [
+            [
+                int(bitrate * weight / total * share)
+                for share in SVC_TEMPORAL_RATES[self.temporal_layers]
+            ]
+            for weight in weights
+        ]
+
+    def __repr__(self) -> str:
+        return (
+            f"Vp9SvcConfig(spatial_layers={self.spatial_layers}, "
+            f"temporal_layers={self.temporal_layers})"
+        )
+
+
+class VpxLayer:
+    """
+    The packets of one layer of an encoded frame.
+    """
+
+    def __init__(
+        self, spatial_id: int, temporal_id: int, payloads: List[bytes]
+    ) -> None:
+        self.spatial_id = spatial_id
+        self.temporal_id = temporal_id
+        self.payloads = payloads
+
+    def __repr__(self) -> str:
+        return (
+            f"VpxLayer(spatial_id={self.spatial_id}, temporal_id={self.temporal_id}, "
+            f"payloads={len(self.payloads)})"
+        )
+
+
+class BufferPool:
+    """
+    Reusable bytearrays in power of two size classes, so that buffers of very
+    different sizes, such as those for keyframes and for the frames in between,
+    are each allocated once instead of growing and being copied.
+    """
+
+    def __init__(self, min_size: int = OUTPUT_POOL_MIN_SIZE) -> None:
+        self.min_size = min_size
+        self._free: Dict[int, List[bytearray]] = {}
+
+    def size_class(self, size: int) -> int:
+        return max(self.min_size, 1 << (size - 1).bit_length())
+
+    def acquire(self, size: int) -> bytearray:
+        """
+        Return a buffer of at least `size` bytes, to be given back with
+        :meth:`release` once it is no longer used.
+        """
+        size = self.size_class(size)
+        free = self._free.get(size)
+        return free.pop() if free else bytearray(size)
+
+    def release(self, buffer: bytearray) -> None:
+        self._free.setdefault(len(buffer), []).append(buffer)
+
+    def reserve(self, size: int) -> None:
+        """
+        Allocate a buffer of at least `size` bytes ahead of time, unless one is free.
+        """
+        if not self._free.get(self.size_class(size)):
+            self.release(bytearray(self.size_class(size)))
+
+
+class VpxImage:
+    """
+    A decoded I420 image whose planes point directly into libvpx's memory.
+
+    Each plane is a memoryview of ``stride * rows`` bytes, so it can be viewed without
+    copying, eg ``numpy.frombuffer(image.planes[0], numpy.uint8).reshape(-1, stride)``.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        timestamp: int,
+        planes: list[memoryview],
+        strides: list[int],
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.timestamp = timestamp
+        self.planes = planes
+        self.strides = strides
+
+
 def _vpx_assert(err: int) -> None:
     if err != lib.VPX_CODEC_OK:
         reason = ffi.string(lib.vpx_codec_err_to_string(err))
@@ -214,6 +660,57 @@ class Vp8Decoder:
 
     def decode(self, encoded_frame: JitterFrame) -> list[VideoFrame]:
         frames = list[VideoFrame]()
+        for img in self._decode(encoded_frame):
+            frame = VideoFrame(width=img.d_w, height=img.d_h)
+            frame.pts = encoded_frame.timestamp
+            frame.time_base = VIDEO_TIME_BASE
+
+            for p in range(3):
+                shift = p and 1 or 0
+                plane = frame.planes[p]
+                lib.vpx_rtp_copy_plane(
+                    ffi.from_buffer(plane, require_writable=True),
+                    plane.line_size,
+                    img.planes[p],
+                    img.stride[p],
+                    (img.d_w + shift) >> shift,
+                    (img.d_h + shift) >> shift,
+                )
+
+            frames.append(frame)
+
+        return frames
+
+    def decode_images(self, encoded_frame: JitterFrame) -> list[VpxImage]:
+        """
+        Decode without copying, returning images backed by libvpx's frame buffers.
+
+        The returned images are only valid until the next call to the decoder.
+        """
+        images = list[VpxImage]()
+        for img in self._decode(encoded_frame):
+            planes = []
+            strides = []
+            for p in range(3):
+                shift = p and 1 or 0
+                stride = img.stride[p]
+                rows = (img.d_h + shift) >> shift
+                planes.append(memoryview(ffi.buffer(img.planes[p], stride * rows)))
+                strides.append(stride)
+
+            images.append(
+                VpxImage(
+                    width=img.d_w,
+                    height=img.d_h,
+                    timestamp=encoded_frame.timestamp,
+                    planes=planes,
+                    strides=strides,
+                )
+            )
+
+        return images
+
+    def _decode(self, encoded_frame: JitterFrame) -> Iterator[Any]:
         result = lib.vpx_codec_decode(
             self.codec,
             encoded_frame.data,
@@ -228,37 +725,28 @@ class Vp8Decoder:
                 if not img:
                     break
                 assert img.fmt == lib.VPX_IMG_FMT_I420
-
-                frame = VideoFrame(width=img.d_w, height=img.d_h)
-                frame.pts = encoded_frame.timestamp
-                frame.time_base = VIDEO_TIME_BASE
-
-                for p in range(3):
-                    i_stride = img.stride[p]
-                    i_buf = ffi.buffer(img.planes[p], i_stride * img.d_h)
-                    i_pos = 0
-
-                    o_stride = frame.planes[p].line_size
-                    o_buf = memoryview(cast(bytes, frame.planes[p]))
-                    o_pos = 0
-
-                    div = p and 2 or 1
-                    for r in range(0, img.d_h // div):
-                        o_buf[o_pos : o_pos + o_stride] = i_buf[
-                            i_pos : i_pos + o_stride
-                        ]
-                        i_pos += i_stride
-                        o_pos += o_stride
-
-                frames.append(frame)
-
-        return frames
+                yield img
 
 
 class Vp8Encoder:
     def __init__(
-        self, codec: VpxCodec = VpxCodec.VP9, target_bitrate: int = DEFAULT_BITRATE
+        self,
+        codec: VpxCodec = VpxCodec.VP9,
+        target_bitrate: int = DEFAULT_BITRATE,
+        svc: Optional[Vp9SvcConfig] = None,
+        temporal_layers: int = 1,
+        preset: EncoderPreset = EncoderPreset(),
     ) -> None:
+        """
+        :param svc: the spatial and temporal layers to encode, for VP9 only
+        :param temporal_layers: the number of temporal layers to encode, for VP8
+            only: each payload descriptor then carries TL0PICIDX, TID and KEYIDX
+        :param preset: the speed and threading settings
+        """
+        assert svc is None or codec == VpxCodec.VP9, "SVC requires VP9"
+        assert (
+            temporal_layers == 1 or codec == VpxCodec.VP8
+        ), "temporal_layers requires VP8, use svc for VP9"
         match codec:
             case VpxCodec.VP8:
                 self.cx = lib.vpx_codec_vp8_cx()
@@ -268,27 +756,254 @@ class Vp8Encoder:
         self.cfg = ffi.new("vpx_codec_enc_cfg_t *")
         lib.vpx_codec_enc_config_default(self.cx, self.cfg, 0)
 
-        self.buffer = bytearray(8000)
+        self.output_pool = BufferPool()
+        self.output: Optional[bytearray] = None
+        self.chroma_buffer = bytearray()
         self.codec = None
+        self.vpx_codec = codec
+        self.reformatter = VideoReformatter()
         self.picture_id = random.randint(0, (1 << 15) - 1)
+        self.svc = svc
+        self.temporal_layers = temporal_layers
+        self.temporal_pattern = _vp8_temporal_pattern(temporal_layers)
+        self.temporal_index = 0
+        self.temporal_id = 0
+        self.layer_sync = 0
+        self.tl0picidx = 0
+        self.keyidx = 0
         self.timestamp_increment = VIDEO_CLOCK_RATE // MAX_FRAME_RATE
         self.__target_bitrate = target_bitrate
         self.__update_config_needed = False
+        self.__preset = preset
+        self.__preset_update_needed = False
 
     def __del__(self) -> None:
         if self.codec:
             lib.vpx_codec_destroy(self.codec)
 
     def encode(
-        self, frame: VideoFrame, force_keyframe: bool = False
+        self, frame: VideoFrame, force_keyframe: bool = False, headroom: int = 0
     ) -> Tuple[List[bytes], int]:
         """
+        :param headroom: if non-zero, each payload is a bytearray with this many bytes
+            reserved at the front, so the RTP header can be written in place
         :return: a list of packets encoding the image, and the timestamp in the video time base
         """
         if frame.format.name != "yuv420p":
-            frame = frame.reformat(format="yuv420p")
+            frame = self.reformatter.reformat(frame, format="yuv420p")
+
+        bitstream, keyframe = self._encode_bitstream(frame, force_keyframe)
+
+        # packetize
+        payloads = self._packetize_frame(
+            bitstream, keyframe, (frame.width, frame.height), headroom
+        )
+        timestamp = convert_timebase(frame.pts, frame.time_base, VIDEO_TIME_BASE)
+        return payloads, timestamp
+
+    def encode_layers(
+        self, frame: VideoFrame, force_keyframe: bool = False, headroom: int = 0
+    ) -> Tuple[List[VpxLayer], int]:
+        """
+        Encode a frame as :meth:`encode`, with the packets grouped by layer and
+        tagged with their spatial and temporal layer IDs, so that layers can be
+        forwarded selectively. Unlayered streams have a single layer.
+        """
+        if frame.format.name != "yuv420p":
+            frame = self.reformatter.reformat(frame, format="yuv420p")
+
+        bitstream, keyframe = self._encode_bitstream(frame, force_keyframe)
+
+        layers = self._packetize_layers(
+            bitstream, keyframe, (frame.width, frame.height), headroom
+        )
+        assert frame.pts is not None and frame.time_base is not None
+        timestamp = convert_timebase(frame.pts, frame.time_base, VIDEO_TIME_BASE)
+        return layers, timestamp
+
+    def encode_i420(
+        self,
+        data: Any,
+        width: int,
+        height: int,
+        pts: int,
+        force_keyframe: bool = False,
+        headroom: int = 0,
+    ) -> Tuple[List[bytes], int]:
+        """
+        Encode a contiguous I420 image from any buffer, such as shared memory,
+        without building a VideoFrame.
+
+        :param pts: the presentation timestamp in the video time base
+        :return: a list of packets encoding the image, and the timestamp
+        """
+        chroma_width = (width + 1) >> 1
+        chroma_size = chroma_width * ((height + 1) >> 1)
+        buffer = ffi.from_buffer(data)
+        assert len(buffer) >= width * height + 2 * chroma_size, "buffer is too small"
+
+        bitstream, keyframe = self._encode_image(
+            width,
+            height,
+            [buffer, buffer + width * height, buffer + width * height + chroma_size],
+            [width, chroma_width, chroma_width],
+            pts,
+            force_keyframe,
+        )
+
+        payloads = self._packetize_frame(bitstream, keyframe, (width, height), headroom)
+        return payloads, pts
+
+    def encode_planes(
+        self,
+        planes: Sequence[Any],
+        strides: Sequence[int],
+        width: int,
+        height: int,
+        pts: int,
+        pixel_format: str = "yuv420p",
+        force_keyframe: bool = False,
+        headroom: int = 0,
+    ) -> Tuple[List[bytes], int]:
+        """
+        Encode an image from the buffers of its planes, such as NumPy arrays,
+        without building a VideoFrame. The planes are read in place, except for
+        the chroma of NV12 images which libvpx needs split into U and V.
+
+        :param planes: the Y, U and V planes for "yuv420p", or the Y and the
+            interleaved UV planes for "nv12"
+        :param strides: the length in bytes of a row of each plane
+        :param pts: the presentation timestamp in the video time base
+        :return: a list of packets encoding the image, and the timestamp
+        """
+        chroma_width = (width + 1) >> 1
+        chroma_height = (height + 1) >> 1
+        buffers = [ffi.from_buffer(plane) for plane in planes]
+        if pixel_format == "yuv420p":
+            assert len(buffers) == 3, "yuv420p images have 3 planes"
+            sizes = [(width, height), (chroma_width, chroma_height)] * 2
+        elif pixel_format == "nv12":
+            assert len(buffers) == 2, "nv12 images have 2 planes"
+            sizes = [(width, height), (2 * chroma_width, chroma_height)]
+        else:
+            raise ValueError(f"Unsupported pixel format {pixel_format}")
+        for buffer, stride, (plane_width, plane_height) in zip(buffers, strides, sizes):
+            assert stride >= plane_width, "stride is too small"
+            assert (
+                len(buffer) >= stride * (plane_height - 1) + plane_width
+            ), "buffer is too small"
+
+        pointers = list(buffers)
+        plane_strides = list(strides)
+        if pixel_format == "nv12":
+            size = chroma_width * chroma_height
+            if len(self.chroma_buffer) < 2 * size:
+                self.chroma_buffer = bytearray(2 * size)
+            chroma = ffi.from_buffer(self.chroma_buffer)
+            lib.vpx_rtp_split_uv(
+                chroma,
+                chroma + size,
+                chroma_width,
+                buffers[1],
+                strides[1],
+                chroma_width,
+                chroma_height,
+            )
+            pointers[1:] = [chroma, chroma + size]
+            plane_strides[1:] = [chroma_width, chroma_width]
+
+        bitstream, keyframe = self._encode_image(
+            width, height, pointers, plane_strides, pts, force_keyframe
+        )
+
+        payloads = self._packetize_frame(bitstream, keyframe, (width, height), headroom)
+        return payloads, pts
+
+    def encode_ndarray(
+        self,
+        array: Any,
+        pts: int,
+        pixel_format: str = "yuv420p",
+        force_keyframe: bool = False,
+        headroom: int = 0,
+    ) -> Tuple[List[bytes], int]:
+        """
+        Encode a contiguous image of ``height * 3 // 2`` rows of `width` bytes
+        holding its planes one after the other, as produced by
+        ``cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420)``. Any C-contiguous
+        two-dimensional buffer of bytes is accepted.
+
+        :param pixel_format: "yuv420p" or "nv12"
+        :param pts: the presentation timestamp in the video time base
+        :return: a list of packets encoding the image, and the timestamp
+        """
+        view = memoryview(array)
+        assert view.ndim == 2 and view.itemsize == 1, "expected a 2D array of bytes"
+        assert view.c_contiguous, "array must be C-contiguous"
+        rows, width = cast(Tuple[int, int], view.shape)
+        assert rows % 3 == 0 and width % 2 == 0, "image sizes must be even"
+        height = rows * 2 // 3
+
+        data = view.cast("B")
+        if pixel_format == "yuv420p":
+            return self.encode_i420(
+                data,
+                width,
+                height,
+                pts,
+                force_keyframe=force_keyframe,
+                headroom=headroom,
+            )
+        return self.encode_planes(
+            [data[: width * height], data[width * height :]],
+            [width, width],
+            width,
+            height,
+            pts,
+            pixel_format=pixel_format,
+            force_keyframe=force_keyframe,
+            headroom=headroom,
+        )
+
+    def _encode_bitstream(
+        self, frame: VideoFrame, force_keyframe: bool
+    ) -> Tuple[memoryview, bool]:
+        """
+        Encode a yuv420p frame, returning a view of the bitstream which is only valid
+        until the next call to the encoder, and whether it is a keyframe.
+        """
+        assert frame.pts is not None, "Frame must have a PTS"
+        return self._encode_image(
+            frame.width,
+            frame.height,
+            [plane.buffer_ptr for plane in frame.planes],
+            [plane.line_size for plane in frame.planes],
+            frame.pts,
+            force_keyframe,
+        )
 
-        if self.codec and (frame.width != self.cfg.g_w or frame.height != self.cfg.g_h):
+    def _encode_image(
+        self,
+        width: int,
+        height: int,
+        planes: List[Any],
+        strides: List[int],
+        pts: int,
+        force_keyframe: bool,
+    ) -> Tuple[memoryview, bool]:
+        """
+        Encode I420 planes, given as pointers or addresses, returning a view of the
+        bitstream which is only valid until the next call to the encoder, and whether
+        it is a keyframe.
+        """
+        if self.codec and (
+            width != self.cfg.g_w
+            or height != self.cfg.g_h
+            or (
+                self.__preset_update_needed
+                and self.__threads(width, height) != self.cfg.g_threads
+            )
+        ):
             lib.vpx_codec_destroy(self.codec)
             self.codec = None
 
@@ -298,11 +1013,9 @@ class Vp8Encoder:
             self.cfg.g_timebase.num = 1
             self.cfg.g_timebase.den = VIDEO_CLOCK_RATE
             self.cfg.g_lag_in_frames = 0
-            self.cfg.g_threads = number_of_threads(
-                frame.width * frame.height, multiprocessing.cpu_count()
-            )
-            self.cfg.g_w = frame.width
-            self.cfg.g_h = frame.height
+            self.cfg.g_threads = self.__threads(width, height)
+            self.cfg.g_w = width
+            self.cfg.g_h = height
             self.cfg.rc_resize_allowed = 0
             self.cfg.rc_end_usage = lib.VPX_CBR
             self.cfg.rc_min_quantizer = 2
@@ -314,18 +1027,16 @@ class Vp8Encoder:
             self.cfg.rc_buf_sz = 1000
             self.cfg.kf_mode = lib.VPX_KF_AUTO
             self.cfg.kf_max_dist = 3000
+            if self.svc is not None:
+                self.__configure_layers()
+            elif self.temporal_layers > 1:
+                self.__configure_temporal_layers()
             self.__update_config()
             _vpx_assert(lib.vpx_codec_enc_init(self.codec, self.cx, self.cfg, 0))
+            if self.svc is not None:
+                self.__enable_svc()
 
-            lib.vpx_codec_control_(
-                self.codec, lib.VP8E_SET_NOISE_SENSITIVITY, ffi.cast("int", 4)
-            )
-            lib.vpx_codec_control_(
-                self.codec, lib.VP8E_SET_STATIC_THRESHOLD, ffi.cast("int", 1)
-            )
-            lib.vpx_codec_control_(
-                self.codec, lib.VP8E_SET_CPUUSED, ffi.cast("int", -6)
-            )
+            self.__apply_preset()
             lib.vpx_codec_control_(
                 self.codec,
                 lib.VP8E_SET_TOKEN_PARTITIONS,
@@ -337,66 +1048,111 @@ class Vp8Encoder:
             lib.vpx_img_wrap(
                 self.image,
                 lib.VPX_IMG_FMT_I420,
-                frame.width,
-                frame.height,
+                width,
+                height,
                 1,
                 ffi.cast("void*", 1),
             )
-        elif self.__update_config_needed:
-            self.__update_config()
-            _vpx_assert(lib.vpx_codec_enc_config_set(self.codec, self.cfg))
+        else:
+            if self.__update_config_needed:
+                self.__update_config()
+                _vpx_assert(lib.vpx_codec_enc_config_set(self.codec, self.cfg))
+            if self.__preset_update_needed:
+                self.__apply_preset()
 
         # setup image
         for p in range(3):
-            self.image.planes[p] = ffi.cast("void*", frame.planes[p].buffer_ptr)
-            self.image.stride[p] = frame.planes[p].line_size
+            self.image.planes[p] = ffi.cast("void*", planes[p])
+            self.image.stride[p] = strides[p]
 
         # encode frame
         flags = 0
         if force_keyframe:
             flags |= lib.VPX_EFLAG_FORCE_KF
+        if self.temporal_layers > 1:
+            if force_keyframe:
+                tid, layer_sync = 0, 0
+            else:
+                tid, layer_sync, layer_flags = self.temporal_pattern[
+                    self.temporal_index % len(self.temporal_pattern)
+                ]
+                flags |= layer_flags
+            lib.vpx_codec_control_(
+                self.codec, lib.VP8E_SET_TEMPORAL_LAYER_ID, ffi.cast("int", tid)
+            )
         _vpx_assert(
             lib.vpx_codec_encode(
                 self.codec,
                 self.image,
-                frame.pts,
+                pts,
                 self.timestamp_increment,
                 flags,
-                lib.VPX_DL_REALTIME,
+                (
+                    lib.VPX_DL_REALTIME
+                    if self.__preset.deadline is None
+                    else self.__preset.deadline
+                ),
             )
         )
 
+        if self.svc is not None:
+            _vpx_assert(
+                lib.vpx_codec_control_(
+                    self.codec, lib.VP9E_GET_SVC_LAYER_ID, self.layer_id
+                )
+            )
+            self.temporal_id = self.layer_id.temporal_layer_id
+
         it = ffi.new("vpx_codec_iter_t *")
-        length = 0
+        chunks: List[Any] = []
+        keyframe = False
         while True:
             pkt = lib.vpx_codec_get_cx_data(self.codec, it)
             if not pkt:
                 break
             elif pkt.kind == lib.VPX_CODEC_CX_FRAME_PKT:
-                # resize buffer if needed
-                if length + pkt.data.frame.sz > len(self.buffer):
-                    new_buffer = bytearray(length + pkt.data.frame.sz)
-                    new_buffer[0:length] = self.buffer[0:length]
-                    self.buffer = new_buffer
-
-                # append new data
-                self.buffer[length : length + pkt.data.frame.sz] = ffi.buffer(
-                    pkt.data.frame.buf, pkt.data.frame.sz
-                )
-                length += pkt.data.frame.sz
-
-        # packetize
-        payloads = self._packetize(self.buffer[:length], self.picture_id)
-        timestamp = convert_timebase(frame.pts, frame.time_base, VIDEO_TIME_BASE)
-        self.picture_id = (self.picture_id + 1) % (1 << 15)
-        return payloads, timestamp
+                chunks.append(ffi.buffer(pkt.data.frame.buf, pkt.data.frame.sz))
+                keyframe |= bool(pkt.data.frame.flags & lib.VPX_FRAME_IS_KEY)
+
+        if self.temporal_layers > 1:
+            # a keyframe starts the temporal pattern over
+            if keyframe:
+                tid, layer_sync = 0, 0
+                self.temporal_index = 0
+            self.temporal_id = tid
+            self.layer_sync = layer_sync
+            self.temporal_index += 1
+
+        # the usual single packet is packetized straight out of libvpx's memory
+        if len(chunks) == 1:
+            return memoryview(chunks[0]), keyframe
+
+        # layers output separately are gathered into a single superframe
+        if self.svc is not None and len(chunks) > 1:
+            chunks = [
+                frame for chunk in chunks for frame in vp9_superframe_frames(chunk)
+            ]
+            chunks.append(vp9_superframe_index([len(frame) for frame in chunks]))
+
+        # gather the chunks into a pooled buffer, the previous frame's being done with
+        length = sum(len(chunk) for chunk in chunks)
+        if self.output is not None:
+            self.output_pool.release(self.output)
+        self.output = self.output_pool.acquire(length)
 
-    def pack(self, packet: Packet) -> Tuple[List[bytes], int]:
-        payloads = self._packetize(bytes(packet), self.picture_id)
+        pos = 0
+        for chunk in chunks:
+            self.output[pos : pos + len(chunk)] = chunk
+            pos += len(chunk)
+        return memoryview(self.output)[:length], keyframe
+
+    def pack(self, packet: Packet, headroom: int = 0) -> Tuple[List[bytes], int]:
+        payloads = self._packetize_frame(
+            memoryview(packet), packet.is_keyframe, None, headroom
+        )
 
         assert packet.pts is not None, "Packet must have a PTS"
         timestamp = convert_timebase(packet.pts, packet.time_base, VIDEO_TIME_BASE)
-        self.picture_id = (self.picture_id + 1) % (1 << 15)
         return payloads, timestamp
 
     @property
@@ -412,27 +1168,608 @@ class Vp8Encoder:
             self.__target_bitrate = bitrate
             self.__update_config_needed = True
 
+    @property
+    def preset(self) -> EncoderPreset:
+        """
+        Speed and threading settings, applied from the next frame.
+        """
+        return self.__preset
+
+    @preset.setter
+    def preset(self, preset: EncoderPreset) -> None:
+        if preset != self.__preset:
+            self.__preset = preset
+            self.__preset_update_needed = True
+
+    def _packetize_frame(
+        self,
+        buffer: bytes | memoryview,
+        keyframe: bool,
+        resolution: Optional[Tuple[int, int]],
+        headroom: int,
+    ) -> List[bytes]:
+        return [
+            payload
+            for layer in self._packetize_layers(buffer, keyframe, resolution, headroom)
+            for payload in layer.payloads
+        ]
+
+    def _packetize_layers(
+        self,
+        buffer: bytes | memoryview,
+        keyframe: bool,
+        resolution: Optional[Tuple[int, int]],
+        headroom: int,
+    ) -> List[VpxLayer]:
+        if self.svc is not None:
+            layers = self._packetize_svc(buffer, keyframe, resolution, headroom)
+        elif self.vpx_codec == VpxCodec.VP9:
+            layers = [
+                VpxLayer(
+                    0,
+                    0,
+                    self._packetize_vp9(
+                        buffer, self.picture_id, keyframe, resolution, headroom
+                    ),
+                )
+            ]
+        else:
+            descr = VpxPayloadDescriptor(
+                partition_start=1, partition_id=0, picture_id=self.picture_id
+            )
+            if self.temporal_layers > 1:
+                if keyframe:
+                    self.keyidx = (self.keyidx + 1) % 32
+                if self.temporal_id == 0:
+                    self.tl0picidx = (self.tl0picidx + 1) % 256
+                descr.tl0picidx = self.tl0picidx
+                descr.tid = (self.temporal_id, self.layer_sync)
+                descr.keyidx = self.keyidx
+            layers = [
+                VpxLayer(0, self.temporal_id, self._packetize(buffer, descr, headroom))
+            ]
+        self.picture_id = (self.picture_id + 1) % (1 << 15)
+        return layers
+
     @classmethod
-    def _packetize(cls, buffer: bytes, picture_id: int) -> List[bytes]:
-        payloads = []
-        descr = VpxPayloadDescriptor(
-            partition_start=1, partition_id=0, picture_id=picture_id
+    def _packetize(
+        cls, buffer: bytes | memoryview, descr: VpxPayloadDescriptor, headroom: int = 0
+    ) -> List[bytes]:
+        payloads: List[bytes] = []
+        descr_bytes = bytes(descr)
+        descr.partition_start = 0
+        next_descr_bytes = bytes(descr)
+
+        view = memoryview(buffer)
+        length = len(view)
+        pos = 0
+        while pos < length:
+            size = min(length - pos, PACKET_MAX - len(descr_bytes))
+            payloads.append(_payload(descr_bytes, view[pos : pos + size], headroom))
+            descr_bytes = next_descr_bytes
+            pos += size
+        return payloads
+
+    @classmethod
+    def _packetize_vp9(
+        cls,
+        buffer: bytes | memoryview,
+        picture_id: int,
+        keyframe: bool,
+        resolution: Optional[Tuple[int, int]] = None,
+        headroom: int = 0,
+    ) -> List[bytes]:
+        descr = Vp9PayloadDescriptor(
+            start_of_frame=1,
+            end_of_frame=0,
+            picture_id=picture_id,
+            inter_picture_predicted=int(not keyframe),
         )
-        length = len(buffer)
+        if keyframe and resolution is not None:
+            descr.scalability_structure = Vp9ScalabilityStructure([resolution])
+        return cls._packetize_vp9_layer(buffer, descr, headroom)
+
+    def _packetize_svc(
+        self,
+        buffer: bytes | memoryview,
+        keyframe: bool,
+        resolution: Optional[Tuple[int, int]],
+        headroom: int,
+    ) -> List[VpxLayer]:
+        """
+        Packetize each spatial layer of a superframe separately, in non-flexible
+        mode: the temporal pattern is described by the scalability structure sent
+        on keyframes.
+        """
+        assert self.svc is not None
+        tid = self.temporal_id
+        if tid == 0:
+            self.tl0picidx = (self.tl0picidx + 1) % 256
+
+        layers = []
+        for sid, frame in enumerate(vp9_superframe_frames(buffer)):
+            descr = Vp9PayloadDescriptor(
+                start_of_frame=1,
+                end_of_frame=0,
+                picture_id=self.picture_id,
+                inter_picture_predicted=int(not keyframe),
+                tid=tid,
+                switching_up=int(tid > 0),
+                sid=sid,
+                inter_layer_predicted=int(sid > 0),
+                tl0picidx=self.tl0picidx,
+            )
+            if keyframe and sid == 0 and resolution is not None:
+                descr.scalability_structure = Vp9ScalabilityStructure(
+                    [
+                        self.svc.resolution(layer, *resolution)
+                        for layer in range(self.svc.spatial_layers)
+                    ],
+                    pictures=self.svc.pictures,
+                )
+            layers.append(
+                VpxLayer(sid, tid, self._packetize_vp9_layer(frame, descr, headroom))
+            )
+        return layers
+
+    @staticmethod
+    def _packetize_vp9_layer(
+        buffer: bytes | memoryview, descr: Vp9PayloadDescriptor, headroom: int
+    ) -> List[bytes]:
+        """
+        Split a frame into packets, with the scalability structure of `descr` in
+        the first packet only.
+        """
+        payloads: List[bytes] = []
+        descr_bytes = bytes(descr)
+        descr.start_of_frame = 0
+        descr.scalability_structure = None
+        next_descr_bytes = bytes(descr)
+
+        view = memoryview(buffer)
+        length = len(view)
         pos = 0
         while pos < length:
-            descr_bytes = bytes(descr)
             size = min(length - pos, PACKET_MAX - len(descr_bytes))
-            payloads.append(descr_bytes + buffer[pos : pos + size])
-            descr.partition_start = 0
+            if pos + size == length:
+                # end of frame
+                descr_bytes = bytes([descr_bytes[0] | 0x04]) + descr_bytes[1:]
+            payloads.append(_payload(descr_bytes, view[pos : pos + size], headroom))
+            descr_bytes = next_descr_bytes
             pos += size
         return payloads
 
+    def __configure_layers(self) -> None:
+        assert self.svc is not None
+        pictures = self.svc.pictures
+        temporal_layers = self.svc.temporal_layers
+        self.cfg.ss_number_layers = self.svc.spatial_layers
+        self.cfg.ts_number_layers = temporal_layers
+        self.cfg.ts_periodicity = len(pictures)
+        for i, (tid, switching_up, p_diffs) in enumerate(pictures):
+            self.cfg.ts_layer_id[i] = tid
+        for tid in range(temporal_layers):
+            self.cfg.ts_rate_decimator[tid] = 1 << (temporal_layers - 1 - tid)
+        self.cfg.temporal_layering_mode = self.__temporal_layering_mode()
+
+    def __apply_preset(self) -> None:
+        preset = self.__preset
+        controls = [
+            (lib.VP8E_SET_CPUUSED, preset.cpu_used),
+            (lib.VP8E_SET_NOISE_SENSITIVITY, preset.noise_sensitivity),
+            (lib.VP8E_SET_STATIC_THRESHOLD, preset.static_threshold),
+        ]
+        if self.vpx_codec == VpxCodec.VP9:
+            controls += [
+                (lib.VP9E_SET_ROW_MT, int(preset.row_mt)),
+                (
+                    lib.VP9E_SET_FRAME_PARALLEL_DECODING,
+                    int(preset.frame_parallel_decoding),
+                ),
+            ]
+            if preset.tile_columns is not None:
+                controls.append((lib.VP9E_SET_TILE_COLUMNS, preset.tile_columns))
+            if preset.aq_mode is not None:
+                controls.append((lib.VP9E_SET_AQ_MODE, preset.aq_mode))
+
+        for control, value in controls:
+            lib.vpx_codec_control_(self.codec, control, ffi.cast("int", value))
+        self.__preset_update_needed = False
+
+    def __threads(self, width: int, height: int) -> int:
+        if self.__preset.threads is not None:
+            return self.__preset.threads
+        return number_of_threads(width * height, multiprocessing.cpu_count())
+
+    def __configure_temporal_layers(self) -> None:
+        self.cfg.g_error_resilient = lib.VPX_ERROR_RESILIENT_DEFAULT
+        self.cfg.ts_number_layers = self.temporal_layers
+        self.cfg.ts_periodicity = len(self.temporal_pattern)
+        for i, (tid, layer_sync, flags) in enumerate(self.temporal_pattern):
+            self.cfg.ts_layer_id[i] = tid
+        for tid in range(self.temporal_layers):
+            self.cfg.ts_rate_decimator[tid] = 1 << (self.temporal_layers - 1 - tid)
+
+    def __enable_svc(self) -> None:
+        assert self.svc is not None
+        _vpx_assert(
+            lib.vpx_codec_control_(self.codec, lib.VP9E_SET_SVC, ffi.cast("int", 1))
+        )
+
+        params = ffi.new("vpx_svc_extra_cfg_t *")
+        params.temporal_layering_mode = self.__temporal_layering_mode()
+        for sid in range(self.svc.spatial_layers):
+            for tid in range(self.svc.temporal_layers):
+                layer = sid * self.svc.temporal_layers + tid
+                params.max_quantizers[layer] = self.cfg.rc_max_quantizer
+                params.min_quantizers[layer] = self.cfg.rc_min_quantizer
+            num, den = self.svc.scaling_factor(sid)
+            params.scaling_factor_num[sid] = num
+            params.scaling_factor_den[sid] = den
+        _vpx_assert(
+            lib.vpx_codec_control_(self.codec, lib.VP9E_SET_SVC_PARAMETERS, params)
+        )
+        self.layer_id = ffi.new("vpx_svc_layer_id_t *")
+
+    def __temporal_layering_mode(self) -> int:
+        assert self.svc is not None
+        return {
+            1: lib.VP9E_TEMPORAL_LAYERING_MODE_NOLAYERING,
+            2: lib.VP9E_TEMPORAL_LAYERING_MODE_0101,
+            3: lib.VP9E_TEMPORAL_LAYERING_MODE_0212,
+        }[self.svc.temporal_layers]
+
     def __update_config(self) -> None:
-        self.cfg.rc_target_bitrate = self.__target_bitrate // 1000
+        # clear the flag first, so that a bitrate set from another thread while the
+        # config is updated is applied with the next frame
         self.__update_config_needed = False
+        target_bitrate = self.__target_bitrate
+        self.cfg.rc_target_bitrate = target_bitrate // 1000
+        self.output_pool.reserve(
+            target_bitrate // 8 // MAX_FRAME_RATE * KEYFRAME_SIZE_RATIO
+        )
+        if self.svc is not None:
+            bitrates = self.svc.layer_bitrates(target_bitrate)
+            for tid in range(self.svc.temporal_layers):
+                self.cfg.ts_target_bitrate[tid] = (
+                    sum(rates[tid] for rates in bitrates) // 1000
+                )
+            for sid, rates in enumerate(bitrates):
+                self.cfg.ss_target_bitrate[sid] = rates[-1] // 1000
+                for tid, rate in enumerate(rates):
+                    layer = sid * self.svc.temporal_layers + tid
+                    self.cfg.layer_target_bitrate[layer] = rate // 1000
+        elif self.temporal_layers > 1:
+            for tid, share in enumerate(SVC_TEMPORAL_RATES[self.temporal_layers]):
+                self.cfg.ts_target_bitrate[tid] = int(target_bitrate * share) // 1000
+
+
+def _vp8_temporal_pattern(temporal_layers: int) -> List[Tuple[int, int, int]]:
+    """
+    Return the temporal layer ID, layer sync bit and encoding flags of each frame of
+    the temporal pattern. Frames of the upper layers never update the references
+    or the entropy context used by lower layers, so they can be dropped.
+    """
+    no_ref = lib.VP8_EFLAG_NO_REF_GF | lib.VP8_EFLAG_NO_REF_ARF
+    no_upd = (
+        lib.VP8_EFLAG_NO_UPD_LAST
+        | lib.VP8_EFLAG_NO_UPD_GF
+        | lib.VP8_EFLAG_NO_UPD_ARF
+        | lib.VP8_EFLAG_NO_UPD_ENTROPY
+    )
+    base = no_ref | lib.VP8_EFLAG_NO_UPD_GF | lib.VP8_EFLAG_NO_UPD_ARF
+    if temporal_layers == 1:
+        return [(0, 0, 0)]
+    elif temporal_layers == 2:
+        return [(0, 0, base), (1, 1, no_ref | no_upd)]
+    elif temporal_layers == 3:
+        # the layer 1 frame updates the golden frame, which the next layer 2 uses
+        return [
+            (0, 0, base),
+            (2, 1, no_ref | no_upd),
+            (1, 1, no_ref | (no_upd & ~lib.VP8_EFLAG_NO_UPD_GF)),
+            (2, 0, lib.VP8_EFLAG_NO_REF_ARF | no_upd),
+        ]
+    raise ValueError("VP8 supports between 1 and 3 temporal layers")
+
+
+def vp9_superframe_frames(data: Any) -> List[memoryview]:
+    """
+    Split a VP9 superframe into its frames, using the index at its end described
+    in Annex B of the VP9 bitstream specification. Data without an index is a
+    single frame.
+    """
+    view = memoryview(data)
+    length = len(view)
+    if length:
+        marker = view[-1]
+        if marker & 0xE0 == 0xC0:
+            count = (marker & 0x07) + 1
+            size_bytes = ((marker >> 3) & 0x03) + 1
+            index_size = 2 + size_bytes * count
+            if length >= index_size and view[length - index_size] == marker:
+                frames = []
+                pos = 0
+                index = length - index_size + 1
+                for _ in range(count):
+                    size = int.from_bytes(view[index : index + size_bytes], "little")
+                    index += size_bytes
+                    if pos + size > length - index_size:
+                        raise ValueError("VP9 superframe index exceeds the data")
+                    frames.append(view[pos : pos + size])
+                    pos += size
+                return frames
+    return [view]
+
+
+def vp9_superframe_index(sizes: List[int]) -> bytes:
+    """
+    Build the index which ends a superframe of frames with the given sizes.
+    """
+    assert 1 <= len(sizes) <= 8, "a superframe has between 1 and 8 frames"
+    marker = 0xC0 | (3 << 3) | (len(sizes) - 1)
+    return (
+        bytes([marker])
+        + b"".join(size.to_bytes(4, "little") for size in sizes)
+        + bytes([marker])
+    )
+
+
+def _payload(descr_bytes: bytes, data: memoryview, headroom: int) -> bytes:
+    if headroom:
+        # write descriptor and payload once, leaving room for the RTP header
+        offset = headroom + len(descr_bytes)
+        payload = bytearray(offset + len(data))
+        payload[headroom:offset] = descr_bytes
+        payload[offset:] = data
+        return payload
+    return descr_bytes + data
+
+
+def vp8_depayload(payload: bytes | memoryview) -> bytes | memoryview:
+    descriptor, data = VpxPayloadDescriptor.parse(payload)
+    return data
 
 
-def vp8_depayload(payload: bytes) -> bytes:
-    descriptor, data = VpxPayloadDescriptor.parse(payload)
+def vp8_frame_start(packet: RtpPacket | RtpPacketView) -> bool:
+    """
+    Return whether the packet's payload descriptor marks the start of a frame.
+    """
+    return bool(packet.payload) and packet.payload[0] & 0x1F == 0x10
+
+
+class Vp8TemporalLayerFilter:
+    """
+    Drops the VP8 temporal layers above `temporal_id` from a stream of serialized
+    RTP packets without decoding them, as a relay would to lower the frame rate of
+    a receiver, and renumbers the packets it keeps so the receiver sees no gaps.
+
+    Changes to `temporal_id` take effect at the start of the next base layer frame,
+    from which the upper layers can be decoded again. Packets without a TID are
+    always kept.
+    """
+
+    def __init__(self, temporal_id: int = 0) -> None:
+        self.temporal_id = temporal_id
+        self._active_temporal_id = temporal_id
+        self._dropped: Deque[int] = deque(maxlen=LAYER_FILTER_HISTORY)
+        self._dropped_count = 0
+        self._highest: Optional[int] = None
+
+    def filter(self, data: bytes | bytearray) -> bytearray | None:
+        """
+        Return a renumbered copy of the packet, or None if it is dropped.
+        """
+        packet = RtpPacketView.parse(data)
+        sequence_number = packet.sequence_number
+        newer = self._highest is None or uint16_gt(sequence_number, self._highest)
+        if newer:
+            self._highest = sequence_number
+
+        descr, _ = VpxPayloadDescriptor.parse(packet.payload)
+        if descr.tid is not None:
+            tid = descr.tid[0]
+            if tid == 0 and descr.partition_start and descr.partition_id == 0:
+                self._active_temporal_id = self.temporal_id
+            if tid > self._active_temporal_id:
+                if newer:
+                    self._dropped.append(sequence_number)
+                    self._dropped_count += 1
+                return None
+
+        # late packets are only shifted by the packets dropped before them
+        offset = self._dropped_count
+        if not newer:
+            for dropped in reversed(self._dropped):
+                if not uint16_gt(dropped, sequence_number):
+                    break
+                offset -= 1
+
+        output = bytearray(data)
+        pack_into("!H", output, 2, (sequence_number - offset) & 0xFFFF)
+        return output
+
+
+def vp9_depayload(payload: bytes | memoryview) -> bytes | memoryview:
+    descriptor, data = Vp9PayloadDescriptor.parse(payload)
     return data
+
+
+def vp9_frame_start(packet: RtpPacket | RtpPacketView) -> bool:
+    """
+    Return whether the packet's payload descriptor has the beginning of frame bit.
+    """
+    return bool(packet.payload) and bool(packet.payload[0] & 0x08)
+
+
+class _FrameStart:
+    __slots__ = ("keyframe", "picture_id", "tid", "sync", "tl0picidx")
+
+    def __init__(
+        self,
+        keyframe: bool,
+        picture_id: Optional[int],
+        tid: Optional[int],
+        sync: bool,
+        tl0picidx: Optional[int],
+    ) -> None:
+        self.keyframe = keyframe
+        self.picture_id = picture_id
+        self.tid = tid
+        self.sync = sync
+        self.tl0picidx = tl0picidx
+
+
+class FrameDecodabilityTracker:
+    """
+    Follows the reference chain of a VP8 or VP9 stream, so that frames which depend
+    on a lost frame are skipped instead of decoded into garbage, until a keyframe
+    arrives.
+
+    Every received packet is passed to :meth:`add`, before its payload descriptor
+    is stripped, and every frame completed by the jitter buffer to
+    :meth:`decodable`. A frame is decodable if it is a keyframe, or if it starts at
+    a frame start and follows the last decodable frame: without a gap in sequence
+    numbers, with the next picture ID or, with temporal layers, with the next
+    TL0PICIDX for base layer frames and the same one for upper layer frames.
+    Skipping an upper layer frame does not stop the base layer from being decoded,
+    but frames of higher layers which are not layer sync frames are skipped until
+    the next sync frame of the skipped layer or the next base layer frame, as are
+    those of any upper layer after frames of unknown layers were lost.
+
+    While frames are skipped, :meth:`request_keyframe` returns True every
+    `request_interval` seconds, when a PLI should be sent.
+    """
+
+    def __init__(
+        self,
+        codec: VpxCodec = VpxCodec.VP8,
+        request_interval: float = KEYFRAME_REQUEST_INTERVAL,
+    ) -> None:
+        self.codec = codec
+        self.request_interval = request_interval
+        self.waiting_for_keyframe = True
+        self._starts: Dict[int, _FrameStart] = {}
+        self._last: Optional[_FrameStart] = None
+        self._last_sequence_number: Optional[int] = None
+        self._last_tl0picidx: Optional[int] = None
+        self._last_end: Optional[int] = None
+        self._skipped_layers: Set[int] = set()
+        self._skipping = False
+        self._last_request: Optional[float] = None
+
+    def add(self, packet: RtpPacket | RtpPacketView) -> None:
+        try:
+            if self.codec == VpxCodec.VP8:
+                if not vp8_frame_start(packet):
+                    return
+                descriptor, data = VpxPayloadDescriptor.parse(packet.payload)
+                start = _FrameStart(
+                    # the P bit of the VP8 payload header is clear on keyframes
+                    keyframe=bool(data) and not data[0] & 0x01,
+                    picture_id=descriptor.picture_id,
+                    tid=None if descriptor.tid is None else descriptor.tid[0],
+                    sync=descriptor.tid is not None and bool(descriptor.tid[1]),
+                    tl0picidx=descriptor.tl0picidx,
+                )
+            else:
+                if not vp9_frame_start(packet):
+                    return
+                vp9_descriptor, data = Vp9PayloadDescriptor.parse(packet.payload)
+                if vp9_descriptor.sid:
+                    return
+                start = _FrameStart(
+                    keyframe=not vp9_descriptor.inter_picture_predicted,
+                    picture_id=vp9_descriptor.picture_id,
+                    tid=vp9_descriptor.tid,
+                    sync=bool(vp9_descriptor.switching_up),
+                    tl0picidx=vp9_descriptor.tl0picidx,
+                )
+        except ValueError:
+            return
+
+        self._starts[packet.sequence_number] = start
+        if len(self._starts) > DECODABILITY_HISTORY:
+            del self._starts[next(iter(self._starts))]
+
+    def decodable(self, frame: JitterFrame) -> bool:
+        """
+        Return whether the frame can be decoded, which also decides whether the
+        frames which follow it can.
+        """
+        first = frame.sequence_numbers[0]
+        if self._last_end is not None and first != (self._last_end + 1) & 0xFFFF:
+            # the frames in between were lost, and may be of any upper layer, whose
+            # temporal layer IDs have 3 bits
+            self._skipped_layers.update(range(1, 8))
+        self._last_end = frame.sequence_numbers[-1]
+
+        # frames whose first packets were lost do not start at a frame start
+        start = self._starts.pop(first, None)
+        if start is None:
+            decodable = False
+        elif start.keyframe:
+            decodable = True
+        else:
+            decodable = not self.waiting_for_keyframe and self._follows(start, first)
+
+        if decodable:
+            assert start is not None
+            self._last = start
+            self._last_sequence_number = frame.sequence_numbers[-1]
+            if start.tl0picidx is not None and not start.tid:
+                self._last_tl0picidx = start.tl0picidx
+            if start.keyframe or not start.tid:
+                self._skipped_layers.clear()
+            elif start.sync:
+                self._skipped_layers.discard(start.tid)
+            self.waiting_for_keyframe = False
+            self._skipping = False
+        elif start is None or not start.tid or self.waiting_for_keyframe:
+            self.waiting_for_keyframe = True
+            self._skipping = True
+        else:
+            self._skipped_layers.add(start.tid)
+        return decodable
+
+    def request_keyframe(self, now: Optional[float] = None) -> bool:
+        """
+        Return whether a keyframe should be requested now.
+        """
+        if not self._skipping:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self._last_request is None or now - self._last_request >= (
+            self.request_interval
+        ):
+            self._last_request = now
+            return True
+        return False
+
+    def _follows(self, start: _FrameStart, sequence_number: int) -> bool:
+        last = self._last
+        assert last is not None and self._last_sequence_number is not None
+        # non-sync frames reference the last frames of the lower upper layers
+        if (
+            start.tid
+            and not start.sync
+            and any(layer < start.tid for layer in self._skipped_layers)
+        ):
+            return False
+
+        if sequence_number == (self._last_sequence_number + 1) & 0xFFFF:
+            return True
+
+        if start.tl0picidx is not None and self._last_tl0picidx is not None:
+            if start.tid:
+                return start.tl0picidx == self._last_tl0picidx
+            return start.tl0picidx == (self._last_tl0picidx + 1) & 0xFF
+
+        if start.picture_id is not None and last.picture_id is not None:
+            # 7-bit picture IDs wrap around sooner
+            return (start.picture_id - last.picture_id) & 0x7FFF == 1 or (
+                last.picture_id < 0x80
+                and start.picture_id == (last.picture_id + 1) & 0x7F
+            )
+        return False
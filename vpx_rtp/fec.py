@@ -0,0 +1,348 @@
+import math
+from collections import deque
+from struct import pack, unpack_from
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from typing_extensions import Self
+
+from vpx_rtp.rtp import RTP_HEADER_LENGTH
+from vpx_rtp.utils import random16, random32, uint16_add
+
+# Flexible Forward Error Correction (RFC 8627) with the flexible mask, protecting
+# the packets of a single stream. Each repair packet is the XOR of the packets it
+# protects, so it recovers any one of them.
+
+# repair packets per media packet of delta frames and of keyframes, which every
+# following frame depends on
+FEC_DELTA_PROTECTION = 0.1
+FEC_KEYFRAME_PROTECTION = 0.3
+
+# the flexible mask covers at most this many packets from its base
+FLEXFEC_MAX_MASK = 110
+
+# the mask ends after 15, 46 or 110 bits, each part but the last led by a k bit
+FLEXFEC_MASK_BITS = (15, 46, 110)
+
+FLEXFEC_HEADER_LENGTH = 8
+
+# received media packets kept to recover others from, and repair packets kept
+# until they can be used
+FEC_MEDIA_HISTORY = 1024
+FEC_REPAIR_HISTORY = 128
+
+
+def _recovery_bits(data: bytes | bytearray | memoryview) -> Tuple[int, int]:
+    """
+    Return the bits of an RTP packet which FEC protects, as an integer, and their
+    length: the first two bytes of the header, the length of everything after
+    the fixed header, the timestamp and everything after the fixed header.
+    """
+    length = len(data) - RTP_HEADER_LENGTH
+    value = int.from_bytes(
+        bytes(data[0:2]) + pack("!H", length) + bytes(data[4:8]), "big"
+    )
+    value = (value << (8 * length)) | int.from_bytes(data[RTP_HEADER_LENGTH:], "big")
+    return value, FLEXFEC_HEADER_LENGTH + length
+
+
+def _xor(
+    items: Sequence[Tuple[int, int]], length: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    XOR bit strings of different lengths, padding the shorter ones at the end.
+    """
+    if length is None:
+        length = max(item_length for value, item_length in items)
+    result = 0
+    for value, item_length in items:
+        result ^= value << (8 * (length - item_length))
+    return result, length
+
+
+def pack_flexfec_mask(offsets: Sequence[int]) -> bytes:
+    """
+    Serialize the flexible mask of packets at the given offsets from the base
+    sequence number.
+    """
+    last = max(offsets)
+    assert last < FLEXFEC_MAX_MASK, "packets are too far apart for one mask"
+    bits = 0
+    for offset in offsets:
+        bits |= 1 << (FLEXFEC_MAX_MASK - 1 - offset)
+
+    if last < FLEXFEC_MASK_BITS[0]:
+        return pack("!H", 0x8000 | (bits >> 95))
+    elif last < FLEXFEC_MASK_BITS[1]:
+        return pack("!HL", (bits >> 95), 0x80000000 | ((bits >> 64) & 0x7FFFFFFF))
+    return pack(
+        "!HLQ", (bits >> 95), (bits >> 64) & 0x7FFFFFFF, bits & 0xFFFFFFFFFFFFFFFF
+    )
+
+
+def unpack_flexfec_mask(data: bytes | memoryview, pos: int) -> Tuple[List[int], int]:
+    """
+    Parse a flexible mask, and return the offsets it covers and its length.
+    """
+    if len(data) < pos + 2:
+        raise ValueError("FlexFEC mask is truncated")
+    first = unpack_from("!H", data, pos)[0]
+    bits = (first & 0x7FFF) << 95
+    length = 2
+    if not first & 0x8000:
+        if len(data) < pos + 6:
+            raise ValueError("FlexFEC mask is truncated")
+        second = unpack_from("!L", data, pos + 2)[0]
+        bits |= (second & 0x7FFFFFFF) << 64
+        length = 6
+        if not second & 0x80000000:
+            if len(data) < pos + 14:
+                raise ValueError("FlexFEC mask is truncated")
+            bits |= unpack_from("!Q", data, pos + 6)[0]
+            length = 14
+    offsets = [
+        offset
+        for offset in range(FLEXFEC_MAX_MASK)
+        if bits >> (FLEXFEC_MAX_MASK - 1 - offset) & 1
+    ]
+    return offsets, length
+
+
+class FlexFecEncoder:
+    """
+    Generates FlexFEC repair packets for the RTP packets of a stream, sent as a
+    separate stream with its own payload type and SSRC.
+
+    The packets of each frame are protected with :meth:`protect`, keyframes more
+    heavily than delta frames. Repair packets are interleaved, the first protecting
+    the media packets 0, m, 2m... so that bursts of losses are recovered too.
+    """
+
+    def __init__(
+        self,
+        payload_type: int,
+        ssrc: Optional[int] = None,
+        sequence_number: Optional[int] = None,
+        delta_protection: float = FEC_DELTA_PROTECTION,
+        keyframe_protection: float = FEC_KEYFRAME_PROTECTION,
+    ) -> None:
+        self.payload_type = payload_type
+        self.ssrc = random32() if ssrc is None else ssrc
+        self.sequence_number = (
+            random16() if sequence_number is None else sequence_number
+        )
+        self.delta_protection = delta_protection
+        self.keyframe_protection = keyframe_protection
+
+    def protect(
+        self,
+        packets: Sequence[bytes | bytearray],
+        keyframe: bool = False,
+        protection: Optional[float] = None,
+    ) -> List[bytes]:
+        """
+        Return repair packets for the RTP packets of one frame, as written by
+        :meth:`RtpSender.write_headers`.
+
+        :param protection: repair packets per media packet, by default
+            :attr:`keyframe_protection` or :attr:`delta_protection`
+        """
+        if protection is None:
+            protection = self.keyframe_protection if keyframe else self.delta_protection
+        if not packets or protection <= 0:
+            return []
+
+        repairs = []
+        for start in range(0, len(packets), FLEXFEC_MAX_MASK):
+            chunk = packets[start : start + FLEXFEC_MAX_MASK]
+            count = min(math.ceil(len(chunk) * protection), len(chunk))
+            for first in range(count):
+                repairs.append(self._repair(chunk[first::count], chunk[0]))
+        return repairs
+
+    def _repair(
+        self, protected: Sequence[bytes | bytearray], first: bytes | bytearray
+    ) -> bytes:
+        base = unpack_from("!H", first, 2)[0]
+        offsets = [
+            uint16_add(unpack_from("!H", data, 2)[0], -base) for data in protected
+        ]
+        bits, length = _xor([_recovery_bits(data) for data in protected])
+        recovered = bits.to_bytes(length, "big")
+
+        timestamp, media_ssrc = unpack_from("!LL", first, 4)
+        header = pack(
+            "!BBHLLL",
+            0x81,
+            self.payload_type,
+            self.sequence_number,
+            timestamp,
+            self.ssrc,
+            media_ssrc,
+        )
+        self.sequence_number = uint16_add(self.sequence_number, 1)
+        return b"".join(
+            [
+                header,
+                bytes([recovered[0] & 0x3F]),
+                recovered[1:FLEXFEC_HEADER_LENGTH],
+                pack("!H", base),
+                pack_flexfec_mask(offsets),
+                recovered[FLEXFEC_HEADER_LENGTH:],
+            ]
+        )
+
+
+class _RepairPacket:
+    def __init__(
+        self, sequence_numbers: List[int], ssrc: int, bits: int, length: int
+    ) -> None:
+        self.sequence_numbers = sequence_numbers
+        self.ssrc = ssrc
+        self.bits = bits
+        self.length = length
+        self.missing: Set[int] = set()
+
+    @classmethod
+    def parse(cls, data: bytes | bytearray | memoryview) -> Self:
+        if len(data) < RTP_HEADER_LENGTH or data[0] & 0x0F != 1:
+            raise ValueError("FlexFEC packet must protect a single SSRC")
+        if data[0] & 0x30:
+            raise ValueError("FlexFEC packet has padding or extensions")
+
+        pos = RTP_HEADER_LENGTH + 4
+        if len(data) < pos + FLEXFEC_HEADER_LENGTH + 2:
+            raise ValueError("FlexFEC header is truncated")
+        if data[pos] & 0xC0:
+            raise ValueError("FlexFEC packet does not use the flexible mask")
+
+        ssrc = unpack_from("!L", data, RTP_HEADER_LENGTH)[0]
+        base = unpack_from("!H", data, pos + FLEXFEC_HEADER_LENGTH)[0]
+        offsets, mask_length = unpack_flexfec_mask(
+            data, pos + FLEXFEC_HEADER_LENGTH + 2
+        )
+        if not offsets:
+            raise ValueError("FlexFEC packet protects no packets")
+
+        payload_pos = pos + FLEXFEC_HEADER_LENGTH + 2 + mask_length
+        length = FLEXFEC_HEADER_LENGTH + len(data) - payload_pos
+        bits = int.from_bytes(
+            bytes(data[pos : pos + FLEXFEC_HEADER_LENGTH]) + bytes(data[payload_pos:]),
+            "big",
+        )
+        return cls(
+            sequence_numbers=[uint16_add(base, offset) for offset in offsets],
+            ssrc=ssrc,
+            bits=bits,
+            length=length,
+        )
+
+
+class FlexFecDecoder:
+    """
+    Recovers lost RTP packets of a stream from FlexFEC repair packets.
+
+    Every received packet of the stream, and every repair packet, is passed to
+    :meth:`add`, which returns the media packets it allowed to recover, ready to be
+    parsed and added to the jitter buffer. A repair packet recovers a packet as
+    soon as all but one of the packets it protects have arrived, without waiting
+    for a retransmission.
+    """
+
+    def __init__(self, payload_type: int) -> None:
+        self.payload_type = payload_type
+        self._media: Dict[int, Tuple[int, int]] = {}
+        self._repairs: Deque[_RepairPacket] = deque()
+        self._waiting: Dict[int, List[_RepairPacket]] = {}
+
+    def add(self, data: bytes | bytearray | memoryview) -> List[bytes]:
+        """
+        Add a received media or repair packet, and return the media packets it
+        recovered.
+        """
+        if len(data) < RTP_HEADER_LENGTH:
+            raise ValueError(f"RTP packet length is less than {RTP_HEADER_LENGTH}")
+
+        if data[1] & 0x7F == self.payload_type:
+            repair = _RepairPacket.parse(data)
+            repair.missing = {
+                x for x in repair.sequence_numbers if x not in self._media
+            }
+            if len(repair.missing) > 1:
+                self._wait(repair)
+                return []
+            ready = [repair] if repair.missing else []
+        else:
+            sequence_number = unpack_from("!H", data, 2)[0]
+            if sequence_number in self._media:
+                return []
+            self._remember(sequence_number, _recovery_bits(data))
+            ready = self._arrived(sequence_number)
+
+        # each recovered packet may complete other repair packets
+        recovered = []
+        while ready:
+            repair = ready.pop()
+            if len(repair.missing) != 1:
+                continue
+            sequence_number = repair.missing.pop()
+            packet = self._recover(repair, sequence_number)
+            if packet is not None:
+                recovered.append(packet)
+                self._remember(sequence_number, _recovery_bits(packet))
+                ready.extend(self._arrived(sequence_number))
+        return recovered
+
+    def _recover(self, repair: _RepairPacket, sequence_number: int) -> Optional[bytes]:
+        items = [(repair.bits, repair.length)]
+        for x in repair.sequence_numbers:
+            if x != sequence_number:
+                if x not in self._media:
+                    return None
+                items.append(self._media[x])
+        bits, length = _xor(items)
+        recovered = bits.to_bytes(length, "big")
+
+        payload_length = unpack_from("!H", recovered, 2)[0]
+        if FLEXFEC_HEADER_LENGTH + payload_length > length:
+            return None
+        return b"".join(
+            [
+                bytes([0x80 | (recovered[0] & 0x3F), recovered[1]]),
+                pack("!H", sequence_number),
+                recovered[4:FLEXFEC_HEADER_LENGTH],
+                pack("!L", repair.ssrc),
+                recovered[
+                    FLEXFEC_HEADER_LENGTH : FLEXFEC_HEADER_LENGTH + payload_length
+                ],
+            ]
+        )
+
+    def _remember(self, sequence_number: int, bits: Tuple[int, int]) -> None:
+        self._media[sequence_number] = bits
+        if len(self._media) > FEC_MEDIA_HISTORY:
+            del self._media[next(iter(self._media))]
+
+    def _wait(self, repair: _RepairPacket) -> None:
+        if len(self._repairs) == FEC_REPAIR_HISTORY:
+            oldest = self._repairs.popleft()
+            for x in oldest.missing:
+                waiting = self._waiting.get(x)
+                if waiting is not None and oldest in waiting:
+                    waiting.remove(oldest)
+                    if not waiting:
+                        del self._waiting[x]
+        self._repairs.append(repair)
+        for x in repair.missing:
+            self._waiting.setdefault(x, []).append(repair)
+
+    def _arrived(self, sequence_number: int) -> List[_RepairPacket]:
+        """
+        Return the repair packets which are only missing one packet now that
+        `sequence_number` arrived.
+        """
+        ready = []
+        for repair in self._waiting.pop(sequence_number, []):
+            repair.missing.discard(sequence_number)
+            if len(repair.missing) == 1:
+                ready.append(repair)
+        return ready
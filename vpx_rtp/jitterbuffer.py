@@ -1,7 +1,8 @@
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, cast
 
-from vpx_rtp.rtp import RtpPacket
-from vpx_rtp.utils import uint16_add
+from vpx_rtp.nack import NackGenerator
+from vpx_rtp.rtp import RtpPacket, RtpPacketView
+from vpx_rtp.utils import uint16_add, uint16_gt
 
 MAX_MISORDER = 100
 
@@ -15,22 +16,60 @@ class JitterFrame:
         self.sequence_numbers = sequence_numbers
 
 
+class _FrameState:
+    """
+    Bookkeeping for the packets of one timestamp currently held in the buffer.
+    """
+
+    __slots__ = ("count", "first", "last", "marker")
+
+    def __init__(self, sequence_number: int) -> None:
+        self.count = 0
+        self.first = sequence_number
+        self.last = sequence_number
+        self.marker: Optional[int] = None
+
+
 class JitterBuffer:
+    """
+    Reorders RTP packets and reassembles them into frames.
+
+    By default a frame is complete once the first packet of the next frame arrives.
+    If `frame_start` is given, a frame is also complete as soon as it is contiguous
+    from a packet for which `frame_start` returns True through the packet carrying
+    the RTP marker bit, which saves a full frame interval of latency.
+
+    If `nack_generator` is given, it is fed every accepted sequence number and told
+    when the buffer moves past missing packets, so it can request retransmissions.
+    """
+
     def __init__(
-        self, capacity: int, prefetch: int = 0, is_video: bool = False
+        self,
+        capacity: int,
+        prefetch: int = 0,
+        is_video: bool = False,
+        frame_start: Optional[Callable[[RtpPacket | RtpPacketView], bool]] = None,
+        nack_generator: Optional[NackGenerator] = None,
     ) -> None:
         assert capacity & (capacity - 1) == 0, "capacity must be a power of 2"
         self._capacity = capacity
         self._origin: Optional[int] = None
-        self._packets: List[Optional[RtpPacket]] = [None for i in range(capacity)]
+        self._packets: List[RtpPacket | RtpPacketView | None] = [
+            None for i in range(capacity)
+        ]
+        self._frames: Dict[int, _FrameState] = {}
         self._prefetch = prefetch
         self._is_video = is_video
+        self._frame_start = frame_start
+        self._nack = nack_generator
 
     @property
     def capacity(self) -> int:
         return self._capacity
 
-    def add(self, packet: RtpPacket) -> Tuple[bool, Optional[JitterFrame]]:
+    def add(
+        self, packet: RtpPacket | RtpPacketView
+    ) -> Tuple[bool, Optional[JitterFrame]]:
         pli_flag = False
         if self._origin is None:
             self._origin = packet.sequence_number
@@ -45,6 +84,8 @@ class JitterBuffer:
                 self.remove(self.capacity)
                 self._origin = packet.sequence_number
                 delta = misorder = 0
+                if self._nack is not None:
+                    self._nack.reset()
                 if self._is_video:
                     pli_flag = True
             else:
@@ -55,61 +96,114 @@ class JitterBuffer:
             excess = delta - self.capacity + 1
             if self.smart_remove(excess):
                 self._origin = packet.sequence_number
+                if self._nack is not None:
+                    self._nack.remove_before(self._origin)
             if self._is_video:
                 pli_flag = True
 
+        if self._nack is not None:
+            self._nack.add(packet.sequence_number)
+
         pos = packet.sequence_number % self._capacity
+        previous = self._packets[pos]
+        if previous is not None:
+            self._forget(previous)
         self._packets[pos] = packet
+        self._track(packet)
 
         return pli_flag, self._remove_frame(packet.sequence_number)
 
+    def _track(self, packet: RtpPacket | RtpPacketView) -> None:
+        sequence_number = packet.sequence_number
+        state = self._frames.get(packet.timestamp)
+        if state is None:
+            state = self._frames[packet.timestamp] = _FrameState(sequence_number)
+        elif sequence_number != state.last:
+            if uint16_gt(sequence_number, state.last):
+                state.last = sequence_number
+            elif uint16_gt(state.first, sequence_number):
+                state.first = sequence_number
+        state.count += 1
+        if packet.marker:
+            state.marker = sequence_number
+
+    def _forget(self, packet: RtpPacket | RtpPacketView) -> None:
+        state = self._frames[packet.timestamp]
+        state.count -= 1
+        if not state.count:
+            del self._frames[packet.timestamp]
+
     def _remove_frame(self, sequence_number: int) -> Optional[JitterFrame]:
-        frame = None
         frames = 0
-        packets = []
         remove = 0
-        timestamp = None
+        start = self._origin
 
-        assert self._origin is not None, "origin must be set"
+        assert start is not None, "origin must be set"
 
-        for count in range(self.capacity):
-            pos = (self._origin + count) % self._capacity
-            packet = self._packets[pos]
+        while True:
+            packet = self._packets[start % self._capacity]
             if packet is None:
-                break
-            if timestamp is None:
-                timestamp = packet.timestamp
-            elif packet.timestamp != timestamp:
-                # we now have a complete frame, only store the first one
-                if frame is None:
-                    frame = JitterFrame(
-                        data=b"".join([x._data for x in packets]),
-                        timestamp=timestamp,
-                        sequence_numbers=[x.sequence_number for x in packets],
-                    )
-                    remove = count
-
-                # check we have prefetched enough
-                frames += 1
-                if frames >= self._prefetch:
-                    self.remove(remove)
-                    return frame
-
-                # start a new frame
-                packets = []
-                timestamp = packet.timestamp
+                return None
+
+            # the frame is contiguous if every slot up to its last packet is its own
+            state = self._frames[packet.timestamp]
+            length = ((state.last - start) & 0xFFFF) + 1
+            if state.count != length:
+                return None
+
+            # and it is complete once it runs from a frame start to the marker bit,
+            # or once a packet from another frame follows it
+            end = (state.last + 1) & 0xFFFF
+            if not (
+                self._frame_start is not None
+                and state.marker == state.last
+                and self._frame_start(packet)
+            ):
+                following = self._packets[end % self._capacity]
+                if following is None or following.sequence_number != end:
+                    return None
+
+            # only return the first complete frame
+            if not remove:
+                remove = length
+
+            # check we have prefetched enough
+            frames += 1
+            if frames >= self._prefetch:
+                return self._pop_frame(remove)
+
+            start = end
+
+    def _pop_frame(self, count: int) -> JitterFrame:
+        assert self._origin is not None, "origin must be set"
+        packets = []
+        for i in range(count):
+            pos = (self._origin + i) % self._capacity
+            packets.append(cast(RtpPacket | RtpPacketView, self._packets[pos]))
+            self._packets[pos] = None
 
-            packets.append(packet)
+        # the frame's packets are exactly the ones we just took out of the ring
+        del self._frames[packets[0].timestamp]
+        self._origin = uint16_add(self._origin, count)
 
-        return None
+        return JitterFrame(
+            data=b"".join([x._data for x in packets]),
+            timestamp=packets[0].timestamp,
+            sequence_numbers=[x.sequence_number for x in packets],
+        )
 
     def remove(self, count: int) -> None:
         assert count <= self._capacity
         assert self._origin is not None, "origin must be set"
         for _ in range(count):
             pos = self._origin % self._capacity
-            self._packets[pos] = None
+            packet = self._packets[pos]
+            if packet is not None:
+                self._forget(packet)
+                self._packets[pos] = None
             self._origin = uint16_add(self._origin, 1)
+        if self._nack is not None:
+            self._nack.remove_before(self._origin)
 
     def smart_remove(self, count: int) -> bool:
         """
@@ -117,6 +211,7 @@ class JitterBuffer:
         to prevent sending corrupted frames to the decoder.
         """
         timestamp = None
+        emptied = False
         assert self._origin is not None, "origin must be set"
         for i in range(self._capacity):
             pos = self._origin % self._capacity
@@ -125,8 +220,11 @@ class JitterBuffer:
                 if i >= count and timestamp != packet.timestamp:
                     break
                 timestamp = packet.timestamp
+                self._forget(packet)
             self._packets[pos] = None
             self._origin = uint16_add(self._origin, 1)
             if i == self._capacity - 1:
-                return True
-        return False
+                emptied = True
+        if self._nack is not None:
+            self._nack.remove_before(self._origin)
+        return emptied
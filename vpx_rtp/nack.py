@@ -0,0 +1,122 @@
+import time
+from typing import Dict, List, Optional
+
+from vpx_rtp.rtcp import RtcpRtpfbPacket
+from vpx_rtp.rtp import RTCP_RTPFB_NACK
+from vpx_rtp.utils import uint16_add, uint16_gt
+
+NACK_RETRY_INTERVAL = 0.1  # seconds between NACKs for the same packet, about an RTT
+NACK_MAX_AGE = 1.0  # seconds after which a missing packet is given up on
+NACK_MAX_RETRIES = 10
+NACK_MAX_MISSING = 512  # larger gaps are better served by a keyframe
+
+# generic NACKs per RTCP packet, keeping it within a typical MTU
+NACK_MAX_PER_PACKET = 256
+
+
+class _MissingPacket:
+    def __init__(self, detected: float) -> None:
+        self.detected = detected
+        self.last_sent: Optional[float] = None
+        self.retries = 0
+
+
+class NackGenerator:
+    """
+    Tracks missing sequence numbers and decides when to NACK them.
+
+    Every received sequence number is passed to :meth:`add`, which is done by a
+    :class:`JitterBuffer` given this generator. :meth:`get_nacks` returns the
+    missing packets which are due a (re)transmission request, at most every
+    `retry_interval` seconds per packet, until the packet is `max_age` seconds old
+    or has been requested `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        retry_interval: float = NACK_RETRY_INTERVAL,
+        max_age: float = NACK_MAX_AGE,
+        max_retries: int = NACK_MAX_RETRIES,
+    ) -> None:
+        self.retry_interval = retry_interval
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self._newest: Optional[int] = None
+        self._missing: Dict[int, _MissingPacket] = {}
+
+    @property
+    def missing(self) -> List[int]:
+        return list(self._missing)
+
+    def add(self, sequence_number: int, now: Optional[float] = None) -> None:
+        if self._newest is None:
+            self._newest = sequence_number
+        elif uint16_gt(sequence_number, self._newest):
+            gap = uint16_add(sequence_number, -self._newest) - 1
+            if gap > NACK_MAX_MISSING:
+                self._missing.clear()
+            elif gap:
+                if now is None:
+                    now = time.monotonic()
+                for i in range(1, gap + 1):
+                    self._missing[uint16_add(self._newest, i)] = _MissingPacket(now)
+            self._newest = sequence_number
+        else:
+            self._missing.pop(sequence_number, None)
+
+    def remove_before(self, sequence_number: int) -> None:
+        """
+        Stop tracking missing packets older than `sequence_number`, for instance
+        because the jitter buffer has moved past them.
+        """
+        for missing in [x for x in self._missing if uint16_gt(sequence_number, x)]:
+            del self._missing[missing]
+
+    def reset(self) -> None:
+        self._newest = None
+        self._missing.clear()
+
+    def get_nacks(self, now: Optional[float] = None) -> List[int]:
+        """
+        Return the missing sequence numbers, in order, which should be NACKed now.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        lost = []
+        expired = []
+        for sequence_number, missing in self._missing.items():
+            if (
+                now - missing.detected > self.max_age
+                or missing.retries >= self.max_retries
+            ):
+                expired.append(sequence_number)
+            elif (
+                missing.last_sent is None
+                or now - missing.last_sent >= self.retry_interval
+            ):
+                missing.last_sent = now
+                missing.retries += 1
+                lost.append(sequence_number)
+
+        for sequence_number in expired:
+            del self._missing[sequence_number]
+
+        return lost
+
+    def get_nack_packets(
+        self, ssrc: int, media_ssrc: int, now: Optional[float] = None
+    ) -> List[RtcpRtpfbPacket]:
+        """
+        Return the generic NACK RTCP packets which should be sent now.
+        """
+        lost = self.get_nacks(now)
+        return [
+            RtcpRtpfbPacket(
+                fmt=RTCP_RTPFB_NACK,
+                ssrc=ssrc,
+                media_ssrc=media_ssrc,
+                lost=lost[i : i + NACK_MAX_PER_PACKET],
+            )
+            for i in range(0, len(lost), NACK_MAX_PER_PACKET)
+        ]
@@ -0,0 +1,636 @@
+import math
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, List, Optional, Tuple
+
+from vpx_rtp.rtcp import RtcpTransportFeedback
+
+# Delay-based bandwidth estimation after Google Congestion Control
+# (draft-ietf-rmcat-gcc-02). All times are in milliseconds and bitrates in bits
+# per second.
+
+# packets sent within this long of the first packet of a group form one group
+BURST_TIME = 5.0
+
+# packets arriving within this long of each other, and faster than they were
+# sent, belong to the same burst
+BURST_ARRIVAL_TIME = 5.0
+BURST_MAX_DURATION = 100.0
+
+# delay gradients in the trendline, the smoothing of the accumulated delay and
+# the gain applied to the slope before comparing it with the threshold
+TRENDLINE_WINDOW_SIZE = 20
+TRENDLINE_SMOOTHING = 0.9
+TRENDLINE_THRESHOLD_GAIN = 4.0
+TRENDLINE_MAX_DELTAS = 60
+
+# adaptive threshold of the overuse detector, and how long the trend must stay
+# above it to signal overuse
+OVERUSE_THRESHOLD = 12.5
+OVERUSE_THRESHOLD_MIN = 6.0
+OVERUSE_THRESHOLD_MAX = 600.0
+OVERUSE_K_UP = 0.0087
+OVERUSE_K_DOWN = 0.039
+OVERUSE_TIME = 10.0
+OVERUSE_MAX_ADAPT_OFFSET = 15.0
+OVERUSE_MAX_TIME_DELTA = 100.0
+
+# multiplicative decrease factor, and how far above the acknowledged bitrate the
+# estimate may grow
+AIMD_BETA = 0.85
+AIMD_THROUGHPUT_FACTOR = 1.5
+AIMD_THROUGHPUT_MARGIN = 10000
+AIMD_INCREASE_FACTOR = 1.08
+AIMD_MIN_INCREASE = 1000
+AIMD_MIN_ADDITIVE_INCREASE = 4000
+AIMD_DEFAULT_RTT = 200.0
+AIMD_FRAME_RATE = 30
+AIMD_PACKET_SIZE = 1200
+
+BWE_MIN_BITRATE = 30000
+BWE_MAX_BITRATE = 10000000
+
+# window over which the received bitrate is measured
+RATE_WINDOW = 1000.0
+
+# sent packets remembered until their transport feedback arrives
+SEND_HISTORY_SIZE = 2048
+
+# abs-send-time is in seconds, 6.18 fixed point, wrapping around every 64 s
+ABS_SEND_TIME_FRACTION_BITS = 18
+
+# how often the receiver-side estimate is updated, unless there is overuse
+REMOTE_UPDATE_INTERVAL = 100.0
+
+# how often a REMB is sent while the estimate holds, and how far it must drop for
+# one to be sent straight away
+REMB_INTERVAL = 1000.0
+REMB_DECREASE_RATIO = 0.97
+
+# streams not heard from for this long are left out of REMBs
+REMB_STREAM_TIMEOUT = 2000.0
+
+
+class BandwidthUsage(Enum):
+    NORMAL = 0
+    UNDERUSING = 1
+    OVERUSING = 2
+
+
+class RateControlState(Enum):
+    HOLD = 0
+    INCREASE = 1
+    DECREASE = 2
+
+
+class _PacketGroup:
+    def __init__(self, send_time: float, arrival_time: float, size: int) -> None:
+        self.first_send_time = send_time
+        self.send_time = send_time
+        self.first_arrival = arrival_time
+        self.complete_time = arrival_time
+        self.size = size
+
+
+class InterArrival:
+    """
+    Groups packets sent in bursts and computes the send time, arrival time and
+    size deltas between consecutive groups.
+    """
+
+    def __init__(self, burst_time: float = BURST_TIME) -> None:
+        self.burst_time = burst_time
+        self._current: Optional[_PacketGroup] = None
+        self._previous: Optional[_PacketGroup] = None
+
+    def compute(
+        self, send_time: float, arrival_time: float, size: int
+    ) -> Optional[Tuple[float, float, int]]:
+        """
+        Add a packet, and return the deltas between the previous two groups when
+        it starts a new one.
+        """
+        current = self._current
+        if current is None:
+            self._current = _PacketGroup(send_time, arrival_time, size)
+            return None
+
+        # reordered packets belong to a group which is already complete
+        if send_time < current.first_send_time:
+            return None
+
+        if not self._new_group(current, send_time, arrival_time):
+            current.send_time = max(current.send_time, send_time)
+            current.complete_time = arrival_time
+            current.size += size
+            return None
+
+        deltas = None
+        previous = self._previous
+        if previous is not None:
+            arrival_delta = current.complete_time - previous.complete_time
+            if arrival_delta >= 0:
+                deltas = (
+                    current.send_time - previous.send_time,
+                    arrival_delta,
+                    current.size - previous.size,
+                )
+        self._previous = current
+        self._current = _PacketGroup(send_time, arrival_time, size)
+        return deltas
+
+    def _new_group(
+        self, current: _PacketGroup, send_time: float, arrival_time: float
+    ) -> bool:
+        arrival_delta = arrival_time - current.complete_time
+        send_delta = send_time - current.send_time
+        if send_delta == 0:
+            return False
+        if (
+            arrival_delta - send_delta < 0
+            and arrival_delta <= BURST_ARRIVAL_TIME
+            and arrival_time - current.first_arrival < BURST_MAX_DURATION
+        ):
+            return False
+        return send_time - current.first_send_time > self.burst_time
+
+
+class TrendlineEstimator:
+    """
+    Fits a line to the smoothed accumulated delay of recent packet groups. A
+    positive slope means queues are building up along the path.
+    """
+
+    def __init__(
+        self,
+        window_size: int = TRENDLINE_WINDOW_SIZE,
+        smoothing: float = TRENDLINE_SMOOTHING,
+        threshold_gain: float = TRENDLINE_THRESHOLD_GAIN,
+    ) -> None:
+        self.window_size = window_size
+        self.smoothing = smoothing
+        self.threshold_gain = threshold_gain
+        self.num_deltas = 0
+        self._first_arrival: Optional[float] = None
+        self._accumulated_delay = 0.0
+        self._smoothed_delay = 0.0
+        self._history: Deque[Tuple[float, float]] = deque(maxlen=window_size)
+        self._trend = 0.0
+
+    def update(
+        self, arrival_delta: float, send_delta: float, arrival_time: float
+    ) -> float:
+        """
+        Add the deltas of a packet group and return the modified trend, the slope
+        scaled by the number of deltas seen and the threshold gain.
+        """
+        if self._first_arrival is None:
+            self._first_arrival = arrival_time
+        self.num_deltas = min(self.num_deltas + 1, TRENDLINE_MAX_DELTAS)
+
+        self._accumulated_delay += arrival_delta - send_delta
+        self._smoothed_delay = (
+            self.smoothing * self._smoothed_delay
+            + (1 - self.smoothing) * self._accumulated_delay
+        )
+        self._history.append((arrival_time - self._first_arrival, self._smoothed_delay))
+        if len(self._history) == self.window_size:
+            slope = _linear_fit_slope(self._history)
+            if slope is not None:
+                self._trend = slope
+
+        return self.num_deltas * self._trend * self.threshold_gain
+
+
+def _linear_fit_slope(points: Deque[Tuple[float, float]]) -> Optional[float]:
+    x_avg = sum(x for x, y in points) / len(points)
+    y_avg = sum(y for x, y in points) / len(points)
+    numerator = 0.0
+    denominator = 0.0
+    for x, y in points:
+        numerator += (x - x_avg) * (y - y_avg)
+        denominator += (x - x_avg) * (x - x_avg)
+    return numerator / denominator if denominator else None
+
+
+class OveruseDetector:
+    """
+    Compares the delay trend with a threshold which adapts to it, so that the
+    estimator competes fairly with loss-based flows.
+    """
+
+    def __init__(self) -> None:
+        self.threshold = OVERUSE_THRESHOLD
+        self.state = BandwidthUsage.NORMAL
+        self._last_update: Optional[float] = None
+        self._previous_trend = 0.0
+        self._overuse_counter = 0
+        self._overuse_time: Optional[float] = None
+
+    def detect(
+        self, trend: float, send_delta: float, num_deltas: int, now: float
+    ) -> BandwidthUsage:
+        if num_deltas < 2:
+            return self.state
+
+        if trend > self.threshold:
+            if self._overuse_time is None:
+                # assume the overuse started half way through the interval
+                self._overuse_time = send_delta / 2
+            else:
+                self._overuse_time += send_delta
+            self._overuse_counter += 1
+            if (
+                self._overuse_time > OVERUSE_TIME
+                and self._overuse_counter > 1
+                and trend >= self._previous_trend
+            ):
+                self._overuse_time = 0.0
+                self._overuse_counter = 0
+                self.state = BandwidthUsage.OVERUSING
+        elif trend < -self.threshold:
+            self._overuse_time = None
+            self._overuse_counter = 0
+            self.state = BandwidthUsage.UNDERUSING
+        else:
+            self._overuse_time = None
+            self._overuse_counter = 0
+            self.state = BandwidthUsage.NORMAL
+
+        self._previous_trend = trend
+        self._update_threshold(trend, now)
+        return self.state
+
+    def _update_threshold(self, trend: float, now: float) -> None:
+        if self._last_update is None:
+            self._last_update = now
+
+        # spikes such as route changes should not move the threshold
+        if abs(trend) > self.threshold + OVERUSE_MAX_ADAPT_OFFSET:
+            self._last_update = now
+            return
+
+        k = OVERUSE_K_DOWN if abs(trend) < self.threshold else OVERUSE_K_UP
+        time_delta = min(now - self._last_update, OVERUSE_MAX_TIME_DELTA)
+        self.threshold += k * (abs(trend) - self.threshold) * time_delta
+        self.threshold = min(
+            max(self.threshold, OVERUSE_THRESHOLD_MIN), OVERUSE_THRESHOLD_MAX
+        )
+        self._last_update = now
+
+
+class AimdRateControl:
+    """
+    Additive increase, multiplicative decrease of the estimated bitrate, driven by
+    the detector's signal and the bitrate which actually got through.
+
+    The increase is multiplicative until an overuse gives an estimate of the link
+    capacity, then additive near that capacity.
+    """
+
+    def __init__(
+        self,
+        start_bitrate: int,
+        min_bitrate: int = BWE_MIN_BITRATE,
+        max_bitrate: int = BWE_MAX_BITRATE,
+    ) -> None:
+        self.current_bitrate = start_bitrate
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.rtt = AIMD_DEFAULT_RTT
+        self.state = RateControlState.HOLD
+        self._last_change: Optional[float] = None
+
+        # average and normalized variance of the bitrate at overuse, in kbps
+        self._link_capacity: Optional[float] = None
+        self._link_capacity_variance = 0.4
+
+    def update(
+        self, usage: BandwidthUsage, acked_bitrate: Optional[int], now: float
+    ) -> int:
+        """
+        Update and return the estimated bitrate.
+        """
+        if usage == BandwidthUsage.OVERUSING:
+            self.state = RateControlState.DECREASE
+        elif usage == BandwidthUsage.UNDERUSING:
+            self.state = RateControlState.HOLD
+        elif self.state == RateControlState.HOLD:
+            self.state = RateControlState.INCREASE
+
+        bitrate = float(self.current_bitrate)
+        if self.state == RateControlState.INCREASE:
+            if acked_bitrate is not None and self._link_capacity is not None:
+                std = math.sqrt(self._link_capacity_variance * self._link_capacity)
+                if acked_bitrate / 1000 > self._link_capacity + 3 * std:
+                    self._link_capacity = None
+
+            elapsed = 0.0 if self._last_change is None else now - self._last_change
+            elapsed = min(elapsed, 1000.0)
+            if self._link_capacity is not None:
+                bitrate += self._additive_increase(elapsed)
+            else:
+                bitrate += self._multiplicative_increase(elapsed)
+            self._last_change = now
+
+            # do not grow far beyond what actually gets through
+            if acked_bitrate is not None:
+                limit = AIMD_THROUGHPUT_FACTOR * acked_bitrate + AIMD_THROUGHPUT_MARGIN
+                bitrate = min(bitrate, max(limit, self.current_bitrate))
+        elif self.state == RateControlState.DECREASE:
+            if self._reduce_further(acked_bitrate, now):
+                if acked_bitrate is None:
+                    bitrate *= AIMD_BETA
+                else:
+                    decreased = AIMD_BETA * acked_bitrate
+                    if decreased > bitrate and self._link_capacity is not None:
+                        decreased = AIMD_BETA * self._link_capacity * 1000
+                    bitrate = min(bitrate, decreased)
+                    self._update_link_capacity(acked_bitrate / 1000)
+                self._last_change = now
+            self.state = RateControlState.HOLD
+
+        self.current_bitrate = int(
+            min(max(bitrate, self.min_bitrate), self.max_bitrate)
+        )
+        return self.current_bitrate
+
+    def _reduce_further(self, acked_bitrate: Optional[int], now: float) -> bool:
+        # give the previous decrease a round trip to take effect, unless the
+        # bitrate getting through is far below the estimate
+        if self._last_change is None or now - self._last_change >= min(
+            self.rtt, AIMD_DEFAULT_RTT
+        ):
+            return True
+        return acked_bitrate is not None and acked_bitrate < self.current_bitrate / 2
+
+    def _additive_increase(self, elapsed: float) -> float:
+        bits_per_frame = self.current_bitrate / AIMD_FRAME_RATE
+        packets_per_frame = math.ceil(bits_per_frame / (AIMD_PACKET_SIZE * 8))
+        packet_bits = bits_per_frame / packets_per_frame
+        response_time = (self.rtt + 100) / 1000
+        rate = max(AIMD_MIN_ADDITIVE_INCREASE, packet_bits / response_time)
+        return rate * elapsed / 1000
+
+    def _multiplicative_increase(self, elapsed: float) -> float:
+        alpha = AIMD_INCREASE_FACTOR ** (elapsed / 1000)
+        return max(self.current_bitrate * (alpha - 1), AIMD_MIN_INCREASE)
+
+    def _update_link_capacity(self, acked_kbps: float) -> None:
+        alpha = 0.05
+        if self._link_capacity is None:
+            self._link_capacity = acked_kbps
+        else:
+            self._link_capacity = (1 - alpha) * self._link_capacity + alpha * acked_kbps
+        norm = max(self._link_capacity, 1.0)
+        self._link_capacity_variance = (
+            1 - alpha
+        ) * self._link_capacity_variance + alpha * (
+            self._link_capacity - acked_kbps
+        ) ** 2 / norm
+        self._link_capacity_variance = min(max(self._link_capacity_variance, 0.4), 2.5)
+
+
+class RateCounter:
+    """
+    Measures a bitrate over a sliding window of packet arrivals.
+    """
+
+    def __init__(self, window: float = RATE_WINDOW) -> None:
+        self.window = window
+        self._packets: Deque[Tuple[float, int]] = deque()
+        self._size = 0
+        self._start: Optional[float] = None
+
+    def add(self, size: int, now: float) -> None:
+        if self._start is None:
+            self._start = now
+        self._packets.append((now, size))
+        self._size += size
+
+    def rate(self, now: float) -> Optional[int]:
+        """
+        Return the bitrate, or None until a whole window has been observed.
+        """
+        while self._packets and self._packets[0][0] <= now - self.window:
+            self._size -= self._packets.popleft()[1]
+        if self._start is None or now - self._start < self.window:
+            return None
+        return int(self._size * 8000 / self.window)
+
+
+class DelayBasedEstimator:
+    """
+    Estimates the available bitrate from the send and arrival times of packets,
+    which must be added in the order they were sent.
+
+    The send and arrival times need not share a clock, only their deltas are used.
+    """
+
+    def __init__(
+        self,
+        start_bitrate: int,
+        min_bitrate: int = BWE_MIN_BITRATE,
+        max_bitrate: int = BWE_MAX_BITRATE,
+    ) -> None:
+        self.inter_arrival = InterArrival()
+        self.trendline = TrendlineEstimator()
+        self.detector = OveruseDetector()
+        self.rate_control = AimdRateControl(start_bitrate, min_bitrate, max_bitrate)
+        self.incoming_bitrate = RateCounter()
+        self._last_arrival: Optional[float] = None
+
+    @property
+    def bitrate(self) -> int:
+        return self.rate_control.current_bitrate
+
+    @property
+    def usage(self) -> BandwidthUsage:
+        return self.detector.state
+
+    def add(self, send_time: float, arrival_time: float, size: int) -> None:
+        self.incoming_bitrate.add(size, arrival_time)
+        self._last_arrival = arrival_time
+
+        deltas = self.inter_arrival.compute(send_time, arrival_time, size)
+        if deltas is not None:
+            send_delta, arrival_delta, size_delta = deltas
+            trend = self.trendline.update(arrival_delta, send_delta, arrival_time)
+            self.detector.detect(
+                trend, send_delta, self.trendline.num_deltas, arrival_time
+            )
+
+    def update(self, now: float) -> Optional[int]:
+        """
+        Update the estimate, and return it if it changed.
+        """
+        if self._last_arrival is None:
+            return None
+
+        previous = self.rate_control.current_bitrate
+        bitrate = self.rate_control.update(
+            self.detector.state,
+            self.incoming_bitrate.rate(self._last_arrival),
+            now,
+        )
+        return bitrate if bitrate != previous else None
+
+
+class _SentPacket:
+    __slots__ = ("send_time", "size")
+
+    def __init__(self, send_time: float, size: int) -> None:
+        self.send_time = send_time
+        self.size = size
+
+
+class SendSideBandwidthEstimator:
+    """
+    Estimates the available send bitrate from transport-wide congestion control
+    feedback.
+
+    Each packet carrying a transport-wide sequence number is passed to
+    :meth:`on_packet_sent` as it leaves, and each :class:`RtcpTransportFeedback`
+    received to :meth:`on_transport_feedback`, which returns the new target
+    bitrate when it changes. A :class:`RtpSendProtocol` given this estimator
+    applies it to its encoder and pacer.
+    """
+
+    def __init__(
+        self,
+        start_bitrate: int,
+        min_bitrate: int = BWE_MIN_BITRATE,
+        max_bitrate: int = BWE_MAX_BITRATE,
+    ) -> None:
+        self.estimator = DelayBasedEstimator(start_bitrate, min_bitrate, max_bitrate)
+        self._sent: Dict[int, _SentPacket] = {}
+
+    @property
+    def target_bitrate(self) -> int:
+        return self.estimator.bitrate
+
+    @property
+    def rtt(self) -> float:
+        return self.estimator.rate_control.rtt
+
+    @rtt.setter
+    def rtt(self, rtt: float) -> None:
+        self.estimator.rate_control.rtt = rtt
+
+    def on_packet_sent(
+        self, transport_sequence_number: int, size: int, now: float
+    ) -> None:
+        sent = self._sent
+        sent.pop(transport_sequence_number, None)
+        sent[transport_sequence_number] = _SentPacket(now, size)
+        if len(sent) > SEND_HISTORY_SIZE:
+            del sent[next(iter(sent))]
+
+    def on_transport_feedback(
+        self, feedback: RtcpTransportFeedback, now: float
+    ) -> Optional[int]:
+        """
+        Add the arrival times reported by the feedback, and return the new target
+        bitrate if it changed.
+        """
+        added = False
+        for sequence_number, arrival_time in feedback.arrival_times:
+            sent = self._sent.pop(sequence_number, None)
+            if sent is not None and arrival_time is not None:
+                self.estimator.add(sent.send_time, arrival_time / 1000, sent.size)
+                added = True
+        return self.estimator.update(now) if added else None
+
+
+class RemoteBitrateEstimator:
+    """
+    Estimates the bitrate available from a remote sender from the abs-send-time of
+    the packets received from it, for senders without transport-wide congestion
+    control.
+
+    Each received packet carrying abs-send-time is passed to :meth:`add`, which
+    returns the bitrate and SSRCs of a REMB when one is due: every second, or as
+    soon as the estimate drops. The estimate starts from the received bitrate once
+    it has been measured. The work per packet is constant.
+    """
+
+    def __init__(
+        self,
+        min_bitrate: int = BWE_MIN_BITRATE,
+        max_bitrate: int = BWE_MAX_BITRATE,
+    ) -> None:
+        self.estimator = DelayBasedEstimator(min_bitrate, min_bitrate, max_bitrate)
+        self._started = False
+        self._abs_send_time: Optional[int] = None
+        self._send_time = 0
+        self._last_update: Optional[float] = None
+        self._last_remb: Optional[float] = None
+        self._last_remb_bitrate = 0
+        self._ssrcs: Dict[int, float] = {}
+
+    @property
+    def bitrate(self) -> Optional[int]:
+        """
+        The estimated bitrate, or None until the received bitrate is known.
+        """
+        return self.estimator.bitrate if self._started else None
+
+    def add(
+        self, arrival_time: float, abs_send_time: int, size: int, ssrc: int
+    ) -> Optional[Tuple[int, List[int]]]:
+        """
+        Add a received packet, and return the bitrate and SSRCs to send in a REMB
+        if one is due.
+
+        :param arrival_time: when the packet arrived, in milliseconds
+        :param abs_send_time: the packet's 24-bit abs-send-time
+        """
+        self._ssrcs[ssrc] = arrival_time
+
+        # unwrap abs-send-time, allowing for reordering
+        if self._abs_send_time is not None:
+            delta = (abs_send_time - self._abs_send_time) & 0xFFFFFF
+            if delta & 0x800000:
+                delta -= 1 << 24
+            self._send_time += delta
+        self._abs_send_time = abs_send_time
+
+        estimator = self.estimator
+        estimator.add(
+            self._send_time * 1000 / (1 << ABS_SEND_TIME_FRACTION_BITS),
+            arrival_time,
+            size,
+        )
+
+        if not self._started:
+            incoming = estimator.incoming_bitrate.rate(arrival_time)
+            if incoming is None:
+                return None
+            estimator.rate_control.current_bitrate = incoming
+            self._started = True
+
+        if (
+            self._last_update is None
+            or arrival_time - self._last_update >= REMOTE_UPDATE_INTERVAL
+            or estimator.usage == BandwidthUsage.OVERUSING
+        ):
+            estimator.update(arrival_time)
+            self._last_update = arrival_time
+
+        bitrate = estimator.bitrate
+        if (
+            self._last_remb is not None
+            and arrival_time - self._last_remb < REMB_INTERVAL
+            and bitrate >= self._last_remb_bitrate * REMB_DECREASE_RATIO
+        ):
+            return None
+
+        self._last_remb = arrival_time
+        self._last_remb_bitrate = bitrate
+        for stale in [
+            x
+            for x, last in self._ssrcs.items()
+            if arrival_time - last > REMB_STREAM_TIMEOUT
+        ]:
+            del self._ssrcs[stale]
+        return bitrate, list(self._ssrcs)
@@ -1,15 +1,21 @@
 import time
-from typing import Optional
+from typing import Callable, Optional, Sequence
 
 from vpx_rtp.codecs.vpx import VIDEO_CLOCK_RATE
-from vpx_rtp.rtp import RtpPacket
+from vpx_rtp.rtcp import RtcpReceiverInfo
+from vpx_rtp.rtp import RtpPacket, RtpPacketView
 from vpx_rtp.utils import uint16_gt
 
 # From https://github.com/aiortc/aiortc/blob/22699ea879f93b6d6dd1af4a200d37b9ff560870/src/aiortc/rtcrtpreceiver.py
 
 
 class ReceivedRtpStreamStatistics:
-    def __init__(self) -> None:
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        """
+        :param clock: the source of arrival times in seconds, such as
+            `time.monotonic`, for packets added without one
+        """
+        self.clock = clock
         self.base_seq: Optional[int] = None
         self.max_seq: Optional[int] = None
         self.cycles = 0
@@ -24,35 +30,144 @@ class ReceivedRtpStreamStatistics:
         self._expected_prior = 0
         self._received_prior = 0
 
-    def add(self, packet: RtpPacket) -> None:
-        in_order = self.max_seq is None or uint16_gt(
-            packet.sequence_number, self.max_seq
+    def add(
+        self, packet: RtpPacket | RtpPacketView, arrival_time: Optional[float] = None
+    ) -> None:
+        """
+        :param arrival_time: when the packet arrived in seconds, by default read
+            from the clock
+        """
+        self._add(packet.sequence_number, packet.timestamp, arrival_time)
+
+    def add_batch(
+        self,
+        sequence_numbers: Sequence[int],
+        timestamps: Sequence[int],
+        arrival_times: Optional[Sequence[float]] = None,
+    ) -> None:
+        """
+        Add a batch of packets, with the same results as calling :meth:`add` for
+        each of them in turn.
+
+        The fields may be given as lists, arrays such as ``array("H")`` and
+        ``array("I")`` or the columns of a NumPy structured array. Packets without
+        arrival times are taken to have arrived together, now. If NumPy is
+        installed, everything but the jitter recurrence is vectorized.
+        """
+        count = len(sequence_numbers)
+        assert len(timestamps) == count, "expected a timestamp per packet"
+        if arrival_times is None:
+            arrival_times = [self.clock()] * count
+        assert len(arrival_times) == count, "expected an arrival time per packet"
+        if not count:
+            return
+
+        try:
+            import numpy as np
+        except ImportError:
+            self._add_each(sequence_numbers, timestamps, arrival_times, 0)
+            return
+
+        start = 0
+        if self.max_seq is None:
+            self._add(
+                int(sequence_numbers[0]), int(timestamps[0]), float(arrival_times[0])
+            )
+            start = 1
+            if count == 1:
+                return
+        assert self.max_seq is not None
+        assert self._last_arrival is not None and self._last_timestamp is not None
+
+        # unwrap the sequence numbers from one packet to the next, starting from the
+        # highest one so far
+        seqs = np.asarray(sequence_numbers, dtype=np.int64)[start:]
+        previous = np.empty_like(seqs)
+        previous[0] = self.max_seq
+        previous[1:] = seqs[:-1]
+        highest = self.cycles + self.max_seq
+        extended = highest + np.cumsum((seqs - previous + 0x8000) % 0x10000 - 0x8000)
+        prior = np.maximum.accumulate(np.concatenate(([highest], extended[:-1])))
+        ahead = extended - prior
+
+        # unwrapping only agrees with comparing each packet with the highest
+        # sequence number modulo 2^16 as long as they are less than 2^15 apart
+        if np.any(np.abs(ahead) >= 0x8000):
+            self._add_each(sequence_numbers, timestamps, arrival_times, start)
+            return
+
+        in_order = ahead > 0
+        self.packets_received += len(seqs)
+        if not in_order.any():
+            return
+
+        highest = int(max(prior[-1], extended[-1]))
+        self.max_seq = highest & 0xFFFF
+        self.cycles = highest - self.max_seq
+
+        arrivals = (
+            np.asarray(arrival_times, dtype=np.float64)[start:][in_order]
+            * VIDEO_CLOCK_RATE
+        ).astype(np.int64)
+        stamps = np.asarray(timestamps, dtype=np.int64)[start:][in_order]
+        previous_arrivals = np.concatenate(([self._last_arrival], arrivals[:-1]))
+        previous_stamps = np.concatenate(([self._last_timestamp], stamps[:-1]))
+        changed = stamps != previous_stamps
+        diffs = np.abs(
+            (arrivals - previous_arrivals)[changed]
+            - (stamps - previous_stamps)[changed]
         )
+
+        # the rounding of the jitter recurrence makes it inherently sequential
+        jitter_q4 = self._jitter_q4
+        for diff in diffs.tolist():
+            jitter_q4 += diff - ((jitter_q4 + 8) >> 4)
+        self._jitter_q4 = jitter_q4
+        self._last_arrival = int(arrivals[-1])
+        self._last_timestamp = int(stamps[-1])
+
+    def _add_each(
+        self,
+        sequence_numbers: Sequence[int],
+        timestamps: Sequence[int],
+        arrival_times: Sequence[float],
+        start: int,
+    ) -> None:
+        for i in range(start, len(sequence_numbers)):
+            self._add(
+                int(sequence_numbers[i]), int(timestamps[i]), float(arrival_times[i])
+            )
+
+    def _add(
+        self, sequence_number: int, timestamp: int, arrival_time: Optional[float]
+    ) -> None:
+        in_order = self.max_seq is None or uint16_gt(sequence_number, self.max_seq)
         self.packets_received += 1
 
         if self.base_seq is None:
-            self.base_seq = packet.sequence_number
+            self.base_seq = sequence_number
 
         if in_order:
-            arrival = int(time.time() * VIDEO_CLOCK_RATE)
+            if arrival_time is None:
+                arrival_time = self.clock()
+            arrival = int(arrival_time * VIDEO_CLOCK_RATE)
 
-            if self.max_seq is not None and packet.sequence_number < self.max_seq:
+            if self.max_seq is not None and sequence_number < self.max_seq:
                 self.cycles += 1 << 16
-            self.max_seq = packet.sequence_number
+            self.max_seq = sequence_number
 
             if (
                 self._last_arrival is not None
                 and self._last_timestamp is not None
-                and packet.timestamp != self._last_timestamp
+                and timestamp != self._last_timestamp
             ):
                 diff = abs(
-                    (arrival - self._last_arrival)
-                    - (packet.timestamp - self._last_timestamp)
+                    (arrival - self._last_arrival) - (timestamp - self._last_timestamp)
                 )
                 self._jitter_q4 += diff - ((self._jitter_q4 + 8) >> 4)
 
             self._last_arrival = arrival
-            self._last_timestamp = packet.timestamp
+            self._last_timestamp = timestamp
 
     @property
     def fraction_lost(self) -> int:
@@ -96,3 +211,19 @@ class ReceivedRtpStreamStatistics:
         includes any which are late or duplicates.
         """
         return self.packets_expected - self.packets_received
+
+    def report_block(self, ssrc: int, lsr: int = 0, dlsr: int = 0) -> RtcpReceiverInfo:
+        """
+        Report block for the stream with the given SSRC, to send in a sender or
+        receiver report. This resets :attr:`fraction_lost`, so call it once per
+        report.
+        """
+        return RtcpReceiverInfo(
+            ssrc=ssrc,
+            fraction_lost=self.fraction_lost,
+            packets_lost=self.packets_lost,
+            highest_sequence=self.cycles + (self.max_seq or 0),
+            jitter=self.jitter,
+            lsr=lsr,
+            dlsr=dlsr,
+        )
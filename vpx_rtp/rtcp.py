@@ -0,0 +1,667 @@
+from struct import pack, unpack_from
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from typing_extensions import Self
+
+from vpx_rtp.rtp import (
+    PACKETS_LOST_MAX,
+    PACKETS_LOST_MIN,
+    RTCP_BYE,
+    RTCP_HEADER_LENGTH,
+    RTCP_PSFB,
+    RTCP_RR,
+    RTCP_RTPFB,
+    RTCP_RTPFB_NACK,
+    RTCP_RTPFB_TRANSPORT_CC,
+    RTCP_SDES,
+    RTCP_SR,
+    padl,
+)
+from vpx_rtp.utils import uint16_add
+
+RTCP_SDES_CNAME = 1
+
+RTCP_RECEIVER_INFO_LENGTH = 24
+RTCP_SENDER_INFO_LENGTH = 20
+
+# transport-wide congestion control packet status symbols
+TRANSPORT_CC_NOT_RECEIVED = 0
+TRANSPORT_CC_SMALL_DELTA = 1
+TRANSPORT_CC_LARGE_DELTA = 2
+
+
+def pack_rtcp_packet(packet_type: int, count: int, payload: bytes) -> bytes:
+    assert len(payload) % 4 == 0
+    return pack("!BBH", (2 << 6) | count, packet_type, len(payload) // 4) + payload
+
+
+def pack_nack(lost: Sequence[int]) -> bytes:
+    """
+    Serialize lost sequence numbers, in ascending order, as generic NACK PID/BLP
+    pairs according to RFC 4585.
+    """
+    fci = []
+    pid = None
+    blp = 0
+    for sequence_number in lost:
+        if pid is not None:
+            delta = uint16_add(sequence_number, -pid) - 1
+            if delta < 16:
+                blp |= 1 << delta
+                continue
+            fci.append(pack("!HH", pid, blp))
+        pid = sequence_number
+        blp = 0
+    if pid is not None:
+        fci.append(pack("!HH", pid, blp))
+    return b"".join(fci)
+
+
+def unpack_nack(fci: bytes | memoryview) -> List[int]:
+    lost = []
+    for pos in range(0, len(fci) - 3, 4):
+        pid, blp = unpack_from("!HH", fci, pos)
+        lost.append(pid)
+        for d in range(0, 16):
+            if (blp >> d) & 1:
+                lost.append(uint16_add(pid, d + 1))
+    return lost
+
+
+def pack_remb_fci(bitrate: int, ssrcs: Sequence[int]) -> bytes:
+    """
+    Serialize a Receiver Estimated Maximum Bitrate, in bits per second.
+    """
+    exponent = 0
+    mantissa = bitrate
+    while mantissa > 0x3FFFF:
+        mantissa >>= 1
+        exponent += 1
+    return (
+        b"REMB"
+        + pack("!L", (len(ssrcs) << 24) | (exponent << 18) | mantissa)
+        + b"".join([pack("!L", ssrc) for ssrc in ssrcs])
+    )
+
+
+def unpack_remb_fci(fci: bytes | memoryview) -> Tuple[int, List[int]]:
+    """
+    Return the bitrate, in bits per second, and SSRCs of a REMB.
+    """
+    if len(fci) < 8 or fci[0:4] != b"REMB":
+        raise ValueError("RTCP payload-specific feedback is not a REMB")
+
+    count, exponent_mantissa, mantissa = unpack_from("!BBH", fci, 4)
+    if len(fci) < 8 + 4 * count:
+        raise ValueError("RTCP REMB has truncated SSRCs")
+
+    bitrate = (((exponent_mantissa & 0x03) << 16) | mantissa) << (
+        exponent_mantissa >> 2
+    )
+    return bitrate, list(unpack_from(f"!{count}L", fci, 8))
+
+
+class RtcpReceiverInfo:
+    """
+    A report block, as carried by sender and receiver reports.
+    """
+
+    def __init__(
+        self,
+        ssrc: int,
+        fraction_lost: int,
+        packets_lost: int,
+        highest_sequence: int,
+        jitter: int,
+        lsr: int,
+        dlsr: int,
+    ) -> None:
+        self.ssrc = ssrc
+        self.fraction_lost = fraction_lost
+        self.packets_lost = packets_lost
+        self.highest_sequence = highest_sequence
+        self.jitter = jitter
+        self.lsr = lsr
+        self.dlsr = dlsr
+
+    def __bytes__(self) -> bytes:
+        packets_lost = max(PACKETS_LOST_MIN, min(self.packets_lost, PACKETS_LOST_MAX))
+        return pack(
+            "!LLLLLL",
+            self.ssrc,
+            (self.fraction_lost << 24) | (packets_lost & 0xFFFFFF),
+            self.highest_sequence,
+            self.jitter,
+            self.lsr,
+            self.dlsr,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpReceiverInfo(ssrc={self.ssrc}, fraction_lost={self.fraction_lost}, "
+            f"packets_lost={self.packets_lost}, "
+            f"highest_sequence={self.highest_sequence}, jitter={self.jitter}, "
+            f"lsr={self.lsr}, dlsr={self.dlsr})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, offset: int = 0) -> Self:
+        ssrc, lost, highest_sequence, jitter, lsr, dlsr = unpack_from(
+            "!LLLLLL", data, offset
+        )
+        packets_lost = lost & 0xFFFFFF
+        if packets_lost & 0x800000:
+            packets_lost -= 1 << 24
+        return cls(
+            ssrc=ssrc,
+            fraction_lost=lost >> 24,
+            packets_lost=packets_lost,
+            highest_sequence=highest_sequence,
+            jitter=jitter,
+            lsr=lsr,
+            dlsr=dlsr,
+        )
+
+
+class RtcpSenderInfo:
+    def __init__(
+        self,
+        ntp_timestamp: int,
+        rtp_timestamp: int,
+        packet_count: int,
+        octet_count: int,
+    ) -> None:
+        self.ntp_timestamp = ntp_timestamp
+        self.rtp_timestamp = rtp_timestamp
+        self.packet_count = packet_count
+        self.octet_count = octet_count
+
+    def __bytes__(self) -> bytes:
+        return pack(
+            "!QLLL",
+            self.ntp_timestamp,
+            self.rtp_timestamp,
+            self.packet_count,
+            self.octet_count,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpSenderInfo(ntp_timestamp={self.ntp_timestamp}, "
+            f"rtp_timestamp={self.rtp_timestamp}, "
+            f"packet_count={self.packet_count}, octet_count={self.octet_count})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, offset: int = 0) -> Self:
+        ntp_timestamp, rtp_timestamp, packet_count, octet_count = unpack_from(
+            "!QLLL", data, offset
+        )
+        return cls(
+            ntp_timestamp=ntp_timestamp,
+            rtp_timestamp=rtp_timestamp,
+            packet_count=packet_count,
+            octet_count=octet_count,
+        )
+
+
+def _parse_reports(
+    data: bytes | memoryview, offset: int, count: int
+) -> List[RtcpReceiverInfo]:
+    if len(data) < offset + count * RTCP_RECEIVER_INFO_LENGTH:
+        raise ValueError("RTCP report has truncated report blocks")
+    return [
+        RtcpReceiverInfo.parse(data, offset + i * RTCP_RECEIVER_INFO_LENGTH)
+        for i in range(count)
+    ]
+
+
+class RtcpSrPacket:
+    def __init__(
+        self,
+        ssrc: int,
+        sender_info: RtcpSenderInfo,
+        reports: List[RtcpReceiverInfo] | None = None,
+    ) -> None:
+        self.ssrc = ssrc
+        self.sender_info = sender_info
+        self.reports = reports if reports is not None else []
+
+    def __bytes__(self) -> bytes:
+        assert len(self.reports) < 32, "too many report blocks"
+        payload = b"".join(
+            [pack("!L", self.ssrc), bytes(self.sender_info)]
+            + [bytes(report) for report in self.reports]
+        )
+        return pack_rtcp_packet(RTCP_SR, len(self.reports), payload)
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpSrPacket(ssrc={self.ssrc}, sender_info={self.sender_info}, "
+            f"reports={self.reports})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        if len(data) < 4 + RTCP_SENDER_INFO_LENGTH:
+            raise ValueError("RTCP sender report length is invalid")
+
+        return cls(
+            ssrc=unpack_from("!L", data)[0],
+            sender_info=RtcpSenderInfo.parse(data, 4),
+            reports=_parse_reports(data, 4 + RTCP_SENDER_INFO_LENGTH, count),
+        )
+
+
+class RtcpRrPacket:
+    def __init__(
+        self, ssrc: int, reports: List[RtcpReceiverInfo] | None = None
+    ) -> None:
+        self.ssrc = ssrc
+        self.reports = reports if reports is not None else []
+
+    def __bytes__(self) -> bytes:
+        assert len(self.reports) < 32, "too many report blocks"
+        payload = b"".join(
+            [pack("!L", self.ssrc)] + [bytes(report) for report in self.reports]
+        )
+        return pack_rtcp_packet(RTCP_RR, len(self.reports), payload)
+
+    def __repr__(self) -> str:
+        return f"RtcpRrPacket(ssrc={self.ssrc}, reports={self.reports})"
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        if len(data) < 4:
+            raise ValueError("RTCP receiver report length is invalid")
+
+        return cls(
+            ssrc=unpack_from("!L", data)[0], reports=_parse_reports(data, 4, count)
+        )
+
+
+class RtcpSourceInfo:
+    """
+    An SDES chunk: the items, such as the CNAME, describing one source.
+    """
+
+    def __init__(self, ssrc: int, items: List[Tuple[int, bytes]]) -> None:
+        self.ssrc = ssrc
+        self.items = items
+
+    def __bytes__(self) -> bytes:
+        data = pack("!L", self.ssrc) + b"".join(
+            [
+                pack("!BB", item_type, len(value)) + value
+                for item_type, value in self.items
+            ]
+        )
+        # the item list ends with at least one null octet
+        return data + b"\x00" * (padl(len(data) + 1) + 1)
+
+    def __repr__(self) -> str:
+        return f"RtcpSourceInfo(ssrc={self.ssrc}, items={self.items})"
+
+
+class RtcpSdesPacket:
+    def __init__(self, chunks: List[RtcpSourceInfo] | None = None) -> None:
+        self.chunks = chunks if chunks is not None else []
+
+    def __bytes__(self) -> bytes:
+        assert len(self.chunks) < 32, "too many SDES chunks"
+        payload = b"".join([bytes(chunk) for chunk in self.chunks])
+        return pack_rtcp_packet(RTCP_SDES, len(self.chunks), payload)
+
+    def __repr__(self) -> str:
+        return f"RtcpSdesPacket(chunks={self.chunks})"
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        chunks = []
+        pos = 0
+        for _ in range(count):
+            if len(data) < pos + 4:
+                raise ValueError("RTCP SDES source is truncated")
+            ssrc = unpack_from("!L", data, pos)[0]
+            pos += 4
+            items = []
+            while pos < len(data) and data[pos]:
+                if len(data) < pos + 2:
+                    raise ValueError("RTCP SDES item is truncated")
+                item_type, length = data[pos], data[pos + 1]
+                pos += 2
+                if len(data) < pos + length:
+                    raise ValueError("RTCP SDES item is truncated")
+                items.append((item_type, bytes(data[pos : pos + length])))
+                pos += length
+            # skip the null octets up to the next 32-bit boundary
+            pos += padl(pos + 1) + 1
+            chunks.append(RtcpSourceInfo(ssrc=ssrc, items=items))
+        return cls(chunks=chunks)
+
+
+class RtcpByePacket:
+    def __init__(self, sources: List[int]) -> None:
+        self.sources = sources
+
+    def __bytes__(self) -> bytes:
+        assert len(self.sources) < 32, "too many sources"
+        payload = b"".join([pack("!L", ssrc) for ssrc in self.sources])
+        return pack_rtcp_packet(RTCP_BYE, len(self.sources), payload)
+
+    def __repr__(self) -> str:
+        return f"RtcpByePacket(sources={self.sources})"
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        if len(data) < 4 * count:
+            raise ValueError("RTCP bye length is invalid")
+
+        return cls(sources=list(unpack_from(f"!{count}L", data)))
+
+
+def _transport_cc_symbol(delta: Optional[int]) -> int:
+    if delta is None:
+        return TRANSPORT_CC_NOT_RECEIVED
+    elif 0 <= delta <= 0xFF:
+        return TRANSPORT_CC_SMALL_DELTA
+    else:
+        assert -0x8000 <= delta <= 0x7FFF, "receive delta does not fit 16 bits"
+        return TRANSPORT_CC_LARGE_DELTA
+
+
+def _pack_status_chunks(symbols: List[int]) -> List[bytes]:
+    chunks = []
+    pos = 0
+    while pos < len(symbols):
+        symbol = symbols[pos]
+        run = 1
+        while (
+            pos + run < len(symbols) and symbols[pos + run] == symbol and run < 0x1FFF
+        ):
+            run += 1
+
+        window = symbols[pos : pos + 14]
+        if run >= 14 or (run >= 7 and max(window) > TRANSPORT_CC_SMALL_DELTA):
+            # run length chunk
+            chunks.append(pack("!H", (symbol << 13) | run))
+            pos += run
+        elif max(window) <= TRANSPORT_CC_SMALL_DELTA:
+            # status vector chunk with 14 one-bit symbols
+            chunk = 0x8000
+            for i, s in enumerate(window):
+                chunk |= s << (13 - i)
+            chunks.append(pack("!H", chunk))
+            pos += len(window)
+        else:
+            # status vector chunk with 7 two-bit symbols
+            chunk = 0xC000
+            for i, s in enumerate(symbols[pos : pos + 7]):
+                chunk |= s << (12 - 2 * i)
+            chunks.append(pack("!H", chunk))
+            pos += 7
+    return chunks
+
+
+class RtcpTransportFeedback:
+    """
+    Transport-wide congestion control feedback.
+
+    `deltas` has one entry per packet starting at `base_sequence_number`: None if
+    the packet was not received, otherwise its arrival time relative to the
+    previous received packet, or to `reference_time` for the first one, in
+    multiples of 250 microseconds. `reference_time` is in multiples of 64 ms.
+    """
+
+    def __init__(
+        self,
+        base_sequence_number: int,
+        reference_time: int,
+        feedback_packet_count: int,
+        deltas: List[Optional[int]],
+    ) -> None:
+        self.base_sequence_number = base_sequence_number
+        self.reference_time = reference_time
+        self.feedback_packet_count = feedback_packet_count
+        self.deltas = deltas
+
+    def __bytes__(self) -> bytes:
+        symbols = [_transport_cc_symbol(delta) for delta in self.deltas]
+        data = b"".join(
+            [
+                pack(
+                    "!HHL",
+                    self.base_sequence_number,
+                    len(self.deltas),
+                    ((self.reference_time & 0xFFFFFF) << 8)
+                    | (self.feedback_packet_count & 0xFF),
+                )
+            ]
+            + _pack_status_chunks(symbols)
+            + [
+                pack("!B" if symbol == TRANSPORT_CC_SMALL_DELTA else "!h", delta)
+                for symbol, delta in zip(symbols, self.deltas)
+                if symbol != TRANSPORT_CC_NOT_RECEIVED
+            ]
+        )
+        return data + b"\x00" * padl(len(data))
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpTransportFeedback(base_sequence_number={self.base_sequence_number}, "
+            f"reference_time={self.reference_time}, "
+            f"feedback_packet_count={self.feedback_packet_count}, "
+            f"deltas={self.deltas})"
+        )
+
+    @property
+    def arrival_times(self) -> List[Tuple[int, Optional[int]]]:
+        """
+        The sequence number of each packet and its arrival time in microseconds,
+        or None if it was not received.
+        """
+        times: List[Tuple[int, Optional[int]]] = []
+        time = self.reference_time * 64000
+        for i, delta in enumerate(self.deltas):
+            sequence_number = uint16_add(self.base_sequence_number, i)
+            if delta is None:
+                times.append((sequence_number, None))
+            else:
+                time += delta * 250
+                times.append((sequence_number, time))
+        return times
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview) -> Self:
+        if len(data) < 8:
+            raise ValueError("RTCP transport feedback length is invalid")
+
+        base_sequence_number, count, reference = unpack_from("!HHL", data)
+        reference_time = reference >> 8
+        if reference_time & 0x800000:
+            reference_time -= 1 << 24
+
+        symbols: List[int] = []
+        pos = 8
+        while len(symbols) < count:
+            if len(data) < pos + 2:
+                raise ValueError("RTCP transport feedback has truncated chunks")
+            chunk = unpack_from("!H", data, pos)[0]
+            pos += 2
+            if not chunk & 0x8000:
+                symbols.extend([(chunk >> 13) & 0x03] * (chunk & 0x1FFF))
+            elif not chunk & 0x4000:
+                symbols.extend([(chunk >> (13 - i)) & 0x01 for i in range(14)])
+            else:
+                symbols.extend([(chunk >> (12 - 2 * i)) & 0x03 for i in range(7)])
+        del symbols[count:]
+
+        deltas: List[Optional[int]] = []
+        for symbol in symbols:
+            if symbol == TRANSPORT_CC_NOT_RECEIVED:
+                deltas.append(None)
+            elif symbol == TRANSPORT_CC_SMALL_DELTA:
+                if len(data) < pos + 1:
+                    raise ValueError("RTCP transport feedback has truncated deltas")
+                deltas.append(data[pos])
+                pos += 1
+            elif symbol == TRANSPORT_CC_LARGE_DELTA:
+                if len(data) < pos + 2:
+                    raise ValueError("RTCP transport feedback has truncated deltas")
+                deltas.append(unpack_from("!h", data, pos)[0])
+                pos += 2
+            else:
+                raise ValueError("RTCP transport feedback has invalid status")
+
+        return cls(
+            base_sequence_number=base_sequence_number,
+            reference_time=reference_time,
+            feedback_packet_count=reference & 0xFF,
+            deltas=deltas,
+        )
+
+
+class RtcpRtpfbPacket:
+    """
+    Generic RTP Feedback packet: generic NACK or transport-wide congestion control
+    feedback.
+    """
+
+    def __init__(
+        self,
+        fmt: int,
+        ssrc: int,
+        media_ssrc: int,
+        lost: List[int] | None = None,
+        transport_feedback: RtcpTransportFeedback | None = None,
+    ) -> None:
+        self.fmt = fmt
+        self.ssrc = ssrc
+        self.media_ssrc = media_ssrc
+        self.lost = lost if lost is not None else []
+        self.transport_feedback = transport_feedback
+
+    def __bytes__(self) -> bytes:
+        payload = pack("!LL", self.ssrc, self.media_ssrc)
+        if self.fmt == RTCP_RTPFB_NACK:
+            payload += pack_nack(self.lost)
+        elif self.fmt == RTCP_RTPFB_TRANSPORT_CC:
+            assert self.transport_feedback is not None, "transport feedback is missing"
+            payload += bytes(self.transport_feedback)
+        return pack_rtcp_packet(RTCP_RTPFB, self.fmt, payload)
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpRtpfbPacket(fmt={self.fmt}, ssrc={self.ssrc}, "
+            f"media_ssrc={self.media_ssrc}, lost={self.lost}, "
+            f"transport_feedback={self.transport_feedback})"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        if len(data) < 8 or len(data) % 4:
+            raise ValueError("RTCP RTP feedback length is invalid")
+
+        ssrc, media_ssrc = unpack_from("!LL", data)
+        packet = cls(fmt=count, ssrc=ssrc, media_ssrc=media_ssrc)
+        if count == RTCP_RTPFB_NACK:
+            packet.lost = unpack_nack(data[8:])
+        elif count == RTCP_RTPFB_TRANSPORT_CC:
+            packet.transport_feedback = RtcpTransportFeedback.parse(data[8:])
+        return packet
+
+
+class RtcpPsfbPacket:
+    """
+    Payload-Specific Feedback packet, such as a PLI, or a REMB using
+    :func:`pack_remb_fci` and :func:`unpack_remb_fci`.
+    """
+
+    def __init__(
+        self, fmt: int, ssrc: int, media_ssrc: int, fci: bytes | memoryview = b""
+    ) -> None:
+        self.fmt = fmt
+        self.ssrc = ssrc
+        self.media_ssrc = media_ssrc
+        self.fci = fci
+
+    def __bytes__(self) -> bytes:
+        payload = pack("!LL", self.ssrc, self.media_ssrc) + self.fci
+        return pack_rtcp_packet(RTCP_PSFB, self.fmt, payload)
+
+    def __repr__(self) -> str:
+        return (
+            f"RtcpPsfbPacket(fmt={self.fmt}, ssrc={self.ssrc}, "
+            f"media_ssrc={self.media_ssrc}, {len(self.fci)} bytes)"
+        )
+
+    @classmethod
+    def parse(cls, data: bytes | memoryview, count: int) -> Self:
+        if len(data) < 8 or len(data) % 4:
+            raise ValueError("RTCP payload-specific feedback length is invalid")
+
+        ssrc, media_ssrc = unpack_from("!LL", data)
+        return cls(fmt=count, ssrc=ssrc, media_ssrc=media_ssrc, fci=data[8:])
+
+
+RtcpPacket = Union[
+    RtcpSrPacket,
+    RtcpRrPacket,
+    RtcpSdesPacket,
+    RtcpByePacket,
+    RtcpRtpfbPacket,
+    RtcpPsfbPacket,
+]
+
+_PARSERS: Dict[int, Callable[[memoryview, int], RtcpPacket]] = {
+    RTCP_SR: RtcpSrPacket.parse,
+    RTCP_RR: RtcpRrPacket.parse,
+    RTCP_SDES: RtcpSdesPacket.parse,
+    RTCP_BYE: RtcpByePacket.parse,
+    RTCP_RTPFB: RtcpRtpfbPacket.parse,
+    RTCP_PSFB: RtcpPsfbPacket.parse,
+}
+
+
+def parse_rtcp(data: bytes | bytearray | memoryview) -> List[RtcpPacket]:
+    """
+    Parse a compound RTCP packet in a single pass.
+
+    Every packet is handed a memoryview of its own payload, so nothing is copied
+    but the decoded fields; the `fci` of payload-specific feedback still refers to
+    `data`. Packets of unknown types are skipped.
+    """
+    view = memoryview(data)
+    packets = []
+    pos = 0
+    while pos < len(view):
+        if len(view) < pos + RTCP_HEADER_LENGTH:
+            raise ValueError(
+                f"RTCP packet length is less than {RTCP_HEADER_LENGTH} bytes"
+            )
+
+        v_p_count, packet_type, length = unpack_from("!BBH", view, pos)
+        if v_p_count >> 6 != 2:
+            raise ValueError("RTCP packet has invalid version")
+
+        start = pos + RTCP_HEADER_LENGTH
+        pos = end = start + 4 * length
+        if end > len(view):
+            raise ValueError("RTCP packet is truncated")
+        if v_p_count & 0x20:
+            padding = view[end - 1]
+            if not padding or padding > 4 * length:
+                raise ValueError("RTCP packet padding length is invalid")
+            end -= padding
+
+        parser = _PARSERS.get(packet_type)
+        if parser is not None:
+            packets.append(parser(view[start:end], v_p_count & 0x1F))
+    return packets
+
+
+def serialize_rtcp(packets: Iterable[RtcpPacket]) -> bytes:
+    """
+    Serialize packets into a compound RTCP packet.
+    """
+    return b"".join([bytes(packet) for packet in packets])
@@ -1,11 +1,13 @@
 import os
-from dataclasses import dataclass
-from struct import pack, unpack, unpack_from
-from typing import Any, List, Optional, Tuple
+from dataclasses import dataclass, replace
+from struct import pack, pack_into, unpack, unpack_from
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
 
 from typing_extensions import Self
 
+from vpx_rtp.clock import current_ntp_time
 from vpx_rtp.rtcrtpparameters import RTCRtpParameters
+from vpx_rtp.utils import random16, random32, uint16_add
 
 # used for NACK and retransmission
 RTP_HISTORY_SIZE = 128
@@ -28,6 +30,7 @@ RTCP_RTPFB = 205
 RTCP_PSFB = 206
 
 RTCP_RTPFB_NACK = 1
+RTCP_RTPFB_TRANSPORT_CC = 15
 
 RTCP_PSFB_PLI = 1
 RTCP_PSFB_SLI = 2
@@ -46,9 +49,63 @@ class HeaderExtensions:
     transport_sequence_number: Optional[int] = None
 
 
+class HeaderExtensionsTemplate:
+    """
+    A serialized header extension block, including its profile and length word,
+    with fixed offsets at which abs-send-time and the transport-wide sequence
+    number can be patched in place.
+    """
+
+    def __init__(
+        self,
+        extension_profile: int,
+        extension_value: bytes,
+        abs_send_time_offset: Optional[int] = None,
+        transport_sequence_number_offset: Optional[int] = None,
+    ) -> None:
+        self.extension_profile = extension_profile
+        self.data = (
+            pack("!HH", extension_profile, len(extension_value) >> 2) + extension_value
+            if extension_value
+            else b""
+        )
+        self.abs_send_time_offset = abs_send_time_offset
+        self.transport_sequence_number_offset = transport_sequence_number_offset
+
+    def patch(
+        self,
+        buffer: bytearray,
+        offset: int,
+        abs_send_time: Optional[int] = None,
+        transport_sequence_number: Optional[int] = None,
+    ) -> None:
+        """
+        Write values into a copy of :attr:`data` which starts at `offset` in `buffer`.
+        """
+        if abs_send_time is not None and self.abs_send_time_offset is not None:
+            pack_into(
+                "!BH",
+                buffer,
+                offset + self.abs_send_time_offset,
+                (abs_send_time >> 16) & 0xFF,
+                abs_send_time & 0xFFFF,
+            )
+        if (
+            transport_sequence_number is not None
+            and self.transport_sequence_number_offset is not None
+        ):
+            pack_into(
+                "!H",
+                buffer,
+                offset + self.transport_sequence_number_offset,
+                transport_sequence_number,
+            )
+
+
 class HeaderExtensionsMap:
     def __init__(self) -> None:
         self.__ids = HeaderExtensions()
+        self.template = self.compile()
 
     def configure(self, parameters: RTCRtpParameters) -> None:
         for ext in parameters.headerExtensions:
@@ -71,6 +128,7 @@ class HeaderExtensionsMap:
                 == "http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01"
             ):
                 self.__ids.transport_sequence_number = ext.id
+        self.template = self.compile()
 
     def get(self, extension_profile: int, extension_value: bytes) -> HeaderExtensions:
         values = HeaderExtensions()
@@ -95,6 +153,61 @@ class HeaderExtensionsMap:
         return values
 
     def set(self, values: HeaderExtensions) -> tuple[int, bytes]:
+        template = self.template
+        if (
+            values.mid is None
+            and values.repaired_rtp_stream_id is None
+            and values.rtp_stream_id is None
+            and values.transmission_offset is None
+            and values.audio_level is None
+            and (
+                values.abs_send_time is not None
+                or template.abs_send_time_offset is None
+            )
+            and (
+                values.transport_sequence_number is not None
+                or template.transport_sequence_number_offset is None
+            )
+        ):
+            # only the extensions the template has slots for are in use
+            data = bytearray(template.data)
+            template.patch(
+                data, 0, values.abs_send_time, values.transport_sequence_number
+            )
+            return template.extension_profile, bytes(data[4:])
+
+        return pack_header_extensions(self._extensions(values))
+
+    def compile(
+        self, values: HeaderExtensions = HeaderExtensions()
+    ) -> HeaderExtensionsTemplate:
+        """
+        Precompute the extension block for `values`, leaving slots for abs-send-time
+        and the transport-wide sequence number (if configured) to be patched in.
+        """
+        values = replace(values, abs_send_time=0, transport_sequence_number=0)
+        extensions = self._extensions(values)
+        extension_profile, extension_value = pack_header_extensions(extensions)
+
+        abs_send_time_offset = None
+        transport_sequence_number_offset = None
+        pos = 4
+        for x_id, x_value in extensions:
+            pos += 1 if extension_profile == 0xBEDE else 2
+            if x_id == self.__ids.abs_send_time:
+                abs_send_time_offset = pos
+            elif x_id == self.__ids.transport_sequence_number:
+                transport_sequence_number_offset = pos
+            pos += len(x_value)
+
+        return HeaderExtensionsTemplate(
+            extension_profile,
+            extension_value,
+            abs_send_time_offset=abs_send_time_offset,
+            transport_sequence_number_offset=transport_sequence_number_offset,
+        )
+
+    def _extensions(self, values: HeaderExtensions) -> List[Tuple[int, bytes]]:
         extensions = []
         if values.mid is not None and self.__ids.mid:
             extensions.append((self.__ids.mid, values.mid.encode("utf8")))
@@ -144,7 +257,7 @@ class HeaderExtensionsMap:
                     pack("!H", values.transport_sequence_number),
                 )
             )
-        return pack_header_extensions(extensions)
+        return extensions
 
 
 def padl(length: int) -> int:
@@ -220,23 +333,23 @@ def pack_header_extensions(extensions: List[Tuple[int, bytes]]) -> Tuple[int, by
         if x_id > 14 or x_length == 0 or x_length > 16:
             one_byte = False
 
+    data = []
     if one_byte:
         # One-Byte Header
         extension_profile = 0xBEDE
-        extension_value = b""
         for x_id, x_value in extensions:
             x_length = len(x_value)
-            extension_value += pack("!B", (x_id << 4) | (x_length - 1))
-            extension_value += x_value
+            data.append(pack("!B", (x_id << 4) | (x_length - 1)))
+            data.append(x_value)
     else:
         # Two-Byte Header
         extension_profile = 0x1000
-        extension_value = b""
         for x_id, x_value in extensions:
             x_length = len(x_value)
-            extension_value += pack("!BB", x_id, x_length)
-            extension_value += x_value
+            data.append(pack("!BB", x_id, x_length))
+            data.append(x_value)
 
+    extension_value = b"".join(data)
     extension_value += b"\x00" * padl(len(extension_value))
     return extension_profile, extension_value
 
@@ -339,28 +452,425 @@ class RtpPacket:
     def serialize(
         self, extensions_map: HeaderExtensionsMap = HeaderExtensionsMap()
     ) -> bytes:
+        data = [self.serialize_header(extensions_map), self.payload]
+        if self.padding_size > 0:
+            data.append(os.urandom(self.padding_size - 1))
+            data.append(bytes([self.padding_size]))
+        return b"".join(data)
+
+    def serialize_header(
+        self, extensions_map: HeaderExtensionsMap = HeaderExtensionsMap()
+    ) -> bytes:
+        """
+        Serialize everything that precedes the payload.
+
+        This lets the header be written in front of a payload which was built with
+        headroom for it, instead of copying the payload again.
+        """
         extension_profile, extension_value = extensions_map.set(self.extensions)
         has_extension = bool(extension_value)
 
         padding = self.padding_size > 0
-        data = pack(
-            "!BBHLL",
-            (self.version << 6)
-            | (padding << 5)
-            | (has_extension << 4)
-            | len(self.csrc),
-            (self.marker << 7) | self.payload_type,
-            self.sequence_number,
-            self.timestamp,
-            self.ssrc,
-        )
+        data = [
+            pack(
+                "!BBHLL",
+                (self.version << 6)
+                | (padding << 5)
+                | (has_extension << 4)
+                | len(self.csrc),
+                (self.marker << 7) | self.payload_type,
+                self.sequence_number,
+                self.timestamp,
+                self.ssrc,
+            )
+        ]
         for csrc in self.csrc:
-            data += pack("!L", csrc)
+            data.append(pack("!L", csrc))
         if has_extension:
-            data += pack("!HH", extension_profile, len(extension_value) >> 2)
-            data += extension_value
-        data += self.payload
+            data.append(pack("!HH", extension_profile, len(extension_value) >> 2))
+            data.append(extension_value)
+        return b"".join(data)
+
+
+class RtpPacketView:
+    """
+    A compact, read-only RTP packet backed by the buffer it was parsed from.
+
+    Only the fixed header is decoded by :meth:`parse`. CSRCs, header extensions and
+    the payload are decoded on access, and byte fields are returned as memoryviews
+    into the original buffer instead of copies.
+    """
+
+    __slots__ = (
+        "marker",
+        "payload_type",
+        "sequence_number",
+        "timestamp",
+        "ssrc",
+        "_buffer",
+        "_extensions_map",
+        "_extensions",
+        "_csrc_count",
+        "_extension_pos",
+        "_payload_pos",
+        "_payload_end",
+        "_parsed_data",
+    )
+
+    version = 2
+
+    def __init__(
+        self,
+        buffer: memoryview,
+        extensions_map: HeaderExtensionsMap,
+        marker: int,
+        payload_type: int,
+        sequence_number: int,
+        timestamp: int,
+        ssrc: int,
+    ) -> None:
+        self.marker = marker
+        self.payload_type = payload_type
+        self.sequence_number = sequence_number
+        self.timestamp = timestamp
+        self.ssrc = ssrc
+        self._buffer = buffer
+        self._extensions_map = extensions_map
+        self._extensions: HeaderExtensions | None = None
+        self._csrc_count = 0
+        self._extension_pos = 0
+        self._payload_pos = RTP_HEADER_LENGTH
+        self._payload_end = len(buffer)
+        self._parsed_data: bytes | memoryview | None = None
+
+    @property
+    def _data(self) -> bytes | memoryview:
+        if self._parsed_data is None:
+            raise ValueError("RTP payload has not been parsed")
+        return self._parsed_data
+
+    @_data.setter
+    def _data(self, value: bytes | memoryview) -> None:
+        self._parsed_data = value
+
+    @property
+    def csrc(self) -> List[int]:
+        return list(
+            unpack_from(f"!{self._csrc_count}L", self._buffer, RTP_HEADER_LENGTH)
+        )
+
+    @property
+    def extensions(self) -> HeaderExtensions:
+        if self._extensions is None:
+            if self._extension_pos:
+                extension_profile, extension_length = unpack_from(
+                    "!HH", self._buffer, self._extension_pos
+                )
+                start = self._extension_pos + 4
+                self._extensions = self._extensions_map.get(
+                    extension_profile,
+                    bytes(self._buffer[start : start + 4 * extension_length]),
+                )
+            else:
+                self._extensions = HeaderExtensions()
+        return self._extensions
+
+    @property
+    def padding_size(self) -> int:
+        return len(self._buffer) - self._payload_end
+
+    @property
+    def payload(self) -> memoryview:
+        return self._buffer[self._payload_pos : self._payload_end]
+
+    def __repr__(self) -> str:
+        return (
+            f"RtpPacketView(seq={self.sequence_number}, ts={self.timestamp}, "
+            f"marker={self.marker}, payload={self.payload_type}, "
+            f"{self._payload_end - self._payload_pos} bytes)"
+        )
+
+    @classmethod
+    def parse(
+        cls,
+        data: bytes | bytearray | memoryview,
+        extensions_map: HeaderExtensionsMap = HeaderExtensionsMap(),
+    ) -> Self:
+        if len(data) < RTP_HEADER_LENGTH:
+            raise ValueError(
+                f"RTP packet length is less than {RTP_HEADER_LENGTH} bytes"
+            )
+
+        v_p_x_cc, m_pt, sequence_number, timestamp, ssrc = unpack_from("!BBHLL", data)
+        version = v_p_x_cc >> 6
+        padding = (v_p_x_cc >> 5) & 1
+        extension = (v_p_x_cc >> 4) & 1
+        cc = v_p_x_cc & 0x0F
+        if version != 2:
+            raise ValueError("RTP packet has invalid version")
+
+        pos = RTP_HEADER_LENGTH + 4 * cc
+        if len(data) < pos:
+            raise ValueError("RTP packet has truncated CSRC")
+
+        packet = cls(
+            memoryview(data),
+            extensions_map,
+            marker=(m_pt >> 7),
+            payload_type=(m_pt & 0x7F),
+            sequence_number=sequence_number,
+            timestamp=timestamp,
+            ssrc=ssrc,
+        )
+        packet._csrc_count = cc
+
+        if extension:
+            if len(data) < pos + 4:
+                raise ValueError("RTP packet has truncated extension profile / length")
+            packet._extension_pos = pos
+            pos += 4 + 4 * unpack_from("!H", data, pos + 2)[0]
+            if len(data) < pos:
+                raise ValueError("RTP packet has truncated extension value")
+
+        packet._payload_pos = pos
         if padding:
-            data += os.urandom(self.padding_size - 1)
-            data += bytes([self.padding_size])
-        return data
+            padding_len = data[-1]
+            if not padding_len or padding_len > len(data) - pos:
+                raise ValueError("RTP packet padding length is invalid")
+            packet._payload_end = len(data) - padding_len
+
+        return packet
+
+
+def _payload_position(data: bytes | bytearray | memoryview) -> int:
+    pos = RTP_HEADER_LENGTH + 4 * (data[0] & 0x0F)
+    if data[0] & 0x10:
+        pos += 4 + 4 * unpack_from("!H", data, pos + 2)[0]
+    return pos
+
+
+def wrap_rtx(
+    data: bytes | bytearray, payload_type: int, sequence_number: int, ssrc: int
+) -> bytes:
+    """
+    Wrap a serialized RTP packet in an RTX packet according to RFC 4588.
+    """
+    pos = _payload_position(data)
+    end = len(data) - data[-1] if data[0] & 0x20 else len(data)
+    header = bytearray(data[:pos])
+    header[0] &= ~0x20
+    header[1] = (header[1] & 0x80) | payload_type
+    pack_into("!H", header, 2, sequence_number)
+    pack_into("!L", header, 8, ssrc)
+    return b"".join([header, data[2:4], memoryview(data)[pos:end]])
+
+
+def unwrap_rtx(data: bytes | bytearray, payload_type: int, ssrc: int) -> bytes:
+    """
+    Recover the original serialized RTP packet from an RTX packet.
+    """
+    pos = _payload_position(data)
+    end = len(data) - data[-1] if data[0] & 0x20 else len(data)
+    if end - pos < 2:
+        raise ValueError("RTX packet is too short")
+
+    header = bytearray(data[:pos])
+    header[0] &= ~0x20
+    header[1] = (header[1] & 0x80) | payload_type
+    header[2:4] = data[pos : pos + 2]
+    pack_into("!L", header, 8, ssrc)
+    return b"".join([header, memoryview(data)[pos + 2 : end]])
+
+
+class RtpHistory:
+    """
+    A ring of the most recently sent packets, indexed by sequence number, which is
+    used to answer NACKs.
+
+    Packets are kept as the serialized objects that were sent, without copying. If
+    `rtx_payload_type` and `rtx_ssrc` are given, retransmissions are wrapped in RTX
+    packets (RFC 4588) with their own sequence numbers.
+    """
+
+    def __init__(
+        self,
+        size: int = RTP_HISTORY_SIZE,
+        rtx_payload_type: Optional[int] = None,
+        rtx_ssrc: Optional[int] = None,
+    ) -> None:
+        self._size = size
+        self._packets: List[bytes | bytearray | None] = [None] * size
+        self.rtx_payload_type = rtx_payload_type
+        self.rtx_ssrc = rtx_ssrc
+        self.rtx_sequence_number = random16()
+
+    def add(self, data: bytes | bytearray) -> None:
+        self._packets[unpack_from("!H", data, 2)[0] % self._size] = data
+
+    def get(self, sequence_number: int) -> bytes | bytearray | None:
+        data = self._packets[sequence_number % self._size]
+        if data is not None and unpack_from("!H", data, 2)[0] == sequence_number:
+            return data
+        return None
+
+    def handle_nack(self, lost: Iterable[int]) -> List[bytes | bytearray]:
+        """
+        Return the packets to resend for the lost sequence numbers still in history.
+        """
+        packets = []
+        for sequence_number in lost:
+            data = self.get(sequence_number)
+            if data is None:
+                continue
+            if self.rtx_payload_type is not None and self.rtx_ssrc is not None:
+                data = wrap_rtx(
+                    data,
+                    payload_type=self.rtx_payload_type,
+                    sequence_number=self.rtx_sequence_number,
+                    ssrc=self.rtx_ssrc,
+                )
+                self.rtx_sequence_number = uint16_add(self.rtx_sequence_number, 1)
+            packets.append(data)
+        return packets
+
+
+class RtpSender:
+    """
+    Serializes whole encoded frames into the RTP packets of one stream.
+
+    Sequence numbers are allocated across frames, the marker bit is set on the last
+    packet of each frame and the header extensions (including abs-send-time) are
+    serialized once per frame, with only the transport-wide sequence number patched
+    into each packet. If a `history` is given, sent packets are recorded in it so
+    that NACKs can be answered with :meth:`handle_nack`.
+    """
+
+    def __init__(
+        self,
+        payload_type: int,
+        ssrc: Optional[int] = None,
+        sequence_number: Optional[int] = None,
+        extensions_map: HeaderExtensionsMap = HeaderExtensionsMap(),
+        history: Optional[RtpHistory] = None,
+    ) -> None:
+        self.payload_type = payload_type
+        self.ssrc = random32() if ssrc is None else ssrc
+        self.sequence_number = (
+            random16() if sequence_number is None else sequence_number
+        )
+        self.extensions = HeaderExtensions()
+        self.extensions_map = extensions_map
+        self.transport_sequence_number = 0
+        self.history = history
+        self._template = extensions_map.template
+
+    @property
+    def header_length(self) -> int:
+        """
+        Length of the headers written by this sender, to be used as the encoder's
+        headroom with :meth:`write_headers`.
+        """
+        return len(self._serialize_header(0))
+
+    def serialize_frame(
+        self, payloads: Sequence[bytes], timestamp: int
+    ) -> List[bytearray]:
+        """
+        Serialize the payloads of one frame, as returned by `Vp8Encoder.encode`.
+        """
+        header = self._serialize_header(timestamp)
+        header_length = len(header)
+        packets = []
+        for payload in payloads:
+            data = bytearray(header_length + len(payload))
+            data[:header_length] = header
+            data[header_length:] = payload
+            packets.append(data)
+        return self._number(packets)
+
+    def write_headers(
+        self, packets: List[bytearray], timestamp: int, headroom: int
+    ) -> List[bytearray]:
+        """
+        Write headers in place into payloads of one frame which were encoded with
+        :attr:`header_length` bytes of headroom, and return them.
+
+        :param headroom: the headroom the payloads were encoded with, which must
+            still be the length of the headers
+        """
+        header = self._serialize_header(timestamp)
+        header_length = len(header)
+        if headroom != header_length:
+            raise ValueError(
+                f"Payloads have {headroom} bytes of headroom "
+                f"for {header_length} bytes of headers"
+            )
+        for data in packets:
+            data[:header_length] = header
+        return self._number(packets)
+
+    def handle_nack(self, lost: Iterable[int]) -> List[bytearray]:
+        """
+        Return copies of the packets to resend for the lost sequence numbers still
+        in the history, with new transport-wide sequence numbers and send times so
+        that congestion control accounts for them.
+        """
+        assert self.history is not None, "RtpSender has no history"
+        template = self._template
+        abs_send_time = (current_ntp_time() >> 14) & 0x00FFFFFF
+        packets = []
+        for data in self.history.handle_nack(lost):
+            data = bytearray(data)
+            template.patch(data, RTP_HEADER_LENGTH, abs_send_time=abs_send_time)
+            self._number_transport(data)
+            packets.append(data)
+        return packets
+
+    def _number(self, packets: List[bytearray]) -> List[bytearray]:
+        for data in packets:
+            pack_into("!H", data, 2, self.sequence_number)
+            self.sequence_number = uint16_add(self.sequence_number, 1)
+            self._number_transport(data)
+        if packets:
+            packets[-1][1] |= 0x80
+        if self.history is not None:
+            for data in packets:
+                self.history.add(data)
+        return packets
+
+    def _number_transport(self, data: bytearray) -> None:
+        template = self._template
+        if template.transport_sequence_number_offset is not None:
+            template.patch(
+                data,
+                RTP_HEADER_LENGTH,
+                transport_sequence_number=self.transport_sequence_number,
+            )
+            self.transport_sequence_number = uint16_add(
+                self.transport_sequence_number, 1
+            )
+
+    def _serialize_header(self, timestamp: int) -> bytearray:
+        # per-stream values such as the mid need their own template
+        if self.extensions == HeaderExtensions():
+            self._template = self.extensions_map.template
+        else:
+            self._template = self.extensions_map.compile(self.extensions)
+
+        header = bytearray(
+            pack(
+                "!BBHLL",
+                (2 << 6) | (bool(self._template.data) << 4),
+                self.payload_type,
+                0,
+                timestamp,
+                self.ssrc,
+            )
+        )
+        header += self._template.data
+        self._template.patch(
+            header,
+            RTP_HEADER_LENGTH,
+            abs_send_time=(current_ntp_time() >> 14) & 0x00FFFFFF,
+        )
+        return header
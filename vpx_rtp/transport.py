@@ -0,0 +1,533 @@
+import asyncio
+import socket
+import time
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple, cast
+
+from av import VideoFrame
+
+from vpx_rtp.codecs.aio import AsyncVp8Decoder, AsyncVp8Encoder
+from vpx_rtp.codecs.vpx import (
+    PACKET_MAX,
+    FrameDecodabilityTracker,
+    Vp8Decoder,
+    Vp8Encoder,
+    vp8_depayload,
+    vp8_frame_start,
+)
+from vpx_rtp.jitterbuffer import JitterBuffer, JitterFrame
+from vpx_rtp.nack import NackGenerator
+from vpx_rtp.rate import RemoteBitrateEstimator, SendSideBandwidthEstimator
+from vpx_rtp.rtcp import (
+    RtcpPacket,
+    RtcpPsfbPacket,
+    RtcpRtpfbPacket,
+    pack_remb_fci,
+    parse_rtcp,
+    serialize_rtcp,
+    unpack_remb_fci,
+)
+from vpx_rtp.rtp import (
+    RTCP_PSFB_APP,
+    RTCP_PSFB_PLI,
+    RTCP_RTPFB_NACK,
+    RTCP_RTPFB_TRANSPORT_CC,
+    HeaderExtensionsMap,
+    RtpPacket,
+    RtpPacketView,
+    RtpSender,
+)
+from vpx_rtp.utils import random32, uint16_add
+
+# bytes which may leave back to back before the pacer spaces packets out
+PACER_BURST = 4 * PACKET_MAX
+
+# pace above the target bitrate so that the encoder's overshoot drains quickly
+PACING_FACTOR = 2.5
+
+# datagrams read from the socket per event loop wakeup
+RECEIVE_BATCH_SIZE = 64
+RECEIVE_BUFFER_SIZE = 65536
+
+Address = Tuple[str, int]
+
+
+def is_rtcp(data: bytes | memoryview) -> bool:
+    """
+    Whether a multiplexed datagram is RTCP rather than RTP, according to RFC 5761.
+    """
+    return len(data) >= 2 and 192 <= data[1] <= 223
+
+
+class TokenBucketPacer:
+    """
+    Spaces out packets so that they leave at `rate` bits per second, with bursts of
+    at most `burst` bytes, instead of at line rate.
+
+    `now` returns the current time in seconds and can be replaced for testing.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        burst: int = PACER_BURST,
+        now: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._now = now
+        self._tokens = float(burst)
+        self._updated = now()
+
+    def reserve(self, size: int) -> float:
+        """
+        Take `size` bytes from the bucket, and return the number of seconds to wait
+        before sending them.
+        """
+        now = self._now()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate / 8
+        )
+        self._updated = now
+        self._tokens -= size
+        return -8 * self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class RtpSendProtocol(asyncio.DatagramProtocol):
+    """
+    Encodes frames and sends them as paced RTP packets.
+
+    RTCP received on the same socket is handled: PLIs force a keyframe and NACKs
+    are answered from the :class:`RtpSender`'s history, if it has one. With an
+    :class:`AsyncVp8Encoder`, frames are encoded off the event loop.
+
+    With a `bandwidth_estimator`, and the transport-wide sequence number extension
+    in the sender's extensions map, transport-wide congestion control feedback
+    sets the encoder's target bitrate and the pacer's rate. REMBs for the stream
+    set them too, or cap them if there is a `bandwidth_estimator`.
+    """
+
+    def __init__(
+        self,
+        encoder: Vp8Encoder | AsyncVp8Encoder,
+        rtp_sender: RtpSender,
+        pacer: Optional[TokenBucketPacer] = None,
+        bandwidth_estimator: Optional[SendSideBandwidthEstimator] = None,
+    ) -> None:
+        self.encoder = encoder
+        self.rtp_sender = rtp_sender
+        self.pacer = pacer
+        self.bandwidth_estimator = bandwidth_estimator
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._force_keyframe = False
+        self._remb_bitrate: Optional[int] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        if not is_rtcp(data):
+            return
+
+        try:
+            packets = parse_rtcp(data)
+        except ValueError:
+            return
+
+        for packet in packets:
+            if isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_PLI:
+                self._force_keyframe = True
+            elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+                try:
+                    remb_bitrate, ssrcs = unpack_remb_fci(packet.fci)
+                except ValueError:
+                    continue
+                if self.rtp_sender.ssrc in ssrcs:
+                    self._remb_bitrate = remb_bitrate
+                    self._set_target_bitrate(
+                        self._remb_bitrate
+                        if self.bandwidth_estimator is None
+                        else self.bandwidth_estimator.target_bitrate
+                    )
+            elif (
+                isinstance(packet, RtcpRtpfbPacket)
+                and packet.fmt == RTCP_RTPFB_NACK
+                and self.rtp_sender.history is not None
+            ):
+                transport_sequence_number = self.rtp_sender.transport_sequence_number
+                retransmissions = self.rtp_sender.handle_nack(packet.lost)
+                for data in retransmissions:
+                    self._send(data)
+                if (
+                    self.rtp_sender.transport_sequence_number
+                    != transport_sequence_number
+                ):
+                    self._packets_sent(transport_sequence_number, retransmissions)
+            elif (
+                isinstance(packet, RtcpRtpfbPacket)
+                and packet.fmt == RTCP_RTPFB_TRANSPORT_CC
+                and packet.transport_feedback is not None
+                and self.bandwidth_estimator is not None
+            ):
+                bitrate = self.bandwidth_estimator.on_transport_feedback(
+                    packet.transport_feedback, time.monotonic() * 1000
+                )
+                if bitrate is not None:
+                    self._set_target_bitrate(bitrate)
+
+    async def send(self, frame: VideoFrame, force_keyframe: bool = False) -> None:
+        """
+        Encode a frame and send its packets, waiting as the pacer requires.
+        """
+        force_keyframe = force_keyframe or self._force_keyframe
+        self._force_keyframe = False
+        headroom = self.rtp_sender.header_length
+        if isinstance(self.encoder, AsyncVp8Encoder):
+            payloads, timestamp = await self.encoder.encode(
+                frame, force_keyframe=force_keyframe, headroom=headroom
+            )
+        else:
+            payloads, timestamp = self.encoder.encode(
+                frame, force_keyframe=force_keyframe, headroom=headroom
+            )
+
+        transport_sequence_number = self.rtp_sender.transport_sequence_number
+        packets = self.rtp_sender.write_headers(
+            cast(List[bytearray], payloads), timestamp, headroom
+        )
+        # the sender only numbers packets if the extension is negotiated
+        if self.rtp_sender.transport_sequence_number == transport_sequence_number:
+            estimator = None
+        else:
+            estimator = self.bandwidth_estimator
+
+        for data in packets:
+            if self.pacer is not None:
+                delay = self.pacer.reserve(len(data))
+                if delay:
+                    await asyncio.sleep(delay)
+            self._send(data)
+            if estimator is not None:
+                estimator.on_packet_sent(
+                    transport_sequence_number, len(data), time.monotonic() * 1000
+                )
+                transport_sequence_number = uint16_add(transport_sequence_number, 1)
+
+    def _set_target_bitrate(self, bitrate: int) -> None:
+        if self._remb_bitrate is not None:
+            bitrate = min(bitrate, self._remb_bitrate)
+        self.encoder.target_bitrate = bitrate
+        if self.pacer is not None:
+            self.pacer.rate = int(bitrate * PACING_FACTOR)
+
+    def _packets_sent(
+        self, transport_sequence_number: int, packets: List[bytearray]
+    ) -> None:
+        if self.bandwidth_estimator is None:
+            return
+        now = time.monotonic() * 1000
+        for data in packets:
+            self.bandwidth_estimator.on_packet_sent(
+                transport_sequence_number, len(data), now
+            )
+            transport_sequence_number = uint16_add(transport_sequence_number, 1)
+
+    def _send(self, data: bytes | bytearray) -> None:
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(data)
+
+
+class RtpReceiveProtocol(asyncio.DatagramProtocol):
+    """
+    Reassembles received RTP packets into frames, decodes them and puts the decoded
+    frames in :attr:`frames`. `depayload` and `frame_start` default to VP8, use
+    :func:`vp9_depayload` and :func:`vp9_frame_start` for VP9.
+
+    Datagrams are processed in batches by :meth:`datagrams_received`, after which
+    PLIs and NACKs, if a `nack_generator` is given, are sent back to the sender,
+    as are REMBs if a `remote_bitrate_estimator` is given and the extensions map
+    has abs-send-time. NACKs are also sent every retry interval of the
+    `nack_generator`, so that a stalled stream's tail is retransmitted. A given
+    `jitter_buffer` must have been created with the `nack_generator`.
+
+    With a `decodability_tracker`, frames which depend on a lost frame are not
+    decoded and PLIs are sent until a keyframe arrives. With an
+    :class:`AsyncVp8Decoder`, frames are decoded off the event loop.
+    """
+
+    def __init__(
+        self,
+        decoder: Vp8Decoder | AsyncVp8Decoder,
+        jitter_buffer: Optional[JitterBuffer] = None,
+        nack_generator: Optional[NackGenerator] = None,
+        extensions_map: HeaderExtensionsMap = HeaderExtensionsMap(),
+        depayload: Callable[[bytes | memoryview], bytes | memoryview] = vp8_depayload,
+        frame_start: Callable[[RtpPacket | RtpPacketView], bool] = vp8_frame_start,
+        ssrc: Optional[int] = None,
+        remote_bitrate_estimator: Optional[RemoteBitrateEstimator] = None,
+        decodability_tracker: Optional[FrameDecodabilityTracker] = None,
+    ) -> None:
+        assert (
+            jitter_buffer is None
+            or nack_generator is None
+            or jitter_buffer._nack is nack_generator
+        ), "nack_generator must be the jitter buffer's"
+        self.decoder = decoder
+        self.jitter_buffer = (
+            jitter_buffer
+            if jitter_buffer is not None
+            else JitterBuffer(
+                capacity=128,
+                is_video=True,
+                frame_start=frame_start,
+                nack_generator=nack_generator,
+            )
+        )
+        self.nack_generator = nack_generator
+        self.remote_bitrate_estimator = remote_bitrate_estimator
+        self.decodability_tracker = decodability_tracker
+        self.extensions_map = extensions_map
+        self.depayload = depayload
+        self.ssrc = random32() if ssrc is None else ssrc
+        self.frames: asyncio.Queue[VideoFrame] = asyncio.Queue()
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._remote_addr: Any = None
+        self._remote_ssrc = 0
+        self._decoding: Set[asyncio.Task[None]] = set()
+        self._nack_timer: Optional[asyncio.TimerHandle] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+        if self.nack_generator is not None:
+            self._schedule_nacks(self.nack_generator)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._nack_timer is not None:
+            self._nack_timer.cancel()
+            self._nack_timer = None
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        self.datagrams_received([(data, addr)])
+
+    def datagrams_received(self, datagrams: List[Tuple[bytes, Any]]) -> None:
+        pli = False
+        remb: Optional[Tuple[int, List[int]]] = None
+        for data, addr in datagrams:
+            if is_rtcp(data):
+                continue
+
+            try:
+                packet = RtpPacketView.parse(data, self.extensions_map)
+                packet._data = self.depayload(packet.payload)
+            except ValueError:
+                continue
+            self._remote_addr = addr
+            self._remote_ssrc = packet.ssrc
+            if self.decodability_tracker is not None:
+                self.decodability_tracker.add(packet)
+
+            if self.remote_bitrate_estimator is not None:
+                abs_send_time = packet.extensions.abs_send_time
+                if abs_send_time is not None:
+                    remb = (
+                        self.remote_bitrate_estimator.add(
+                            time.monotonic() * 1000,
+                            abs_send_time,
+                            len(data),
+                            packet.ssrc,
+                        )
+                        or remb
+                    )
+
+            pli_flag, encoded_frame = self.jitter_buffer.add(packet)
+            pli |= pli_flag
+            if encoded_frame is not None:
+                self._frame_received(encoded_frame)
+
+        if (
+            self.decodability_tracker is not None
+            and self.decodability_tracker.request_keyframe()
+        ):
+            pli = True
+
+        feedback: List[RtcpPacket] = []
+        if pli:
+            feedback.append(
+                RtcpPsfbPacket(
+                    fmt=RTCP_PSFB_PLI, ssrc=self.ssrc, media_ssrc=self._remote_ssrc
+                )
+            )
+        if remb is not None:
+            feedback.append(
+                RtcpPsfbPacket(
+                    fmt=RTCP_PSFB_APP,
+                    ssrc=self.ssrc,
+                    media_ssrc=0,
+                    fci=pack_remb_fci(*remb),
+                )
+            )
+        if self.nack_generator is not None:
+            feedback.extend(
+                self.nack_generator.get_nack_packets(self.ssrc, self._remote_ssrc)
+            )
+        self._send_feedback(feedback)
+
+    def _schedule_nacks(self, nack_generator: NackGenerator) -> None:
+        self._nack_timer = asyncio.get_running_loop().call_later(
+            nack_generator.retry_interval, self._send_nacks, nack_generator
+        )
+
+    def _send_nacks(self, nack_generator: NackGenerator) -> None:
+        # retransmissions are requested even if no more packets arrive
+        self._send_feedback(
+            nack_generator.get_nack_packets(self.ssrc, self._remote_ssrc)
+        )
+        if self.transport is not None and not self.transport.is_closing():
+            self._schedule_nacks(nack_generator)
+
+    def _send_feedback(self, feedback: Sequence[RtcpPacket]) -> None:
+        if (
+            feedback
+            and self.transport is not None
+            and not self.transport.is_closing()
+            and self._remote_addr is not None
+        ):
+            self.transport.sendto(serialize_rtcp(feedback), self._remote_addr)
+
+    def _frame_received(self, encoded_frame: JitterFrame) -> None:
+        if (
+            self.decodability_tracker is not None
+            and not self.decodability_tracker.decodable(encoded_frame)
+        ):
+            return
+
+        if isinstance(self.decoder, AsyncVp8Decoder):
+            # the decoder's thread completes frames in order
+            task = asyncio.ensure_future(self._decode(self.decoder, encoded_frame))
+            self._decoding.add(task)
+            task.add_done_callback(self._decoding.discard)
+        else:
+            for frame in self.decoder.decode(encoded_frame):
+                self.frames.put_nowait(frame)
+
+    async def _decode(
+        self, decoder: AsyncVp8Decoder, encoded_frame: JitterFrame
+    ) -> None:
+        for frame in await decoder.decode(encoded_frame):
+            self.frames.put_nowait(frame)
+
+
+class BatchDatagramTransport(asyncio.DatagramTransport):
+    """
+    A datagram transport which drains its socket in batches of up to
+    :data:`RECEIVE_BATCH_SIZE` datagrams per event loop wakeup, and hands them to
+    :meth:`RtpReceiveProtocol.datagrams_received` at once.
+
+    It requires an event loop supporting :meth:`~asyncio.AbstractEventLoop.add_reader`.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        sock: socket.socket,
+        protocol: RtpReceiveProtocol,
+    ) -> None:
+        super().__init__(extra={"socket": sock, "sockname": sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._closing = False
+        loop.add_reader(sock.fileno(), self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+
+    def get_protocol(self) -> asyncio.BaseProtocol:
+        return self._protocol
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def sendto(self, data: Any, addr: Any = None) -> None:
+        # feedback is small and infrequent, drop it rather than buffer it
+        try:
+            self._sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as exc:
+            self._protocol.error_received(exc)
+
+    def _read_ready(self) -> None:
+        datagrams = []
+        for _ in range(RECEIVE_BATCH_SIZE):
+            try:
+                datagrams.append(self._sock.recvfrom(RECEIVE_BUFFER_SIZE))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                break
+        if datagrams:
+            self._protocol.datagrams_received(datagrams)
+
+
+async def open_sender(
+    encoder: Vp8Encoder | AsyncVp8Encoder,
+    remote_addr: Address,
+    rtp_sender: RtpSender,
+    pacer: Optional[TokenBucketPacer] = None,
+    local_addr: Optional[Address] = None,
+    bandwidth_estimator: Optional[SendSideBandwidthEstimator] = None,
+) -> Tuple[asyncio.DatagramTransport, RtpSendProtocol]:
+    """
+    Open a UDP socket sending RTP to `remote_addr`. Unless a `pacer` is given,
+    packets are paced at a multiple of the encoder's target bitrate.
+    """
+    if pacer is None:
+        pacer = TokenBucketPacer(rate=int(encoder.target_bitrate * PACING_FACTOR))
+
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: RtpSendProtocol(
+            encoder,
+            rtp_sender=rtp_sender,
+            pacer=pacer,
+            bandwidth_estimator=bandwidth_estimator,
+        ),
+        local_addr=local_addr,
+        remote_addr=remote_addr,
+    )
+    return transport, protocol
+
+
+async def open_receiver(
+    decoder: Vp8Decoder | AsyncVp8Decoder, local_addr: Address, **kwargs: Any
+) -> Tuple[asyncio.DatagramTransport, RtpReceiveProtocol]:
+    """
+    Open a UDP socket receiving RTP on `local_addr`, drained in batches by a
+    :class:`BatchDatagramTransport`. Keyword arguments are passed to
+    :class:`RtpReceiveProtocol`.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.bind(local_addr)
+        protocol = RtpReceiveProtocol(decoder, **kwargs)
+        transport = BatchDatagramTransport(loop, sock, protocol)
+    except Exception:
+        sock.close()
+        raise
+    await asyncio.sleep(0)
+    return transport, protocol